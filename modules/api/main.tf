@@ -25,6 +25,9 @@ resource "aws_api_gateway_rest_api" "main" {
   name          = local.api_name
   description   = "REST API with extended integration timeout"
   
+  # Gzip-compressed upload bodies reach the Lambda base64 encoded instead of as UTF-8 text
+  binary_media_types = ["application/gzip"]
+  
   endpoint_configuration {
     types = ["REGIONAL"]
   }
@@ -427,6 +430,7 @@ resource "aws_api_gateway_deployment" "main" {
       aws_api_gateway_integration.auth.id,
       aws_api_gateway_integration.query.id,
       aws_api_gateway_integration.upload.id,
+      aws_api_gateway_rest_api.main.binary_media_types,
     ]))
   }
   
@@ -1,22 +1,47 @@
 import streamlit as st
 import requests
+import httpx
+import asyncio
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import orjson
 import base64
+import gzip
+import hashlib
+import io
 import os
 import time
 import logging
+import threading
+from types import MappingProxyType
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache, partial
 from datetime import datetime, timedelta
-import pandas as pd
-import plotly.graph_objects as go
-from dotenv import load_dotenv
 import re
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Load environment variables from .env file if it exists (deployed apps get them from the environment)
+if os.path.exists(".env") or os.path.exists(os.path.join(os.path.dirname(__file__), ".env")):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Set up logging (WARNING by default; set LOG_LEVEL=DEBUG to trace requests)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file if it exists
-load_dotenv()
+# pandas and plotly are only needed on a few pages, so they are imported on first use
+# rather than on every rerun of the script
+@lru_cache(maxsize=1)
+def _pandas():
+    import pandas
+    return pandas
+
+@lru_cache(maxsize=1)
+def _plotly():
+    import plotly.graph_objects
+    return plotly.graph_objects
 
 # Configuration from environment variables or defaults
 DEFAULT_API_BASE = os.getenv("API_ENDPOINT")
@@ -26,10 +51,39 @@ API_ENDPOINTS = {
     "query": os.getenv("QUERY_ENDPOINT", "/query"),
     "auth": os.getenv("AUTH_ENDPOINT", "/auth")
 }
+
+# Full endpoint URLs, rebuilt only when the base URL changes
+def set_base_url(base_url):
+    global AUTH_URL, UPLOAD_URL, QUERY_URL
+    API_ENDPOINTS["base_url"] = base_url
+    AUTH_URL = f"{base_url}{API_ENDPOINTS['auth']}"
+    UPLOAD_URL = f"{base_url}{API_ENDPOINTS['upload']}"
+    QUERY_URL = f"{base_url}{API_ENDPOINTS['query']}"
+
+set_base_url(DEFAULT_API_BASE)
+_JSON_HEADERS = MappingProxyType({"Content-Type": "application/json", "Accept": "application/json"})
+
 DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "test-user")
 DEFAULT_API_KEY = os.getenv("API_KEY", "")
 COGNITO_CLIENT_ID = os.getenv("COGNITO_CLIENT_ID", "")
 ENABLE_EVALUATION = os.getenv("ENABLE_EVALUATION", "true").lower() == "true"
+EVALUATION_METRICS = ("answer_relevancy", "faithfulness", "context_precision")
+# Send files straight to S3 via presigned URL; "false" keeps the legacy base64 JSON upload
+PRESIGNED_UPLOADS = os.getenv("PRESIGNED_UPLOADS", "true").lower() == "true"
+# Gzip the legacy JSON upload body; only enable when the API passes compressed bodies through
+GZIP_UPLOADS = os.getenv("GZIP_UPLOADS", "false").lower() == "true"
+# Chunk fields shown as document metadata, and those requested from the query API
+# (content is rendered separately and used for evaluation)
+DISPLAY_FIELDS = ("document_id", "file_name", "chunk_id", "similarity_score", "metadata")
+RESULT_FIELDS = [*DISPLAY_FIELDS, "content"]
+# Files uploaded concurrently; the HTTP pool is sized to match
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+# Seconds a successful query result is reused for an identical repeat request; 0 disables
+QUERY_RESULT_TTL = float(os.getenv("QUERY_RESULT_TTL", "5"))
+
+# Form validation patterns, built once at import
+_EMAIL_RE = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+_SPECIALS = frozenset("!@#$%^&*()_-+=<>?/|")
 # Set page config
 st.set_page_config(
     page_title="RAG Application",
@@ -38,18 +92,127 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Shared HTTP session so keep-alive reuses the TLS connection to API Gateway.
+# Cached as a resource so it survives Streamlit reruns and is shared across users.
+@st.cache_resource(show_spinner=False)
+def get_http_client():
+    session = requests.Session()
+    # Status retries only apply to idempotent methods (urllib3 default), so a
+    # POST that reached the Lambda is never replayed; connect errors are retried.
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    # One pool per host (API Gateway, S3); each keeps a connection alive for every upload
+    # worker plus the auth calls of concurrent sessions, so none is opened and thrown away
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UPLOAD_WORKERS + 16, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(_JSON_HEADERS)
+    return session
+
+class AsyncApi:
+    """HTTP/2 client for fanning out independent backend calls concurrently.
+
+    Streamlit runs the script synchronously, and a client bound to a loop made by
+    asyncio.run() would be dead on the next rerun, so the client lives on an event
+    loop kept running in a daemon thread and coroutines are submitted to it.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="api-event-loop", daemon=True).start()
+        self.client, self.semaphore = self.run(self._setup())
+        # Only touched from the API loop, so check-and-set needs no lock
+        self._inflight = {}
+        self._recent = {}
+
+    async def _setup(self):
+        # Created on the API loop so both are bound to it. The semaphore bounds
+        # in-flight requests across every session sharing this client.
+        return self._create_client(), asyncio.Semaphore(8)
+
+    def _create_client(self):
+        # The API Gateway integrations allow up to 150s, so reads must wait at least that long
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=16),
+            timeout=httpx.Timeout(180.0, connect=10.0),
+            headers=_JSON_HEADERS
+        )
+
+    def run(self, coro):
+        """Run a coroutine on the API loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def gather(self, *coros):
+        """Run coroutines concurrently and return their results in order."""
+        async def _gather():
+            return await asyncio.gather(*coros)
+        return self.run(_gather())
+
+    async def collapse(self, key, make_coro, ttl=0.0, keep=lambda result: True):
+        """Share one in-flight call per key, and reuse kept results for ttl seconds.
+
+        Identical concurrent requests (double clicks, several sessions reloading)
+        await the same task instead of each reaching the backend.
+        """
+        now = time.monotonic()
+        cached = self._recent.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = self.loop.create_task(make_coro())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done, ttl, keep))
+        # Shield so one caller giving up doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task, ttl, keep):
+        self._inflight.pop(key, None)
+        if ttl and not task.cancelled() and task.exception() is None and keep(task.result()):
+            now = time.monotonic()
+            self._recent = {k: v for k, v in self._recent.items() if v[0] > now}
+            self._recent[key] = (now + ttl, task.result())
+
+    async def post(self, url, payload, headers):
+        async with self.semaphore:
+            return await self.client.post(url, json=payload, headers=headers)
+
+    async def post_json(self, url, payload, headers):
+        """POST and decode the body once; non-JSON bodies come back as {"_text": ...}."""
+        response = await self.post(url, payload, headers)
+        try:
+            body = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            body = {"_text": response.text}
+        return response, body
+
+@st.cache_resource(show_spinner=False)
+def get_async_api():
+    return AsyncApi()
+
 # Session state initialization
 if 'user_id' not in st.session_state:
     st.session_state.user_id = DEFAULT_USER_ID
     
+# Keep only the most recent uploads so a long session doesn't grow without bound
+UPLOAD_HISTORY_LIMIT = 100
+
 if 'uploaded_docs' not in st.session_state:
-    st.session_state.uploaded_docs = []
+    st.session_state.uploaded_docs = deque(maxlen=UPLOAD_HISTORY_LIMIT)
 
 if 'api_key' not in st.session_state:
     st.session_state.api_key = DEFAULT_API_KEY
 
+# Query history is kept column-wise so each query appends to lists and the
+# DataFrame view only needs rebuilding when a row has been added
+QUERY_HISTORY_COLUMNS = ("query", "timestamp", "num_results", "has_evaluation")
+
+def empty_query_history():
+    return {column: [] for column in QUERY_HISTORY_COLUMNS}
+
 if 'query_history' not in st.session_state:
-    st.session_state.query_history = []
+    st.session_state.query_history = empty_query_history()
 
 # Authentication state
 if 'authenticated' not in st.session_state:
@@ -67,16 +230,26 @@ if 'refresh_token' not in st.session_state:
 if 'token_expiry' not in st.session_state:
     st.session_state.token_expiry = None
 
+# Monotonic deadline used for expiry checks; token_expiry keeps the wall-clock time
+if 'token_expiry_monotonic' not in st.session_state:
+    st.session_state.token_expiry_monotonic = None
+
 if 'user_email' not in st.session_state:
     st.session_state.user_email = None
 
+if 'claims' not in st.session_state:
+    st.session_state.claims = {}
+
+if 'refresh_inflight' not in st.session_state:
+    st.session_state.refresh_inflight = False
+
+# Result of this run's token check; reset on every rerun so the check runs once per run
+st.session_state.token_checked = None
+
 # Function to get headers with correct authentication token format
 def get_headers():
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Access-Control-Allow-Origin": "*"  # For CORS support
-    }
+    # Content-Type/Accept are set once on the shared session
+    headers = {}
     
     # Add authentication token if available
     if st.session_state.id_token:
@@ -88,15 +261,14 @@ def get_headers():
     elif st.session_state.api_key:
         headers["x-api-key"] = st.session_state.api_key
     
-    # Log headers for debugging (remove sensitive info in production)
-    logger.info(f"Request headers (partial): {dict((k, v[:20] + '...' if k == 'Authorization' and v else v) for k, v in headers.items())}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Authorization present: %s", "Authorization" in headers)
     
     return headers
 
 # Function to validate email format
 def is_valid_email(email):
-    pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-    return re.match(pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
 
 # Function to validate password strength
 def is_strong_password(password):
@@ -104,295 +276,219 @@ def is_strong_password(password):
     if len(password) < 8:
         return False, "Password must be at least 8 characters long."
     
-    if not any(c.isupper() for c in password):
+    # Classify characters in a single pass, stopping once every class has been seen
+    has_upper = has_lower = has_digit = has_special = False
+    for c in password:
+        has_upper |= c.isupper()
+        has_lower |= c.islower()
+        has_digit |= c.isdigit()
+        has_special |= c in _SPECIALS
+        if has_upper and has_lower and has_digit and has_special:
+            break
+    
+    if not has_upper:
         return False, "Password must contain at least one uppercase letter."
     
-    if not any(c.islower() for c in password):
+    if not has_lower:
         return False, "Password must contain at least one lowercase letter."
     
-    if not any(c.isdigit() for c in password):
+    if not has_digit:
         return False, "Password must contain at least one number."
     
-    if not any(c in "!@#$%^&*()_-+=<>?/|" for c in password):
+    if not has_special:
         return False, "Password must contain at least one special character."
     
     return True, "Password is strong."
 
-# Function to register a new user
-def register_user(email, password, name=""):
-    payload = {
-        "operation": "register",
-        "email": email,
-        "password": password,
-        "name": name
-    }
-    
-    auth_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['auth']}"
+# POST an operation to the auth endpoint and return (status_code, parsed body)
+def _auth_call(operation, **fields):
+    try:
+        response = get_http_client().post(AUTH_URL, json={"operation": operation, **fields})
+    except Exception as e:
+        logger.error("%s error: %s", operation, e)
+        return None, {"message": f"Error: {str(e)}"}
     
     try:
-        response = requests.post(
-            auth_url,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
-        
-        # Log response details for debugging
-        logger.info(f"Register response status: {response.status_code}")
-        try:
-            logger.info(f"Register response body: {response.json()}")
-        except:
-            logger.info(f"Register response text: {response.text}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            return True, result.get("message", "Registration successful.")
-        else:
-            return False, response.json().get("message", f"Error: {response.status_code}")
+        body = response.json()
+    except ValueError:
+        body = {"_text": response.text}
     
-    except Exception as e:
-        logger.error(f"Register error: {str(e)}")
-        return False, f"Error: {str(e)}"
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s -> %s %s", operation, response.status_code, body)
+    return response.status_code, body
+
+# Function to register a new user
+def register_user(email, password, name=""):
+    status, body = _auth_call("register", email=email, password=password, name=name)
+    if status == 200:
+        return True, body.get("message", "Registration successful.")
+    return False, body.get("message", f"Error: {status}")
 
 # Function to verify a user's email
 def verify_user(email, confirmation_code):
-    payload = {
-        "operation": "verify",
-        "email": email,
-        "confirmation_code": confirmation_code
-    }
-    
-    auth_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['auth']}"
-    
-    try:
-        response = requests.post(
-            auth_url,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
-        
-        # Log response details for debugging
-        logger.info(f"Verify response status: {response.status_code}")
-        try:
-            logger.info(f"Verify response body: {response.json()}")
-        except:
-            logger.info(f"Verify response text: {response.text}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            return True, result.get("message", "Verification successful.")
-        else:
-            return False, response.json().get("message", f"Error: {response.status_code}")
-    
-    except Exception as e:
-        logger.error(f"Verify error: {str(e)}")
-        return False, f"Error: {str(e)}"
+    status, body = _auth_call("verify", email=email, confirmation_code=confirmation_code)
+    if status == 200:
+        return True, body.get("message", "Verification successful.")
+    return False, body.get("message", f"Error: {status}")
+
+# Decode the claims of a JWT (the signature is verified by API Gateway, not here).
+# Raises ValueError for anything that isn't a well-formed token.
+def _decode_jwt_claims(token):
+    parts = token.split('.') if isinstance(token, str) else []
+    if len(parts) != 3:
+        raise ValueError("malformed JWT")
+    segment = parts[1] + '=' * (-len(parts[1]) % 4)
+    return orjson.loads(base64.urlsafe_b64decode(segment))
+
+# Token expiry from the exp claim, falling back to the expires_in the API returned.
+# Returns the wall-clock expiry for display and a time.monotonic() deadline for checks.
+def _token_expiry(claims, expires_in):
+    if "exp" in claims:
+        expires_in = claims["exp"] - time.time()
+    return datetime.now() + timedelta(seconds=expires_in), time.monotonic() + expires_in
 
 # Function to login a user
 def login_user(email, password):
-    payload = {
-        "operation": "login",
-        "email": email,
-        "password": password
-    }
-    
-    auth_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['auth']}"
+    status, body = _auth_call("login", email=email, password=password)
+    if status != 200:
+        return False, body.get("message", f"Error: {status}")
     
+    # Decode the ID token once; its claims give the user ID, email and expiry
+    id_token = body.get("id_token")
     try:
-        response = requests.post(
-            auth_url,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
-        
-        # Log response details for debugging
-        #logger.info(f"Login response status: {response.status_code}")
-        #try:
-        #    logger.info(f"Login response body: {response.json()}")
-        #except:
-        #    logger.info(f"Login response text: {response.text}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Extract tokens and expiry
-            access_token = result.get("access_token")
-            id_token = result.get("id_token")
-            refresh_token = result.get("refresh_token")
-            expires_in = result.get("expires_in", 3600)
-            
-            # Calculate expiry time
-            expiry_time = datetime.now() + timedelta(seconds=expires_in)
-            
-            # Extract user ID from token
-            try:
-                # Decode the JWT token to get the subject (user ID)
-                token_parts = id_token.split('.')
-                if len(token_parts) == 3:
-                    payload = json.loads(base64.b64decode(token_parts[1] + '==').decode('utf-8'))
-                    user_id = payload.get('sub')
-                    user_email = payload.get('email')
-                else:
-                    user_id = "unknown"
-                    user_email = email
-            except:
-                user_id = "unknown"
-                user_email = email
-            
-            return True, {
-                "message": result.get("message", "Login successful."),
-                "access_token": access_token,
-                "id_token": id_token,
-                "refresh_token": refresh_token,
-                "token_expiry": expiry_time,
-                "user_id": user_id,
-                "user_email": user_email
-            }
-        else:
-            return False, response.json().get("message", f"Error: {response.status_code}")
+        claims = _decode_jwt_claims(id_token)
+    except ValueError as e:
+        logger.error("Could not decode ID token: %s", e)
+        return False, f"Error: invalid ID token ({e})"
+    expiry, deadline = _token_expiry(claims, body.get("expires_in", 3600))
     
-    except Exception as e:
-        logger.error(f"Login error: {str(e)}")
-        return False, f"Error: {str(e)}"
-
-# Function to refresh tokens
-def refresh_token_func(refresh_token_value):
-    payload = {
-        "operation": "refresh_token",
-        "refresh_token": refresh_token_value
+    return True, {
+        "message": body.get("message", "Login successful."),
+        "access_token": body.get("access_token"),
+        "id_token": id_token,
+        "refresh_token": body.get("refresh_token"),
+        "token_expiry": expiry,
+        "token_expiry_monotonic": deadline,
+        "claims": claims,
+        "user_id": claims.get("sub", "unknown"),
+        "user_email": claims.get("email", email)
     }
+
+# Function to refresh tokens. The username is the ID token's cognito:username claim,
+# which the API needs to compute the SECRET_HASH when the app client has a secret.
+def refresh_token_func(refresh_token_value, username=None):
+    status, body = _auth_call("refresh_token", refresh_token=refresh_token_value, username=username)
+    if status != 200:
+        return False, body.get("message", f"Error: {status}")
     
-    auth_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['auth']}"
-    
+    id_token = body.get("id_token")
     try:
-        response = requests.post(
-            auth_url,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
-        
-        # Log response details for debugging
-        logger.info(f"Refresh token response status: {response.status_code}")
-        try:
-            logger.info(f"Refresh token response body: {response.json()}")
-        except:
-            logger.info(f"Refresh token response text: {response.text}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Extract tokens and expiry
-            access_token = result.get("access_token")
-            id_token = result.get("id_token")
-            expires_in = result.get("expires_in", 3600)
-            
-            # Calculate expiry time
-            expiry_time = datetime.now() + timedelta(seconds=expires_in)
-            
-            return True, {
-                "message": result.get("message", "Tokens refreshed successfully."),
-                "access_token": access_token,
-                "id_token": id_token,
-                "token_expiry": expiry_time
-            }
-        else:
-            return False, response.json().get("message", f"Error: {response.status_code}")
+        claims = _decode_jwt_claims(id_token)
+    except ValueError as e:
+        logger.error("Could not decode ID token: %s", e)
+        return False, f"Error: invalid ID token ({e})"
+    expiry, deadline = _token_expiry(claims, body.get("expires_in", 3600))
     
-    except Exception as e:
-        logger.error(f"Refresh token error: {str(e)}")
-        return False, f"Error: {str(e)}"
+    return True, {
+        "message": body.get("message", "Tokens refreshed successfully."),
+        "access_token": body.get("access_token"),
+        "id_token": id_token,
+        "token_expiry": expiry,
+        "token_expiry_monotonic": deadline,
+        "claims": claims
+    }
 
 # Function to initiate forgot password
 def forgot_password(email):
-    payload = {
-        "operation": "forgot_password",
-        "email": email
-    }
-    
-    auth_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['auth']}"
-    
-    try:
-        response = requests.post(
-            auth_url,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
-        
-        # Log response details for debugging
-        logger.info(f"Forgot password response status: {response.status_code}")
-        try:
-            logger.info(f"Forgot password response body: {response.json()}")
-        except:
-            logger.info(f"Forgot password response text: {response.text}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            return True, result.get("message", "Password reset initiated.")
-        else:
-            return False, response.json().get("message", f"Error: {response.status_code}")
-    
-    except Exception as e:
-        logger.error(f"Forgot password error: {str(e)}")
-        return False, f"Error: {str(e)}"
+    status, body = _auth_call("forgot_password", email=email)
+    if status == 200:
+        return True, body.get("message", "Password reset initiated.")
+    return False, body.get("message", f"Error: {status}")
 
 # Function to confirm forgot password
 def confirm_forgot_password(email, confirmation_code, new_password):
-    payload = {
-        "operation": "confirm_forgot_password",
-        "email": email,
-        "confirmation_code": confirmation_code,
-        "new_password": new_password
-    }
-    
-    auth_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['auth']}"
-    
-    try:
-        response = requests.post(
-            auth_url,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
-        
-        # Log response details for debugging
-        logger.info(f"Confirm forgot password response status: {response.status_code}")
-        try:
-            logger.info(f"Confirm forgot password response body: {response.json()}")
-        except:
-            logger.info(f"Confirm forgot password response text: {response.text}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            return True, result.get("message", "Password reset confirmed.")
-        else:
-            return False, response.json().get("message", f"Error: {response.status_code}")
-    
-    except Exception as e:
-        logger.error(f"Confirm forgot password error: {str(e)}")
-        return False, f"Error: {str(e)}"
+    status, body = _auth_call(
+        "confirm_forgot_password",
+        email=email,
+        confirmation_code=confirmation_code,
+        new_password=new_password
+    )
+    if status == 200:
+        return True, body.get("message", "Password reset confirmed.")
+    return False, body.get("message", f"Error: {status}")
 
 # Check if token needs to be refreshed
 def check_token_refresh():
-    if st.session_state.authenticated and st.session_state.token_expiry:
-        # If token expires in less than 5 minutes, refresh it
-        if st.session_state.token_expiry < datetime.now() + timedelta(minutes=5):
-            if st.session_state.refresh_token:
-                success, result = refresh_token_func(st.session_state.refresh_token)
-                if success:
-                    st.session_state.access_token = result["access_token"]
-                    st.session_state.id_token = result["id_token"]
-                    st.session_state.token_expiry = result["token_expiry"]
-                    logger.info("Token refreshed successfully")
-                    return True
-                else:
-                    # If refresh fails, log out the user
-                    logger.warning("Token refresh failed, logging out user")
-                    logout_user()
-                    return False
-            else:
-                # If no refresh token, log out the user
-                logger.warning("No refresh token available, logging out user")
-                logout_user()
+    # The sidebar and the upload/query actions all call this; only do the work once per rerun
+    if st.session_state.token_checked is not None:
+        return st.session_state.token_checked
+    st.session_state.token_checked = _refresh_token_if_needed()
+    return st.session_state.token_checked
+
+# Results of background token refreshes, keyed by the refresh token that was used.
+# Script globals are rebuilt on every rerun, so the store lives in a cached resource.
+@st.cache_resource(show_spinner=False)
+def _refresh_store():
+    return {}, threading.Lock()
+
+def _bg_refresh(refresh_token_value, username, results, lock):
+    result = refresh_token_func(refresh_token_value, username)
+    with lock:
+        results[refresh_token_value] = result
+
+def _refresh_token_if_needed():
+    if not (st.session_state.authenticated and st.session_state.token_expiry_monotonic):
+        return True
+
+    # Pick up a refresh that finished in the background since the last rerun
+    if st.session_state.refresh_inflight:
+        results, lock = _refresh_store()
+        with lock:
+            finished = results.pop(st.session_state.refresh_token, None)
+        if finished is not None:
+            st.session_state.refresh_inflight = False
+            if not _apply_refresh(*finished):
                 return False
-    return True
+
+    remaining = st.session_state.token_expiry_monotonic - time.monotonic()
+    # If token expires in less than 5 minutes, refresh it
+    if remaining >= 300:
+        return True
+
+    if not st.session_state.refresh_token:
+        # If no refresh token, log out the user
+        logger.warning("No refresh token available, logging out user")
+        logout_user()
+        return False
+
+    username = st.session_state.claims.get("cognito:username")
+    if remaining > 0:
+        # Token is still valid: refresh off the render path and use the new one next rerun
+        if not st.session_state.refresh_inflight:
+            st.session_state.refresh_inflight = True
+            threading.Thread(
+                target=_bg_refresh,
+                args=(st.session_state.refresh_token, username, *_refresh_store()),
+                daemon=True
+            ).start()
+        return True
+
+    # Token already expired, so the refresh has to complete before continuing
+    return _apply_refresh(*refresh_token_func(st.session_state.refresh_token, username))
+
+def _apply_refresh(success, result):
+    if success:
+        st.session_state.access_token = result["access_token"]
+        st.session_state.id_token = result["id_token"]
+        st.session_state.token_expiry = result["token_expiry"]
+        st.session_state.token_expiry_monotonic = result["token_expiry_monotonic"]
+        st.session_state.claims = result["claims"]
+        logger.info("Token refreshed successfully")
+        return True
+    # If refresh fails, log out the user
+    logger.warning("Token refresh failed, logging out user")
+    logout_user()
+    return False
 
 # Function to log out the user
 def logout_user():
@@ -401,8 +497,15 @@ def logout_user():
     st.session_state.id_token = None
     st.session_state.refresh_token = None
     st.session_state.token_expiry = None
+    st.session_state.token_expiry_monotonic = None
     st.session_state.user_email = None
+    st.session_state.claims = {}
+    st.session_state.auth_test_result = None
     st.session_state.user_id = DEFAULT_USER_ID
+    st.session_state.refresh_inflight = False
+
+# Seconds to reuse the API's answer when the token can't be judged from its expiry
+AUTH_TEST_TTL = 60
 
 # Function to test authentication token
 def test_auth_token():
@@ -410,16 +513,25 @@ def test_auth_token():
     if not st.session_state.authenticated:
         return False
     
+    # A token with more than a minute left is good without asking the API
+    deadline = st.session_state.token_expiry_monotonic
+    if deadline and deadline - time.monotonic() > 60:
+        return True
+    
+    # Reuse a recent answer from the API so rapid reruns don't re-hit the endpoint
+    cached = st.session_state.get("auth_test_result")
+    if cached and time.monotonic() - cached[1] < AUTH_TEST_TTL:
+        return cached[0]
+    
+    result = _test_auth_token_remote()
+    st.session_state.auth_test_result = (result, time.monotonic())
+    return result
+
+def _test_auth_token_remote():
     # Use the /auth endpoint with 'healthcheck' action
     payload = {"action": "healthcheck"}
-    auth_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['auth']}"
-    
     try:
-        response = requests.post(
-            auth_url,
-            json=payload,
-            headers=get_headers()
-        )
+        response = get_http_client().post(AUTH_URL, json=payload, headers=get_headers())
         
         # Check if response is successful (even 401 response means the auth endpoint is working)
         if response.status_code in [200, 401]:
@@ -464,6 +576,8 @@ def render_login_page():
                             st.session_state.id_token = result["id_token"]
                             st.session_state.refresh_token = result["refresh_token"]
                             st.session_state.token_expiry = result["token_expiry"]
+                            st.session_state.token_expiry_monotonic = result["token_expiry_monotonic"]
+                            st.session_state.claims = result["claims"]
                             st.session_state.user_id = result["user_id"]
                             st.session_state.user_email = result["user_email"]
                             
@@ -620,12 +734,11 @@ def render_user_sidebar():
         st.sidebar.write(f"Email: {st.session_state.user_email}")
         
         # Calculate token expiry
-        if st.session_state.token_expiry:
-            now = datetime.now()
-            expiry = st.session_state.token_expiry
+        if st.session_state.token_expiry_monotonic:
+            seconds_left = st.session_state.token_expiry_monotonic - time.monotonic()
             
-            if expiry > now:
-                minutes_left = int((expiry - now).total_seconds() / 60)
+            if seconds_left > 0:
+                minutes_left = int(seconds_left / 60)
                 if minutes_left > 60:
                     hours = minutes_left // 60
                     mins = minutes_left % 60
@@ -649,34 +762,181 @@ def render_user_sidebar():
             st.rerun()
 
 # Function to upload document
-def upload_document(file, user_id):
+# Upload worker pool, shared across reruns so concurrent uploads reuse its threads
+@st.cache_resource(show_spinner=False)
+def _executor():
+    return ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
+def upload_documents(files, user_id):
+    """Upload several files concurrently and render the outcome of each.
+
+    Returns a list of (success, result) tuples in the order of ``files``.
+    """
     # 🔐 Validate session
     if not check_token_refresh():
         st.error("Session expired. Please log in again.")
         logout_user()
         st.rerun()
-        return False, "Authentication failed."
+        return [(False, "Authentication failed.")] * len(files)
 
-    # 📦 Prepare file payload
-    payload = {
-        "file_name": file.name,
-        "mime_type": file.type or "application/octet-stream",
-        "user_id": user_id,
-        "file_content": base64.b64encode(file.getvalue()).decode()
+    # 🌐 Prepare API requests; workers must not touch session state, so resolve it here
+    headers = get_headers()
+    client = get_http_client()
+    # Workers record bytes sent per file; a plain list item store is safe across threads
+    sent = [0] * len(files)
+    total = sum(file.size for file in files) or 1
+    futures = {
+        _executor().submit(send_upload, client, file, user_id, headers, partial(sent.__setitem__, i)): file
+        for i, file in enumerate(files)
     }
 
-    # 🌐 Prepare API request
-    upload_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['upload']}"
-    headers = get_headers()
+    # Network work proceeds in the pool while the status box reports progress
+    with st.status(f"Uploading {len(files)} document(s)...", expanded=True) as status:
+        progress = st.progress(0.0)
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                status.write(f"Finished {futures[future].name}")
+            progress.progress(min(sum(sent) / total, 1.0))
+        progress.progress(1.0)
+        status.update(label="Upload finished", state="complete", expanded=False)
 
-    try:
-        response = requests.post(upload_url, json=payload, headers=headers)
-        logger.info(f"Upload response: {response.status_code}")
-        return handle_response(response, file.name, user_id)
+    results = []
+    for future, file in futures.items():
+        try:
+            response = future.result()
+            logger.info("Upload response: %s", response.status_code)
+            results.append(handle_response(response, file.name, user_id))
+        except Exception as e:
+            logger.error(f"Upload error: {e}")
+            results.append(show_error(f"Exception during upload of {file.name}", str(e)))
+    return results
+
+# Function to upload document
+def upload_document(file, user_id):
+    return upload_documents([file], user_id)[0]
+
+def send_upload(client, file, user_id, headers, on_progress=None):
+    """Send one file to the backend and return the final response (runs in a worker thread).
+
+    ``on_progress`` is called from the worker with the number of file bytes sent so far.
+    """
+    if PRESIGNED_UPLOADS:
+        return upload_presigned(client, file, user_id, headers, on_progress)
+
+    # 📦 Stream the file as base64 inside the JSON body
+    body = Base64JsonBody(
+        file,
+        on_progress=on_progress,
+        file_name=file.name,
+        mime_type=file.type or "application/octet-stream",
+        user_id=user_id
+    )
+    if GZIP_UPLOADS:
+        # Compress as the body streams out, so only the compressed bytes are held
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=1) as gz:
+            for chunk in body:
+                gz.write(chunk)
+        return client.post(
+            UPLOAD_URL,
+            data=buffer.getbuffer(),
+            # API Gateway passes application/gzip bodies through as binary
+            headers={**headers, "Content-Type": "application/gzip", "Content-Encoding": "gzip"}
+        )
+    return client.post(UPLOAD_URL, data=body, headers=headers)
+
+
+class Base64JsonBody:
+    """JSON request body that base64-encodes the file chunk by chunk as it is sent.
+
+    Only one chunk of the file is encoded at a time instead of holding the raw bytes,
+    the base64 copy and the serialized JSON in memory together. The encoded length is
+    known up front, so requests sends a Content-Length rather than chunked encoding.
+    """
+
+    # Multiple of 3 so the base64 of consecutive chunks concatenates without padding
+    CHUNK_SIZE = 48 * 1024
+
+    def __init__(self, file, on_progress=None, **fields):
+        self.file = file
+        self.on_progress = on_progress
+        self.prefix = (json.dumps(fields)[:-1] + ', "file_content": "').encode("utf-8")
+        self.suffix = b'"}'
+        with file.getbuffer() as view:
+            size = view.nbytes
+        self.length = len(self.prefix) + 4 * ((size + 2) // 3) + len(self.suffix)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # Encode straight from slices of the upload's buffer; read() would copy each chunk.
+        # Each iteration starts over, so a retried request resends the whole body.
+        yield self.prefix
+        with self.file.getbuffer() as view:
+            for start in range(0, view.nbytes, self.CHUNK_SIZE):
+                yield base64.b64encode(view[start:start + self.CHUNK_SIZE])
+                if self.on_progress:
+                    self.on_progress(min(start + self.CHUNK_SIZE, view.nbytes))
+        yield self.suffix
 
-    except Exception as e:
-        logger.error(f"Upload error: {e}")
-        return show_error("Exception during upload", str(e))
+
+class RawFileBody:
+    """Raw request body streamed from slices of the upload's buffer.
+
+    Like Base64JsonBody it has a length, so the presigned PUT carries the
+    Content-Length S3 requires, and it reports how many bytes have been sent.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, file, on_progress=None):
+        self.file = file
+        self.on_progress = on_progress
+        with file.getbuffer() as view:
+            self.length = view.nbytes
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        with self.file.getbuffer() as view:
+            for start in range(0, view.nbytes, self.CHUNK_SIZE):
+                yield view[start:start + self.CHUNK_SIZE]
+                if self.on_progress:
+                    self.on_progress(min(start + self.CHUNK_SIZE, view.nbytes))
+
+
+def upload_presigned(client, file, user_id, headers, on_progress=None):
+    """Ask the backend for a presigned S3 URL, PUT the raw file to it, then finalize.
+
+    Returns the response of the first failing step, or of the finalize call.
+    """
+    mime_type = file.type or "application/octet-stream"
+    document = {"file_name": file.name, "mime_type": mime_type, "user_id": user_id}
+
+    response = client.post(UPLOAD_URL, json={"operation": "presign", **document}, headers=headers)
+    if response.status_code != 200:
+        return response
+    meta = response.json()
+
+    # Slices of getbuffer() are views over the upload, so the bytes are not copied again
+    response = client.put(
+        meta["presigned_url"],
+        data=RawFileBody(file, on_progress),
+        headers={"Content-Type": mime_type}
+    )
+    if response.status_code != 200:
+        logger.error(f"S3 upload failed: {response.status_code}")
+        return response
+
+    return client.post(
+        UPLOAD_URL,
+        json={"operation": "finalize", "document_id": meta["document_id"], **document},
+        headers=headers
+    )
 
 
 def handle_response(response, file_name, user_id):
@@ -703,7 +963,12 @@ def handle_response(response, file_name, user_id):
         return False, "Authentication failed."
 
     else:
-        return show_error(f"Upload failed (Error {response.status_code})", response)
+        # Parse the error body once here; show_error only renders it
+        try:
+            details = response.json()
+        except ValueError:
+            details = response.text
+        return show_error(f"Upload failed (Error {response.status_code})", details)
 
 
 def show_success_tabs(file_name, document_id, timestamp, user_id, result):
@@ -729,10 +994,7 @@ def show_error(title, details):
         if isinstance(details, str):
             st.write(details)
         else:
-            try:
-                st.json(details.json())
-            except:
-                st.code(details.text)
+            st.json(details)
 
     with tab2:
         show_upload_history()
@@ -746,14 +1008,55 @@ def show_upload_history():
         st.info("No upload history available.")
         return
 
-    recent = sorted(st.session_state.uploaded_docs, key=lambda x: x.get('upload_time', ''), reverse=True)[:5]
-    df = pd.DataFrame(recent)
-    st.dataframe(df, use_container_width=True)
+    recent = heapq.nlargest(5, st.session_state.uploaded_docs, key=lambda x: x.get('upload_time', ''))
+    st.dataframe(recent, use_container_width=True)
 
     if st.button("Clear Upload History", key="clear_history_upload_func"):
-        st.session_state.uploaded_docs = []
+        st.session_state.uploaded_docs = deque(maxlen=UPLOAD_HISTORY_LIMIT)
         st.rerun()
     
+# Send a query on the shared async client; returns the response and its parsed body.
+# Runs on the API event loop, so it must not touch Streamlit state.
+# Identical payloads sent with the same credentials share a key; the token is part of
+# it so a request is never answered with a result fetched under someone else's auth
+def request_key(payload, headers):
+    material = orjson.dumps([payload, headers], option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(material, digest_size=16).hexdigest()
+
+async def query_documents_async(api, payload, headers):
+    response, result = await api.post_json(QUERY_URL, {**payload, "enable_evaluation": False}, headers)
+    if response.status_code == 200 and payload.get("enable_evaluation"):
+        result["evaluation"] = await evaluate_async(api, payload, result, headers)
+    return response, result
+
+# Score each evaluation metric in its own request so they run in parallel
+async def evaluate_async(api, payload, result, headers):
+    ground_truth = payload.get("ground_truth")
+    metrics = EVALUATION_METRICS if ground_truth else EVALUATION_METRICS[:2]
+    request = {
+        "operation": "evaluate",
+        "model_name": payload.get("model_name"),
+        "query": payload["query"],
+        "answer": result.get("response", ""),
+        "contexts": [chunk.get("content", "") for chunk in result.get("results", [])],
+        "ground_truth": ground_truth
+    }
+    
+    async def score(metric):
+        response, body = await api.post_json(QUERY_URL, {**request, "metric": metric}, headers)
+        if response.status_code != 200:
+            raise RuntimeError(body.get("message", f"Error: {response.status_code}"))
+        return body["score"]
+    
+    scores = await asyncio.gather(*(score(metric) for metric in metrics), return_exceptions=True)
+    evaluation = {}
+    for metric, value in zip(metrics, scores):
+        if isinstance(value, Exception):
+            logger.warning("Evaluation of %s failed: %s", metric, value)
+        else:
+            evaluation[metric] = value
+    return evaluation
+
 # Function to query documents
 def query_documents(selected_model, query_text, user_id, ground_truth=None, enable_evaluation=ENABLE_EVALUATION):
     # Ensure authentication is valid
@@ -768,7 +1071,8 @@ def query_documents(selected_model, query_text, user_id, ground_truth=None, enab
         "query": query_text, 
         "user_id": user_id,
         "enable_evaluation": enable_evaluation,
-        "model_name": selected_model
+        "model_name": selected_model,
+        "projection": RESULT_FIELDS
     }
     
     # Add ground truth if provided
@@ -777,55 +1081,34 @@ def query_documents(selected_model, query_text, user_id, ground_truth=None, enab
     
     # Send request to API Gateway
     try:
-        query_url = f"{API_ENDPOINTS['base_url']}{API_ENDPOINTS['query']}"
-        
-        # Log request details
-        logger.info(f"Sending query request to: {query_url}")
-        logger.info(f"Query payload: {payload}")
-        
-        # Show what's being sent
-        st.write("Sending request to:", query_url)
-        st.json(payload)
+        # Log request details; the query text itself is user data and stays out of the logs
+        logger.info(f"Sending query request to: {QUERY_URL}")
         
-        response = requests.post(
-            query_url,
-            json=payload,
-            headers=get_headers()
-        )
-        
-        # Log response details
-        logger.info(f"Query response status: {response.status_code}")
-        logger.info(f"Query response headers: {dict(response.headers)}")
-        try:
-            logger.info(f"Query response body: {response.json()}")
-        except:
-            logger.info(f"Query response text: {response.text}")
+        api = get_async_api()
+        headers = get_headers()
+        response, result = api.run(api.collapse(
+            request_key(payload, headers),
+            lambda: query_documents_async(api, payload, headers),
+            ttl=QUERY_RESULT_TTL,
+            keep=lambda outcome: outcome[0].status_code == 200
+        ))
         
-        # Display raw response for debugging
-        st.write(f"Response status code: {response.status_code}")
+        # Log response details; the body echoes the query and holds the answer, so only
+        # the number of retrieved chunks is logged
+        logger.info("Query response status: %s, results: %s",
+                    response.status_code, len(result.get("results") or []))
+        logger.debug("Query response headers: %s", response.headers)
         
         if response.status_code == 200:
-            result = response.json()
-            
             # Add to query history
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            st.session_state.query_history.append({
-                "query": query_text,
-                "timestamp": timestamp,
-                "num_results": len(result.get("results", [])),
-                "has_evaluation": "evaluation" in result and bool(result["evaluation"])
-            })
+            record_query(query_text, timestamp, len(result.get("results", [])),
+                         "evaluation" in result and bool(result["evaluation"]))
             
             return True, result
         elif response.status_code == 401:
             # Authentication failed
-            error_message = "Authentication token expired or invalid."
-            try:
-                error_data = response.json()
-                if "message" in error_data:
-                    error_message = error_data["message"]
-            except:
-                pass
+            error_message = result.get("message", "Authentication token expired or invalid.")
             
             st.warning(f"{error_message} Please log in again.")
             logout_user()
@@ -834,12 +1117,10 @@ def query_documents(selected_model, query_text, user_id, ground_truth=None, enab
         else:
             # Handle other errors without logging out
             error_message = f"Error: {response.status_code}"
-            try:
-                error_data = response.json()
-                if "message" in error_data:
-                    error_message += f" - {error_data['message']}"
-            except:
-                error_message += f" - {response.text}"
+            if "message" in result:
+                error_message += f" - {result['message']}"
+            elif "_text" in result:
+                error_message += f" - {result['_text']}"
             
             return False, error_message
     
@@ -847,9 +1128,200 @@ def query_documents(selected_model, query_text, user_id, ground_truth=None, enab
         logger.error(f"Query error: {str(e)}")
         return False, f"Error: {str(e)}"
 
+# Append one row to the columnar query history
+def record_query(query_text, timestamp, num_results, has_evaluation):
+    history = st.session_state.query_history
+    history["query"].append(query_text)
+    history["timestamp"].append(timestamp)
+    history["num_results"].append(num_results)
+    history["has_evaluation"].append(has_evaluation)
+
+# DataFrame view of the query history, rebuilt only when rows were added.
+# Kept in session state: st.cache_resource is shared by every session, and
+# hashing the history for st.cache_data would cost as much as rebuilding it.
+def query_history_frame():
+    rows = len(st.session_state.query_history["query"])
+    cached = st.session_state.get("query_history_frame")
+    if cached is None or cached[0] != rows:
+        cached = (rows, _pandas().DataFrame(st.session_state.query_history, columns=QUERY_HISTORY_COLUMNS))
+        st.session_state.query_history_frame = cached
+    return cached[1]
+
+# Send several queries in one request and score each answer in parallel
+async def query_documents_batch_async(api, payload, headers):
+    response, body = await api.post_json(QUERY_URL, {**payload, "enable_evaluation": False}, headers)
+    results = body.get("results", []) if response.status_code == 200 else []
+    if payload.get("enable_evaluation"):
+        answered = [item["data"] for item in results if item.get("status") == 200]
+        evaluations = await asyncio.gather(*(
+            evaluate_async(api, {**payload, "query": data["query"]}, data, headers) for data in answered
+        ))
+        for data, evaluation in zip(answered, evaluations):
+            data["evaluation"] = evaluation
+    return response, body
+
+# Function to query documents in a single batched request
+def query_documents_batch(selected_model, queries, user_id, enable_evaluation=ENABLE_EVALUATION):
+    # Ensure authentication is valid
+    if not check_token_refresh():
+        st.error("Your session has expired. Please log in again.")
+        logout_user()
+        st.rerun()
+        return False, "Authentication failed. Please log in again."
+    
+    payload = {
+        "queries": queries,
+        "user_id": user_id,
+        "enable_evaluation": enable_evaluation,
+        "model_name": selected_model,
+        "projection": RESULT_FIELDS
+    }
+    
+    try:
+        logger.info(f"Sending batch of {len(queries)} queries to: {QUERY_URL}")
+        
+        api = get_async_api()
+        response, body = api.run(query_documents_batch_async(api, payload, get_headers()))
+        
+        logger.info(f"Batch query response status: {response.status_code}")
+        
+        if response.status_code == 200:
+            results = body.get("results", [])
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            for query_text, item in zip(queries, results):
+                data = item.get("data", {})
+                record_query(query_text, timestamp, len(data.get("results", [])),
+                             bool(data.get("evaluation")))
+            return True, results
+        elif response.status_code == 401:
+            error_message = body.get("message", "Authentication token expired or invalid.")
+            
+            st.warning(f"{error_message} Please log in again.")
+            logout_user()
+            st.rerun()
+            return False, "Authentication failed. Please log in again."
+        else:
+            error_message = f"Error: {response.status_code}"
+            if "message" in body:
+                error_message += f" - {body['message']}"
+            elif "_text" in body:
+                error_message += f" - {body['_text']}"
+            
+            return False, error_message
+    
+    except Exception as e:
+        logger.error(f"Batch query error: {str(e)}")
+        return False, f"Error: {str(e)}"
+
+# Render a single query result as tabs
+def show_query_result(result, key="query_result"):
+    # Create tabs for different views of the results
+    if "evaluation" in result and result["evaluation"]:
+        tab1, tab2, tab3 = st.tabs(["AI Response", "Document Details", "Evaluation"])
+    else:
+        tab1, tab2 = st.tabs(["AI Response", "Document Details"])
+
+    with tab1:
+        # Display the AI-generated response
+        if "response" in result:
+            response_data = orjson.loads(result["response"])
+            st.markdown(response_data.get("answer", "No answer found."))
+        else:
+            st.info("No AI-generated response available.")
+    
+    with tab2:
+        # Display document results
+        if "results" in result and result["results"]:
+            st.markdown("### Retrieved Documents")
+            st.write(f"Found {len(result['results'])} relevant documents")
+            
+            # One virtualized table for all documents; full details only for the selected row
+            rows = []
+            for i, doc in enumerate(result["results"]):
+                score = doc.get('similarity_score')
+                rows.append({
+                    "Document": doc.get('file_name', doc.get('document_id', f'Document {i+1}')),
+                    "Relevance Score": score if isinstance(score, (int, float)) else None,
+                    "Content Preview": doc.get("content", "")[:200]
+                })
+            
+            selection = st.dataframe(
+                rows,
+                column_config={
+                    "Relevance Score": st.column_config.NumberColumn(format="%.4f")
+                },
+                hide_index=True,
+                use_container_width=True,
+                on_select="rerun",
+                selection_mode="single-row",
+                key=f"{key}_documents"
+            ).selection
+            
+            if selection.rows:
+                doc = result["results"][selection.rows[0]]
+                
+                # Two columns for metadata and content
+                col1, col2 = st.columns([1, 1])
+                
+                with col1:
+                    st.markdown("#### Document Metadata")
+                    metadata = {k: doc[k] for k in DISPLAY_FIELDS if k in doc}
+                    st.json(metadata)
+                
+                with col2:
+                    st.markdown("#### Document Content")
+                    if "content" in doc:
+                        st.write(doc["content"])
+                    else:
+                        st.info("No content available")
+            else:
+                st.caption("Select a document to see its metadata and full content.")
+        else:
+            st.info("No relevant documents found. Try a different query or upload more documents.")
+    
+    if "evaluation" in result and result["evaluation"]:
+        with tab3:
+            st.markdown("### RAG Response Evaluation")
+            
+            eval_results = result["evaluation"]
+            
+            # Display metrics
+            metrics_cols = st.columns(len(eval_results))
+            for i, (metric, value) in enumerate(eval_results.items()):
+                with metrics_cols[i]:
+                    # Format metric name for display
+                    display_name = " ".join(word.capitalize() for word in metric.split("_"))
+                    st.metric(display_name, f"{value:.2f}")
+            
+            # Display evaluation chart
+            chart = create_evaluation_chart(eval_results)
+            st.plotly_chart(chart, use_container_width=True)
+            
+            # Explain metrics
+            with st.expander("Understanding Evaluation Metrics"):
+                st.markdown("""
+                ### RAG Evaluation Metrics Explained
+                
+                - **Answer Relevancy (0-1)**: Measures how directly the answer addresses the question.
+                
+                - **Faithfulness (0-1)**: Measures how factually accurate the answer is based only on the provided context.
+                
+                - **Context Precision (0-1)**: When ground truth is provided, measures how well the answer aligns with the known correct answer.
+                
+                A higher score indicates better performance. Scores above 0.7 are generally considered good.
+                """)
+
 # Function to create evaluation chart
 def create_evaluation_chart(eval_results):
     """Create a visualization for RAG evaluation metrics"""
+    # A tuple hashes cheaply; items stay in metric order so the bars keep their order
+    return _evaluation_chart(tuple(eval_results.items()))
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _evaluation_chart(eval_items):
+    go = _plotly()
+    eval_results = dict(eval_items)
+    
     # Define friendly metric names
     metric_names = {
         "answer_relevancy": "Answer Relevancy",
@@ -900,7 +1372,7 @@ def render_sidebar():
         with st.sidebar.expander("⚙️ API Settings", expanded=False):
             new_url = st.text_input("Base API URL", value=API_ENDPOINTS["base_url"])
             if st.button("Save Settings"):
-                API_ENDPOINTS["base_url"] = new_url
+                set_base_url(new_url)
                 st.success("✅ Settings saved for this session.")
         selected_model = st.selectbox(
             "Select Model",
@@ -936,10 +1408,11 @@ def main():
     if page == "Upload Documents":
         st.header("Upload Documents")
         # File uploader with multiple file types
-        uploaded_file = st.file_uploader(
-            "Choose a file to upload", 
+        uploaded_files = st.file_uploader(
+            "Choose files to upload", 
             type=["pdf", "txt", "docx", "doc", "csv", "xlsx", "json", "md"],
-            help="Select a document to upload. Supported formats include PDF, text, Word documents, spreadsheets, and more."
+            accept_multiple_files=True,
+            help="Select one or more documents to upload. Supported formats include PDF, text, Word documents, spreadsheets, and more."
         )
         
         col1, col2 = st.columns(2)
@@ -957,33 +1430,38 @@ def main():
             upload_status = st.empty()
             upload_status.info("No file selected yet")
         
-        if uploaded_file is not None:
+        if uploaded_files:
             # Update status
-            upload_status.info("File selected, ready to upload")
+            upload_status.info(f"{len(uploaded_files)} file(s) selected, ready to upload")
             
             st.write("File Details:")
-            file_details = {
-                "Filename": uploaded_file.name,
-                "File size": f"{uploaded_file.size / 1024:.2f} KB",
-                "MIME type": uploaded_file.type or "application/octet-stream"
-            }
+            file_details = [
+                {
+                    "Filename": uploaded_file.name,
+                    "File size": f"{uploaded_file.size / 1024:.2f} KB",
+                    "MIME type": uploaded_file.type or "application/octet-stream"
+                }
+                for uploaded_file in uploaded_files
+            ]
             st.json(file_details)
             
             # Upload button with user confirmation
             st.write("Ready to upload?")
-            if st.button("Upload Document"):
+            if st.button("Upload Documents"):
                 upload_status.warning("Uploading in progress...")
                 
-                with st.spinner("Uploading document..."):
-                    success, result = upload_document(uploaded_file, upload_user_id)
-                    
+                results = upload_documents(uploaded_files, upload_user_id)
+                
+                for uploaded_file, (success, result) in zip(uploaded_files, results):
                     if success:
-                        upload_status.success("Upload complete!")
-                        st.success(f"Document uploaded successfully! Document ID: {result.get('document_id')}")
-                        
+                        st.success(f"{uploaded_file.name} uploaded successfully! Document ID: {result.get('document_id')}")
                     else:
-                        upload_status.error("Upload failed!")
-                        st.error(result)
+                        st.error(f"{uploaded_file.name}: {result}")
+                
+                if all(success for success, _ in results):
+                    upload_status.success("Upload complete!")
+                else:
+                    upload_status.error("Upload failed!")
 
     # Query Documents Page
     elif page == "Query Documents":
@@ -1000,20 +1478,30 @@ def main():
             
             st.info("RAG evaluation uses Gemini to assess the quality of responses based on retrieved context.")
     
+        batch_mode = st.toggle("Batch Mode", value=False,
+                               help="Submit several questions, one per line, in a single request")
+    
         # Two column layout for query input
         col1, col2 = st.columns([3, 1])
         
         with col1:
             # Query input with placeholder
-            query = st.text_area(
-                "Enter your question:",
-                placeholder="e.g., What are the key points in the latest financial report?",
-                height=100
-            )
+            if batch_mode:
+                query = st.text_area(
+                    "Enter your questions, one per line:",
+                    placeholder="e.g., What are the key points in the latest financial report?\nWho are the main competitors?",
+                    height=150
+                )
+            else:
+                query = st.text_area(
+                    "Enter your question:",
+                    placeholder="e.g., What are the key points in the latest financial report?",
+                    height=100
+                )
             
             # Ground truth input if enabled
             ground_truth = None
-            if use_ground_truth:
+            if use_ground_truth and not batch_mode:
                 ground_truth = st.text_area(
                     "Ground Truth Answer (optional):",
                     placeholder="Enter the correct answer for evaluation purposes.",
@@ -1032,14 +1520,33 @@ def main():
             submit_button = st.button("Submit Query", use_container_width=True)
             
             # Clear results button
-            if 'last_query_result' in st.session_state:
+            if 'last_query_result' in st.session_state or 'last_batch_results' in st.session_state:
                 clear_button = st.button("Clear Results", use_container_width=True)
                 if clear_button:
-                    del st.session_state.last_query_result
+                    st.session_state.pop('last_query_result', None)
+                    st.session_state.pop('last_batch_results', None)
                     st.rerun()
         
         # Execute query when submit button is clicked
-        if submit_button:
+        if submit_button and batch_mode:
+            queries = [line.strip() for line in query.splitlines() if line.strip()]
+            if not queries:
+                st.warning("Please enter at least one question.")
+            else:
+                with st.spinner(f"Processing {len(queries)} queries..."):
+                    success, result = query_documents_batch(
+                        selected_model,
+                        queries,
+                        query_user_id,
+                        enable_evaluation=enable_evaluation
+                    )
+                    
+                    if success:
+                        st.session_state.pop('last_query_result', None)
+                        st.session_state.last_batch_results = (queries, result)
+                    else:
+                        st.error(result)
+        elif submit_button:
             if not query:
                 st.warning("Please enter a question.")
             else:
@@ -1054,98 +1561,33 @@ def main():
                     
                     # Store result in session state
                     if success:
+                        st.session_state.pop('last_batch_results', None)
                         st.session_state.last_query_result = result
         
         # Display query results if available
         if 'last_query_result' in st.session_state:
-            result = st.session_state.last_query_result
-    
-            # Create tabs for different views of the results
-            if "evaluation" in result and result["evaluation"]:
-                tab1, tab2, tab3 = st.tabs(["AI Response", "Document Details", "Evaluation"])
-            else:
-                tab1, tab2 = st.tabs(["AI Response", "Document Details"])
-        
-            with tab1:
-                # Display the AI-generated response
-                if "response" in result:
-                    response_data = json.loads(result["response"])
-                    st.markdown(response_data.get("answer", "No answer found."))
-                else:
-                    st.info("No AI-generated response available.")
-            
-            with tab2:
-                # Display document results
-                if "results" in result and result["results"]:
-                    st.markdown("### Retrieved Documents")
-                    st.write(f"Found {len(result['results'])} relevant documents")
-                    
-                    # Create expandable sections for each document
-                    for i, doc in enumerate(result["results"]):
-                        score = doc.get('similarity_score', 0)
-                        score_display = f"{score:.4f}" if isinstance(score, (int, float)) else "N/A"
-                        doc_name = doc.get('file_name', doc.get('document_id', f'Document {i+1}'))
-                        
-                        with st.expander(f"{doc_name} - Relevance Score: {score_display}"):
-                            # Two columns for metadata and content
-                            col1, col2 = st.columns([1, 1])
-                            
-                            with col1:
-                                st.markdown("#### Document Metadata")
-                                # Filter out large fields like vectors
-                                metadata = {k: v for k, v in doc.items() 
-                                           if k not in ['embedding_vector'] and not isinstance(v, list) or len(v) < 100}
-                                st.json(metadata)
-                            
-                            with col2:
-                                st.markdown("#### Document Content")
-                                if "content" in doc:
-                                    st.write(doc["content"])
-                                else:
-                                    st.info("No content available")
-                else:
-                    st.info("No relevant documents found. Try a different query or upload more documents.")
-            
-            if "evaluation" in result and result["evaluation"]:
-                with tab3:
-                    st.markdown("### RAG Response Evaluation")
-                    
-                    eval_results = result["evaluation"]
-                    
-                    # Display metrics
-                    metrics_cols = st.columns(len(eval_results))
-                    for i, (metric, value) in enumerate(eval_results.items()):
-                        with metrics_cols[i]:
-                            # Format metric name for display
-                            display_name = " ".join(word.capitalize() for word in metric.split("_"))
-                            st.metric(display_name, f"{value:.2f}")
-                    
-                    # Display evaluation chart
-                    chart = create_evaluation_chart(eval_results)
-                    st.plotly_chart(chart, use_container_width=True)
-                    
-                    # Explain metrics
-                    with st.expander("Understanding Evaluation Metrics"):
-                        st.markdown("""
-                        ### RAG Evaluation Metrics Explained
-                        
-                        - **Answer Relevancy (0-1)**: Measures how directly the answer addresses the question.
-                        
-                        - **Faithfulness (0-1)**: Measures how factually accurate the answer is based only on the provided context.
-                        
-                        - **Context Precision (0-1)**: When ground truth is provided, measures how well the answer aligns with the known correct answer.
-                        
-                        A higher score indicates better performance. Scores above 0.7 are generally considered good.
-                        """)
+            show_query_result(st.session_state.last_query_result)
+
+        # Display batch results, one tab per query in submission order
+        if 'last_batch_results' in st.session_state:
+            queries, results = st.session_state.last_batch_results
+            tabs = st.tabs([f"Q{i + 1}" for i in range(len(queries))])
+            for i, (tab, query_text, item) in enumerate(zip(tabs, queries, results)):
+                with tab:
+                    st.markdown(f"**{query_text}**")
+                    if item.get("status") == 200:
+                        show_query_result(item["data"], key=f"batch_result_{i}")
+                    else:
+                        st.error(item.get("error", f"Error: {item.get('status')}"))
 
         # Display query history
         with st.expander("Query History", expanded=False):
-            if st.session_state.query_history:
-                df = pd.DataFrame(st.session_state.query_history)
-                st.dataframe(df)
+            if st.session_state.query_history["query"]:
+                st.dataframe(query_history_frame())
                 
                 if st.button("Clear Query History"):
-                    st.session_state.query_history = []
+                    st.session_state.query_history = empty_query_history()
+                    st.session_state.pop("query_history_frame", None)
                     st.rerun()
             else:
                 st.info("No query history available.")
@@ -1182,7 +1624,7 @@ def main():
             st.subheader(f"Documents for User: {view_user_id}")
             
             # Create a nicer display using a DataFrame
-            df = pd.DataFrame(st.session_state.filtered_docs)
+            df = _pandas().DataFrame(st.session_state.filtered_docs)
             
             # Add styling
             st.dataframe(
@@ -2,25 +2,140 @@
 Lambda function to handle authentication operations.
 """
 import os
-import json
-import boto3
+import botocore.session
 import logging
+import time
+import orjson
+from botocore.config import Config
 import hmac
 import hashlib
 import base64
-from datetime import datetime
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-cognito = boto3.client('cognito-idp')
+# Initialize AWS clients once per container. Keep-alive lets warm invocations reuse
+# the pooled TLS connection, and tight timeouts fail fast instead of hanging the API call.
+# The client comes straight from botocore, which skips importing boto3 on cold start.
+cognito = botocore.session.get_session().create_client('cognito-idp', config=Config(
+    connect_timeout=2,
+    read_timeout=5,
+    retries={'max_attempts': 2, 'mode': 'standard'},
+    tcp_keepalive=True,
+    max_pool_connections=10
+))
+
+# Cognito error classes, resolved once instead of through the client's exception factory
+UsernameExistsException = cognito.exceptions.UsernameExistsException
+InvalidPasswordException = cognito.exceptions.InvalidPasswordException
+CodeMismatchException = cognito.exceptions.CodeMismatchException
+ExpiredCodeException = cognito.exceptions.ExpiredCodeException
+UserNotConfirmedException = cognito.exceptions.UserNotConfirmedException
+NotAuthorizedException = cognito.exceptions.NotAuthorizedException
+UserNotFoundException = cognito.exceptions.UserNotFoundException
 
 # Get environment variables
 USER_POOL_ID = os.environ.get('USER_POOL_ID')
 CLIENT_ID = os.environ.get('CLIENT_ID')
 
+# Worker threads for Cognito calls that can overlap within one request. A container
+# serves one invocation at a time, so this is the only concurrency available; botocore
+# releases the GIL while waiting on the network, which makes threads sufficient here.
+_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# Optional app client secret. Clients created with a secret require a SECRET_HASH of
+# username + client id on every call; the keyed HMAC is set up once and copied per call.
+CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
+_HMAC_TEMPLATE = hmac.new(CLIENT_SECRET.encode(), digestmod=hashlib.sha256) if CLIENT_SECRET else None
+
+def _secret_hash_param(username, name='SecretHash'):
+    """Return {name: SECRET_HASH} for the username, or {} when no client secret is set."""
+    if _HMAC_TEMPLATE is None or not username:
+        return {}
+    digest = _HMAC_TEMPLATE.copy()
+    digest.update((username + CLIENT_ID).encode())
+    return {name: base64.b64encode(digest.digest()).decode()}
+
+# Tokens from recent refreshes, keyed by the SHA-256 of the refresh token:
+# {digest: (monotonic expiry, (access_token, id_token))}. Entries are only reused
+# while more than REFRESH_CACHE_MARGIN seconds remain. The UI refreshes once its
+# token has under 300 seconds left, so the margin must stay below that for repeat
+# refreshes in that window to be answered from the cache.
+REFRESH_CACHE_SIZE = 512
+REFRESH_CACHE_MARGIN = int(os.environ.get('REFRESH_CACHE_MARGIN', '60'))
+_refresh_cache = {}
+
+# Recently rejected logins, {email: {sha256(email + password): monotonic expiry}}.
+# Credential stuffing retries the same pairs, and each repeat would otherwise cost a
+# Cognito call. Grouping by email lets a password reset clear only that user's entries.
+BAD_LOGIN_TTL = int(os.environ.get('BAD_LOGIN_TTL', '60'))
+BAD_LOGIN_CACHE_SIZE = 10000  # emails
+BAD_LOGINS_PER_USER = 16
+_bad_logins = {}
+
+def _is_bad_login(email, login_key):
+    rejected = _bad_logins.get(email)
+    return rejected is not None and rejected.get(login_key, 0) > time.monotonic()
+
+def _remember_bad_login(email, login_key):
+    now = time.monotonic()
+    rejected = _bad_logins.get(email)
+    if rejected is None:
+        if len(_bad_logins) >= BAD_LOGIN_CACHE_SIZE:
+            for key in [k for k, entries in _bad_logins.items() if max(entries.values()) <= now]:
+                del _bad_logins[key]
+            # Still full of live entries: drop the oldest, dicts keep insertion order
+            if len(_bad_logins) >= BAD_LOGIN_CACHE_SIZE:
+                del _bad_logins[next(iter(_bad_logins))]
+        rejected = _bad_logins[email] = {}
+    elif login_key not in rejected and len(rejected) >= BAD_LOGINS_PER_USER:
+        del rejected[next(iter(rejected))]
+    rejected[login_key] = now + BAD_LOGIN_TTL
+
+# Cheap local checks that reject malformed input before it costs a Cognito call.
+# The minimum length mirrors the user pool's password policy.
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+PASSWORD_MIN_LENGTH = int(os.environ.get('PASSWORD_MIN_LENGTH', '8'))
+
+# Headers shared by every response
+HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+
+def _resp(status, message, **extra):
+    """Build an API Gateway proxy response with a JSON body of message plus extra fields."""
+    return {
+        'statusCode': status,
+        'headers': HEADERS,
+        'body': orjson.dumps({'message': message, **extra}).decode()
+    }
+
+HEALTH_RESPONSE = _resp(200, 'Authentication service is healthy')
+
+# Responses for fixed-message errors, built once and returned as-is. Plain dicts,
+# since the Lambda runtime must serialize them; they must never be mutated.
+ERR_OPERATION_REQUIRED = _resp(400, 'Operation is required')
+ERR_INVALID_EMAIL = _resp(400, 'Email address is not valid')
+ERR_PASSWORD_TOO_SHORT = _resp(400, f'Password must be at least {PASSWORD_MIN_LENGTH} characters long')
+ERR_EMAIL_PASSWORD_REQUIRED = _resp(400, 'Email and password are required')
+ERR_USER_EXISTS = _resp(400, 'User with this email already exists.')
+ERR_EMAIL_CODE_REQUIRED = _resp(400, 'Email and confirmation code are required')
+ERR_INVALID_VERIFICATION_CODE = _resp(400, 'Invalid verification code.')
+ERR_EXPIRED_VERIFICATION_CODE = _resp(400, 'Verification code has expired.')
+ERR_USER_NOT_CONFIRMED = _resp(400, 'User is not confirmed. Please verify your email first.', error_code='UserNotConfirmed')
+ERR_INCORRECT_CREDENTIALS = _resp(401, 'Incorrect username or password.')
+ERR_EMAIL_REQUIRED = _resp(400, 'Email is required')
+ERR_RESET_FIELDS_REQUIRED = _resp(400, 'Email, confirmation code, and new password are required')
+ERR_INVALID_CONFIRMATION_CODE = _resp(400, 'Invalid confirmation code.')
+ERR_EXPIRED_CONFIRMATION_CODE = _resp(400, 'Confirmation code has expired.')
+ERR_REFRESH_TOKEN_REQUIRED = _resp(400, 'Refresh token is required')
+ERR_USERNAME_REQUIRED = _resp(400, 'Username is required to refresh tokens')
+ERR_INVALID_REFRESH_TOKEN = _resp(401, 'Refresh token is invalid or expired.')
+
 def handler(event, context):
     """
     Lambda function to handle authentication operations.
@@ -40,85 +155,49 @@ def handler(event, context):
     Returns:
         dict: Response with status code and body
     """
-    logger.info(f"Received event: {json.dumps(event)}")
+    # Warmer pings and direct health checks are answered before any other work
+    if event.get('action') == 'healthcheck' or (event.get('path') or '').endswith('/health'):
+        return HEALTH_RESPONSE
+    
+    # The event carries passwords and tokens, so it is only logged when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received event: %s", event)
     
     try:
-        # Extract body from the request for API Gateway calls
-        body = {}
-        if 'body' in event:
-            if isinstance(event.get('body'), str) and event.get('body'):
-                try:
-                    body = json.loads(event['body'])
-                except json.JSONDecodeError:
-                    body = {}
-            elif isinstance(event.get('body'), dict):
-                body = event.get('body')
+        # Extract body from the request: a dict from direct invocations,
+        # a JSON string (or bytes) from API Gateway
+        raw_body = event.get('body')
+        if isinstance(raw_body, dict):
+            body = raw_body
+        elif isinstance(raw_body, (str, bytes)) and raw_body:
+            try:
+                body = orjson.loads(raw_body)
+            except orjson.JSONDecodeError:
+                body = {}
+        else:
+            body = {}
                 
-        # Check if this is a health check request
-        if event.get('action') == 'healthcheck' or body.get('action') == 'healthcheck':
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'message': 'Authentication service is healthy'
-                })
-            }
+        # Health check sent through API Gateway in the request body
+        if body.get('action') == 'healthcheck':
+            return HEALTH_RESPONSE
         
         # Get operation type
         operation = body.get('operation')
+        logger.info("Auth request: operation=%s request_id=%s",
+                    operation, (event.get('requestContext') or {}).get('requestId'))
         
         if not operation:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'message': 'Operation is required'
-                })
-            }
+            return ERR_OPERATION_REQUIRED
         
         # Handle different operations
-        if operation == 'register':
-            return register_user(body)
-        elif operation == 'login':
-            return login_user(body)
-        elif operation == 'verify':
-            return verify_user(body)
-        elif operation == 'forgot_password':
-            return forgot_password(body)
-        elif operation == 'confirm_forgot_password':
-            return confirm_forgot_password(body)
-        elif operation == 'refresh_token':
-            return refresh_token(body)
-        else:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'message': f'Unknown operation: {operation}'
-                })
-            }
+        operation_handler = OPERATIONS.get(operation)
+        if operation_handler is None:
+            return _resp(400, f'Unknown operation: {operation}')
+        return operation_handler(body)
             
     except Exception as e:
         logger.error(f"Error processing authentication: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f"Error processing authentication: {str(e)}"
-            })
-        }
+        return _resp(500, f"Error processing authentication: {str(e)}")
 
 def register_user(params):
     """
@@ -135,16 +214,11 @@ def register_user(params):
     name = params.get('name', '')
     
     if not email or not password:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Email and password are required'
-            })
-        }
+        return ERR_EMAIL_PASSWORD_REQUIRED
+    if not EMAIL_RE.match(email):
+        return ERR_INVALID_EMAIL
+    if len(password) < PASSWORD_MIN_LENGTH:
+        return ERR_PASSWORD_TOO_SHORT
     
     try:
         # User attributes
@@ -166,57 +240,22 @@ def register_user(params):
             ClientId=CLIENT_ID,
             Username=email,
             Password=password,
-            UserAttributes=user_attributes
+            UserAttributes=user_attributes,
+            **_secret_hash_param(email)
         )
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'User registered successfully. Please check your email for verification code.',
-                'user_id': response['UserSub']
-            })
-        }
-        
-    except cognito.exceptions.UsernameExistsException:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'User with this email already exists.'
-            })
-        }
-        
-    except cognito.exceptions.InvalidPasswordException as e:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': str(e)
-            })
-        }
+        return _resp(200, 'User registered successfully. Please check your email for verification code.',
+                     user_id=response['UserSub'])
+        
+    except UsernameExistsException:
+        return ERR_USER_EXISTS
+        
+    except InvalidPasswordException as e:
+        return _resp(400, str(e))
         
     except Exception as e:
         logger.error(f"Error registering user: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f"Error registering user: {str(e)}"
-            })
-        }
+        return _resp(500, f"Error registering user: {str(e)}")
 
 def verify_user(params):
     """
@@ -232,79 +271,40 @@ def verify_user(params):
     confirmation_code = params.get('confirmation_code')
     
     if not email or not confirmation_code:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Email and confirmation code are required'
-            })
-        }
+        return ERR_EMAIL_CODE_REQUIRED
+    if not EMAIL_RE.match(email):
+        return ERR_INVALID_EMAIL
     
     try:
         # Confirm sign up
         cognito.confirm_sign_up(
             ClientId=CLIENT_ID,
             Username=email,
-            ConfirmationCode=confirmation_code
+            ConfirmationCode=confirmation_code,
+            **_secret_hash_param(email)
         )
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'User verified successfully.'
-            })
-        }
-        
-    except cognito.exceptions.CodeMismatchException:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Invalid verification code.'
-            })
-        }
-        
-    except cognito.exceptions.ExpiredCodeException:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Verification code has expired.'
-            })
-        }
+        return _resp(200, 'User verified successfully.')
+        
+    except CodeMismatchException:
+        return ERR_INVALID_VERIFICATION_CODE
+        
+    except ExpiredCodeException:
+        return ERR_EXPIRED_VERIFICATION_CODE
         
     except Exception as e:
         logger.error(f"Error verifying user: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f"Error verifying user: {str(e)}"
-            })
-        }
+        return _resp(500, f"Error verifying user: {str(e)}")
 
 def login_user(params):
     """
     Authenticate a user and return tokens.
     
+    When ``include_profile`` is set, the user's attributes are fetched alongside
+    authentication and returned as ``profile``.
+    
     Args:
-        params (dict): Parameters including email and password
+        params (dict): Parameters including email, password and optional include_profile
         
     Returns:
         dict: Response with status code and body
@@ -313,16 +313,20 @@ def login_user(params):
     password = params.get('password')
     
     if not email or not password:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Email and password are required'
-            })
-        }
+        return ERR_EMAIL_PASSWORD_REQUIRED
+    if not EMAIL_RE.match(email):
+        return ERR_INVALID_EMAIL
+    
+    # Repeats of a recently rejected email/password pair are refused without calling Cognito
+    login_key = hashlib.sha256(f'{email}\x00{password}'.encode()).digest()
+    if _is_bad_login(email, login_key):
+        return ERR_INCORRECT_CREDENTIALS
+    
+    # Fetch the profile in parallel with authentication; it is only returned once
+    # the password has been accepted
+    profile_future = None
+    if params.get('include_profile'):
+        profile_future = _EXECUTOR.submit(cognito.admin_get_user, UserPoolId=USER_POOL_ID, Username=email)
     
     try:
         # Authenticate user
@@ -331,7 +335,8 @@ def login_user(params):
             AuthFlow='USER_PASSWORD_AUTH',
             AuthParameters={
                 'USERNAME': email,
-                'PASSWORD': password
+                'PASSWORD': password,
+                **_secret_hash_param(email, 'SECRET_HASH')
             }
         )
         
@@ -342,59 +347,33 @@ def login_user(params):
         refresh_token = auth_result.get('RefreshToken')
         expires_in = auth_result.get('ExpiresIn', 3600)
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Login successful.',
-                'access_token': access_token,
-                'id_token': id_token,
-                'refresh_token': refresh_token,
-                'expires_in': expires_in,
-                'token_type': 'Bearer'
-            })
-        }
-        
-    except cognito.exceptions.UserNotConfirmedException:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'User is not confirmed. Please verify your email first.',
-                'error_code': 'UserNotConfirmed'
-            })
-        }
-        
-    except cognito.exceptions.NotAuthorizedException:
-        return {
-            'statusCode': 401,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Incorrect username or password.'
-            })
-        }
+        extra = {}
+        if profile_future is not None:
+            try:
+                user = profile_future.result()
+                extra['profile'] = {attr['Name']: attr['Value'] for attr in user.get('UserAttributes', [])}
+            except Exception as e:
+                # The login itself succeeded, so a missing profile is not an error
+                logger.warning(f"Error fetching user profile: {str(e)}")
+        
+        return _resp(200, 'Login successful.',
+                     access_token=access_token,
+                     id_token=id_token,
+                     refresh_token=refresh_token,
+                     expires_in=expires_in,
+                     token_type='Bearer',
+                     **extra)
+        
+    except UserNotConfirmedException:
+        return ERR_USER_NOT_CONFIRMED
+        
+    except NotAuthorizedException:
+        _remember_bad_login(email, login_key)
+        return ERR_INCORRECT_CREDENTIALS
         
     except Exception as e:
         logger.error(f"Error logging in user: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f"Error logging in user: {str(e)}"
-            })
-        }
+        return _resp(500, f"Error logging in user: {str(e)}")
 
 def forgot_password(params):
     """
@@ -409,60 +388,27 @@ def forgot_password(params):
     email = params.get('email')
     
     if not email:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Email is required'
-            })
-        }
+        return ERR_EMAIL_REQUIRED
+    if not EMAIL_RE.match(email):
+        return ERR_INVALID_EMAIL
     
     try:
         # Initiate forgot password
         cognito.forgot_password(
             ClientId=CLIENT_ID,
-            Username=email
+            Username=email,
+            **_secret_hash_param(email)
         )
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Password reset initiated. Please check your email for the confirmation code.'
-            })
-        }
+        return _resp(200, 'Password reset initiated. Please check your email for the confirmation code.')
         
-    except cognito.exceptions.UserNotFoundException:
+    except UserNotFoundException:
         # For security reasons, still return a success message
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'If a user with this email exists, a password reset code has been sent.'
-            })
-        }
+        return _resp(200, 'If a user with this email exists, a password reset code has been sent.')
         
     except Exception as e:
         logger.error(f"Error initiating forgot password: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f"Error initiating forgot password: {str(e)}"
-            })
-        }
+        return _resp(500, f"Error initiating forgot password: {str(e)}")
 
 def confirm_forgot_password(params):
     """
@@ -479,16 +425,11 @@ def confirm_forgot_password(params):
     new_password = params.get('new_password')
     
     if not email or not confirmation_code or not new_password:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Email, confirmation code, and new password are required'
-            })
-        }
+        return ERR_RESET_FIELDS_REQUIRED
+    if not EMAIL_RE.match(email):
+        return ERR_INVALID_EMAIL
+    if len(new_password) < PASSWORD_MIN_LENGTH:
+        return ERR_PASSWORD_TOO_SHORT
     
     try:
         # Confirm forgot password
@@ -496,75 +437,35 @@ def confirm_forgot_password(params):
             ClientId=CLIENT_ID,
             Username=email,
             ConfirmationCode=confirmation_code,
-            Password=new_password
+            Password=new_password,
+            **_secret_hash_param(email)
         )
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Password has been reset successfully.'
-            })
-        }
-        
-    except cognito.exceptions.CodeMismatchException:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Invalid confirmation code.'
-            })
-        }
-        
-    except cognito.exceptions.ExpiredCodeException:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Confirmation code has expired.'
-            })
-        }
-        
-    except cognito.exceptions.InvalidPasswordException as e:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': str(e)
-            })
-        }
+        # The new password may be one that was recently rejected for this user
+        _bad_logins.pop(email, None)
+        
+        return _resp(200, 'Password has been reset successfully.')
+        
+    except CodeMismatchException:
+        return ERR_INVALID_CONFIRMATION_CODE
+        
+    except ExpiredCodeException:
+        return ERR_EXPIRED_CONFIRMATION_CODE
+        
+    except InvalidPasswordException as e:
+        return _resp(400, str(e))
         
     except Exception as e:
         logger.error(f"Error confirming forgot password: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f"Error confirming forgot password: {str(e)}"
-            })
-        }
+        return _resp(500, f"Error confirming forgot password: {str(e)}")
 
 def refresh_token(params):
     """
     Get new tokens using a refresh token.
     
     Args:
-        params (dict): Parameters including refresh_token
+        params (dict): Parameters including refresh_token, and username (the ID token's
+            cognito:username claim) when the app client has a secret
         
     Returns:
         dict: Response with status code and body
@@ -572,16 +473,24 @@ def refresh_token(params):
     refresh_token = params.get('refresh_token')
     
     if not refresh_token:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Refresh token is required'
-            })
-        }
+        return ERR_REFRESH_TOKEN_REQUIRED
+    # The SECRET_HASH for a refresh is computed over the Cognito username, and the
+    # refresh token is opaque, so only the client can supply it
+    username = params.get('username')
+    if _HMAC_TEMPLATE is not None and not username:
+        return ERR_USERNAME_REQUIRED
+    
+    # Reuse tokens this container already minted for the same refresh token
+    token_key = hashlib.sha256(refresh_token.encode()).digest()
+    now = time.monotonic()
+    cached = _refresh_cache.get(token_key)
+    if cached and cached[0] - now > REFRESH_CACHE_MARGIN:
+        access_token, id_token = cached[1]
+        return _resp(200, 'Tokens refreshed successfully.',
+                     access_token=access_token,
+                     id_token=id_token,
+                     expires_in=int(cached[0] - now),
+                     token_type='Bearer')
     
     try:
         # Refresh tokens
@@ -589,7 +498,8 @@ def refresh_token(params):
             ClientId=CLIENT_ID,
             AuthFlow='REFRESH_TOKEN_AUTH',
             AuthParameters={
-                'REFRESH_TOKEN': refresh_token
+                'REFRESH_TOKEN': refresh_token,
+                **_secret_hash_param(username, 'SECRET_HASH')
             }
         )
         
@@ -599,42 +509,32 @@ def refresh_token(params):
         id_token = auth_result.get('IdToken')
         expires_in = auth_result.get('ExpiresIn', 3600)
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Tokens refreshed successfully.',
-                'access_token': access_token,
-                'id_token': id_token,
-                'expires_in': expires_in,
-                'token_type': 'Bearer'
-            })
-        }
-        
-    except cognito.exceptions.NotAuthorizedException:
-        return {
-            'statusCode': 401,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Refresh token is invalid or expired.'
-            })
-        }
+        # Evict the oldest entry once full; dicts keep insertion order
+        _refresh_cache.pop(token_key, None)
+        if len(_refresh_cache) >= REFRESH_CACHE_SIZE:
+            del _refresh_cache[next(iter(_refresh_cache))]
+        _refresh_cache[token_key] = (now + expires_in, (access_token, id_token))
+        
+        return _resp(200, 'Tokens refreshed successfully.',
+                     access_token=access_token,
+                     id_token=id_token,
+                     expires_in=expires_in,
+                     token_type='Bearer')
+        
+    except NotAuthorizedException:
+        _refresh_cache.pop(token_key, None)
+        return ERR_INVALID_REFRESH_TOKEN
         
     except Exception as e:
         logger.error(f"Error refreshing tokens: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f"Error refreshing tokens: {str(e)}"
-            })
-        }
\ No newline at end of file
+        return _resp(500, f"Error refreshing tokens: {str(e)}")
+
+# Operation name -> handler, used by the dispatcher in handler()
+OPERATIONS = {
+    'register': register_user,
+    'login': login_user,
+    'verify': verify_user,
+    'forgot_password': forgot_password,
+    'confirm_forgot_password': confirm_forgot_password,
+    'refresh_token': refresh_token
+}
@@ -7,7 +7,9 @@ import boto3
 import logging
 import psycopg2
 import time
+import random
 import socket
+from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
 # Set up logging
@@ -22,6 +24,13 @@ DB_SECRET_ARN = os.environ.get('DB_SECRET_ARN')
 STAGE = os.environ.get('STAGE')
 MAX_RETRIES = int(os.environ.get('MAX_RETRIES'))
 RETRY_DELAY = int(os.environ.get('RETRY_DELAY'))  # seconds
+MAX_RETRY_DELAY = 30  # seconds
+DNS_CACHE_TTL = 900  # seconds
+# Memory for vector index builds; sized for the default db.t3.micro instance
+INDEX_BUILD_MEMORY = os.environ.get('INDEX_BUILD_MEMORY', '256MB')
+
+# Resolved hosts for this container: host -> (ip, resolved_at)
+_DNS_CACHE = {}
 
 
 def get_postgres_credentials():
@@ -42,6 +51,7 @@ def get_postgres_credentials():
 def check_dns_resolution(host):
     """
     Check if hostname can be resolved to an IP address.
+    Successful lookups are cached for DNS_CACHE_TTL seconds; failures are not.
     
     Args:
         host (str): Hostname to resolve
@@ -49,36 +59,97 @@ def check_dns_resolution(host):
     Returns:
         bool: True if hostname can be resolved, False otherwise
     """
+    cached = _DNS_CACHE.get(host)
+    if cached and time.monotonic() - cached[1] < DNS_CACHE_TTL:
+        return True
     try:
-        socket.gethostbyname(host)
+        _DNS_CACHE[host] = (socket.gethostbyname(host), time.monotonic())
         return True
     except socket.gaierror:
         return False
 
 
-def create_database_if_not_exists(credentials, dbname, retry_count=0):
+def _version_at_least(extversion, minimum):
+    try:
+        return tuple(int(part) for part in extversion.split('.')[:2]) >= minimum
+    except (AttributeError, ValueError):
+        return False
+
+
+def supports_hnsw(extversion):
+    """
+    Check if a pgvector extension version supports HNSW indexes.
+    
+    Args:
+        extversion (str): Installed pgvector version, e.g. '0.5.1'
+        
+    Returns:
+        bool: True for pgvector 0.5.0 and later
+    """
+    return _version_at_least(extversion, (0, 5))
+
+
+def supports_halfvec(extversion):
+    """
+    Check if a pgvector extension version supports the halfvec type.
+    
+    Args:
+        extversion (str): Installed pgvector version, e.g. '0.7.0'
+        
+    Returns:
+        bool: True for pgvector 0.7.0 and later
+    """
+    return _version_at_least(extversion, (0, 7))
+
+
+def run_with_retries(host, operation, *args):
+    """
+    Run a database operation, retrying DNS and connection failures with exponential backoff.
+    
+    Args:
+        host (str): Database hostname
+        operation (callable): Operation to run; may raise psycopg2.OperationalError
+        *args: Arguments for the operation
+    
+    Returns:
+        bool: Result of the operation, or False if every attempt failed
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        # Check if DNS can resolve the host
+        if not check_dns_resolution(host):
+            error = f"Could not resolve hostname '{host}'"
+        else:
+            try:
+                return operation(*args)
+            except psycopg2.OperationalError as e:
+                error = f"Database connection error: {str(e)}"
+        
+        if attempt < MAX_RETRIES:
+            delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** attempt) + random.random()
+            logger.warning(f"{error}. Retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})")
+            time.sleep(delay)
+    
+    logger.error(f"{error} after {MAX_RETRIES} attempts.")
+    return False
+
+
+def create_database_if_not_exists(credentials, dbname):
     """
     Create the database if it doesn't exist.
     
     Args:
         credentials (dict): PostgreSQL credentials
         dbname (str): Database name
-        retry_count (int): Current retry attempt count
     
     Returns:
         bool: True if successful, False otherwise
     """
+    return run_with_retries(credentials['host'], _create_database, credentials, dbname)
+
+
+def _create_database(credentials, dbname):
     host = credentials['host']
-    
-    # Check if DNS can resolve the host
-    if not check_dns_resolution(host):
-        if retry_count < MAX_RETRIES:
-            logger.warning(f"Could not resolve hostname '{host}'. Retrying in {RETRY_DELAY}s ({retry_count + 1}/{MAX_RETRIES})")
-            time.sleep(RETRY_DELAY)
-            return create_database_if_not_exists(credentials, dbname, retry_count + 1)
-        else:
-            logger.error(f"Could not resolve hostname '{host}' after {MAX_RETRIES} attempts.")
-            return False
+    conn = None
     
     try:
         # Connect to the default 'postgres' database to create the new database if needed
@@ -95,56 +166,46 @@ def create_database_if_not_exists(credentials, dbname, retry_count=0):
         cursor = conn.cursor()
         
         # Check if database exists
-        cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{dbname}'")
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
         exists = cursor.fetchone()
         
         if not exists:
             logger.info(f"Creating database '{dbname}'...")
-            cursor.execute(f"CREATE DATABASE {dbname}")
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
             logger.info(f"Database '{dbname}' created successfully")
         else:
             logger.info(f"Database '{dbname}' already exists")
         
-        cursor.close()
-        conn.close()
         return True
         
-    except psycopg2.OperationalError as e:
-        if retry_count < MAX_RETRIES:
-            logger.warning(f"Database connection error: {str(e)}. Retrying in {RETRY_DELAY}s ({retry_count + 1}/{MAX_RETRIES})")
-            time.sleep(RETRY_DELAY)
-            return create_database_if_not_exists(credentials, dbname, retry_count + 1)
-        else:
-            logger.error(f"Database connection error after {MAX_RETRIES} attempts: {str(e)}")
-            return False
+    except psycopg2.OperationalError:
+        raise
     except Exception as e:
         logger.error(f"Error creating database: {str(e)}")
         return False
+    finally:
+        # Closing the connection also closes its cursor; retried attempts must not leak it
+        if conn is not None:
+            conn.close()
 
 
-def initialize_database(credentials, retry_count=0):
+def initialize_database(credentials):
     """
     Initialize the database with pgvector extension and schema.
     
     Args:
         credentials (dict): PostgreSQL credentials
-        retry_count (int): Current retry attempt count
     
     Returns:
         bool: True if successful, False otherwise
     """
+    return run_with_retries(credentials['host'], _initialize_schema, credentials)
+
+
+def _initialize_schema(credentials):
     host = credentials['host']
     dbname = credentials['dbname']
-    
-    # Check if DNS can resolve the host
-    if not check_dns_resolution(host):
-        if retry_count < MAX_RETRIES:
-            logger.warning(f"Could not resolve hostname '{host}'. Retrying in {RETRY_DELAY}s ({retry_count + 1}/{MAX_RETRIES})")
-            time.sleep(RETRY_DELAY)
-            return initialize_database(credentials, retry_count + 1)
-        else:
-            logger.error(f"Could not resolve hostname '{host}' after {MAX_RETRIES} attempts.")
-            return False
+    conn = None
     
     try:
         # Connect to the database
@@ -217,42 +278,83 @@ def initialize_database(credentials, retry_count=0):
         CREATE INDEX IF NOT EXISTS idx_chunks_user_id ON chunks (user_id)
         """)
         
-        # Create vector index on embedding - wrap in try/except as this could fail
-        # if pgvector doesn't fully support the version of Postgres
+        # Create query embedding cache shared by query processor containers
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS query_cache (
+            query_hash BYTEA PRIMARY KEY,
+            embedding VECTOR(768) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """)
+        
+        # Expired cache rows are found and pruned by age
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_query_cache_created_at ON query_cache (created_at)
+        """)
+        
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        extversion = cursor.fetchone()[0]
+        
+        if supports_halfvec(extversion):
+            # Index half-precision copies of the embeddings: half the index size and
+            # distance work per probe. The column stays vector(768), so the query
+            # processor orders by the same halfvec expression to use this index.
+            index_name = "idx_chunks_embedding_halfvec"
+            index_sql = """
+            CREATE INDEX IF NOT EXISTS idx_chunks_embedding_halfvec ON chunks
+            USING hnsw ((embedding::halfvec(768)) halfvec_cosine_ops)
+            WITH (m = 24, ef_construction = 128)
+            """
+            index_def = "USING hnsw (((embedding)::halfvec(768)) halfvec_cosine_ops) WITH (m='24', ef_construction='128')"
+        else:
+            # Create vector index on embedding - HNSW needs pgvector 0.5.0 or later
+            index_name = "idx_chunks_embedding"
+            if supports_hnsw(extversion):
+                index_sql = """
+                CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON chunks
+                USING hnsw (embedding vector_cosine_ops)
+                WITH (m = 24, ef_construction = 128)
+                """
+                index_def = "USING hnsw (embedding vector_cosine_ops) WITH (m='24', ef_construction='128')"
+            else:
+                index_sql = """
+                CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON chunks
+                USING ivfflat (embedding vector_cosine_ops)
+                WITH (lists = 100)
+                """
+                index_def = "USING ivfflat (embedding vector_cosine_ops) WITH (lists='100')"
+        
+        # CREATE INDEX IF NOT EXISTS keeps any index with this name, so drop the btree
+        # fallback, ivfflat or differently tuned HNSW index older deployments created;
+        # the btree one is never used for similarity search and slows every chunk insert
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = %s", (index_name,))
+        existing = cursor.fetchone()
+        if existing and not existing[0].endswith(index_def):
+            logger.info(f"Dropping outdated index on embedding column: {existing[0]}")
+            cursor.execute(f"DROP INDEX {index_name}")
         try:
-            cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON chunks
-            USING ivfflat (embedding vector_cosine_ops)
-            WITH (lists = 100)
-            """)
+            # A graph that fits in maintenance_work_mem builds much faster
+            cursor.execute("SET maintenance_work_mem = %s", (INDEX_BUILD_MEMORY,))
+            cursor.execute(index_sql)
         except Exception as e:
-            logger.warning(f"Failed to create vector index (this is OK if using older PostgreSQL): {str(e)}")
-            # Try creating a simpler index without IVF
-            try:
-                cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON chunks
-                USING btree (embedding)
-                """)
-                logger.info("Created fallback BTree index on embedding column")
-            except Exception as e2:
-                logger.warning(f"Failed to create fallback index: {str(e2)}")
+            logger.error(f"Failed to build vector index {index_name}: {str(e)}")
+        else:
+            if index_name != "idx_chunks_embedding":
+                # The full-precision index is only dropped once its replacement exists
+                cursor.execute("DROP INDEX IF EXISTS idx_chunks_embedding")
         
         logger.info("Database initialization completed successfully")
-        cursor.close()
-        conn.close()
         return True
         
-    except psycopg2.OperationalError as e:
-        if retry_count < MAX_RETRIES:
-            logger.warning(f"Database connection error: {str(e)}. Retrying in {RETRY_DELAY}s ({retry_count + 1}/{MAX_RETRIES})")
-            time.sleep(RETRY_DELAY)
-            return initialize_database(credentials, retry_count + 1)
-        else:
-            logger.error(f"Database connection error after {MAX_RETRIES} attempts: {str(e)}")
-            return False
+    except psycopg2.OperationalError:
+        raise
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
         return False
+    finally:
+        # Closing the connection also closes its cursor; retried attempts must not leak it
+        if conn is not None:
+            conn.close()
 
 
 def handler(event, context):
@@ -2,21 +2,33 @@
 Lambda function to process documents uploaded to S3.
 Extracts text from documents, chunks it, creates embeddings, and stores in PostgreSQL.
 """
+import io
 import os
+import csv
 import json
+import orjson
+import sys
+import array
+import atexit
+import struct
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 import logging
-import tempfile
+import time
 import psycopg2
+import numpy as np
+from psycopg2.extras import execute_values, Json
+from pgvector.psycopg2 import register_vector
 import uuid
 import urllib.parse
-from datetime import datetime
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Optional, Tuple
 
 # Import LangChain components
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, CSVLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from pypdf import PdfReader
 
 from google import genai
 from google.genai import types
@@ -44,6 +56,41 @@ TOP_K = int(os.environ.get('TOP_K'))
 TOP_P = float(os.environ.get('TOP_P'))
 SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD'))
 GEMINI_EMBEDDING_MODEL = "text-embedding-004"
+CHUNK_INSERT_PAGE_SIZE = 100
+CHUNK_COPY_THRESHOLD = 500  # documents with more chunks are loaded with binary COPY
+EMBED_BATCH_SIZE = 100
+EMBED_WORKERS = 16
+
+# Per-text embedding requests are network bound, so they are issued concurrently
+_embed_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS)
+
+# The DynamoDB metadata write runs alongside the PostgreSQL chunk inserts
+METADATA_WRITE_TIMEOUT = 5  # seconds
+_io_executor = ThreadPoolExecutor(max_workers=2)
+
+
+# Secrets Manager responses for this container: secret id -> (secret, fetched_at)
+SECRET_CACHE_TTL = 3600  # seconds
+_secret_cache = {}
+
+
+def get_secret(secret_id, refresh=False):
+    """
+    Get a JSON secret from Secrets Manager, cached for SECRET_CACHE_TTL seconds.
+    
+    Args:
+        secret_id (str): Secret ARN
+        refresh (bool): Ignore the cached value and fetch the secret again
+    """
+    cached = _secret_cache.get(secret_id)
+    if not refresh and cached and time.monotonic() - cached[1] < SECRET_CACHE_TTL:
+        return cached[0]
+    secret_response = secretsmanager.get_secret_value(
+        SecretId=secret_id
+    )
+    secret = json.loads(secret_response['SecretString'])
+    _secret_cache[secret_id] = (secret, time.monotonic())
+    return secret
 
 
 def get_gemini_api_key():
@@ -51,11 +98,7 @@ def get_gemini_api_key():
     Get Gemini API key from Secrets Manager.
     """
     try:
-        secret_response = secretsmanager.get_secret_value(
-            SecretId=GEMINI_SECRET_ARN
-        )
-        secret = json.loads(secret_response['SecretString'])
-        return secret['GEMINI_API_KEY']
+        return get_secret(GEMINI_SECRET_ARN)['GEMINI_API_KEY']
     except Exception as e:
         logger.error(f"Error getting Gemini API key: {str(e)}")
         raise e
@@ -70,12 +113,24 @@ except Exception as e:
 
 def embed_documents(texts: List[str]) -> List[List[float]]:
     """
-    Embed a list of documents
+    Embed a list of documents, sending up to EMBED_BATCH_SIZE texts per Gemini request.
+    Falls back to concurrent per-text requests if a batch fails.
     """
     embeddings = []
-    for text in texts:
-        embedding = embed_query(text)
-        embeddings.append(embedding)
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = texts[i:i + EMBED_BATCH_SIZE]
+        try:
+            result = client.models.embed_content(
+                model=GEMINI_EMBEDDING_MODEL,
+                contents=batch,
+                config=types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY")
+            )
+            if len(result.embeddings) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embeddings, got {len(result.embeddings)}")
+            embeddings.extend(list(e.values) for e in result.embeddings)
+        except Exception as e:
+            logger.error(f"Error creating batch embeddings, embedding one at a time: {str(e)}")
+            embeddings.extend(_embed_executor.map(embed_query, batch))
     return embeddings
 
 
@@ -96,16 +151,15 @@ def embed_query(text: str) -> List[float]:
         return [0.0] * 768
 
 
-def get_postgres_credentials():
+def get_postgres_credentials(refresh=False):
     """
     Get PostgreSQL credentials from Secrets Manager.
+    
+    Args:
+        refresh (bool): Ignore the cached credentials and fetch them again
     """
     try:
-        secret_response = secretsmanager.get_secret_value(
-            SecretId=DB_SECRET_ARN
-        )
-        secret = json.loads(secret_response['SecretString'])
-        return secret
+        return get_secret(DB_SECRET_ARN, refresh)
     except Exception as e:
         logger.error(f"Error getting PostgreSQL credentials: {str(e)}")
         raise e
@@ -120,31 +174,117 @@ def get_postgres_connection(credentials):
         port=credentials['port'],
         user=credentials['username'],
         password=credentials['password'],
-        dbname=credentials['dbname']
+        dbname=credentials['dbname'],
+        connect_timeout=5
     )
     return conn
 
 
-def get_document_loader(file_path, mime_type):
+# Connection kept for the life of the container so warm invocations skip the
+# Secrets Manager lookup and the connection handshake
+_pg_conn = None
+
+# Prepared once per connection so each document insert skips parsing and planning.
+# Chunks are inserted with execute_values, which already batches them.
+PREPARE_INSERT_DOCUMENT = """
+PREPARE insert_document (text, text, text, text, text, text, text) AS
+INSERT INTO documents (document_id, user_id, file_name, mime_type, status, bucket, key)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+RETURNING id
+"""
+
+
+def get_conn(reconnect=False):
+    """
+    Get the container's PostgreSQL connection, connecting on first use or if it was closed.
+    
+    Args:
+        reconnect (bool): Discard the current connection and open a new one
+    """
+    global _pg_conn
+    if reconnect and _pg_conn is not None:
+        try:
+            _pg_conn.close()
+        except Exception:
+            pass
+        _pg_conn = None
+    if _pg_conn is None or _pg_conn.closed:
+        try:
+            conn = get_postgres_connection(get_postgres_credentials())
+        except psycopg2.OperationalError as e:
+            # The cached credentials may have been rotated
+            logger.warning(f"Connecting with fresh PostgreSQL credentials: {str(e)}")
+            conn = get_postgres_connection(get_postgres_credentials(refresh=True))
+        try:
+            # Send embeddings as vector literals rather than ARRAY[...] expressions
+            register_vector(conn)
+            with conn.cursor() as cursor:
+                cursor.execute(PREPARE_INSERT_DOCUMENT)
+            conn.commit()
+        except Exception:
+            # The vector extension or documents table may not exist yet; don't keep
+            # an unprepared connection around, so the next call sets up a new one
+            conn.close()
+            raise
+        # Publish the connection only once it is set up
+        _pg_conn = conn
+    return _pg_conn
+
+
+@atexit.register
+def _close_conn():
+    if _pg_conn is not None and not _pg_conn.closed:
+        _pg_conn.close()
+
+
+# Connect during INIT so the first invocation doesn't pay for the handshake;
+# on failure the handler connects on demand
+try:
+    get_conn()
+except Exception as e:
+    logger.warning(f"Could not pre-warm PostgreSQL connection: {str(e)}")
+
+
+def load_documents(file_obj, source: str, mime_type: str) -> List[Document]:
     """
-    Get the appropriate document loader based on file type.
+    Load documents from an in-memory file based on file type.
+    Produces the same documents and metadata as the LangChain PDF, CSV and text loaders.
     
     Args:
-        file_path (str): Path to the file
+        file_obj (io.BytesIO): File contents, positioned at the start
+        source (str): S3 key recorded as the documents' source
         mime_type (str): MIME type of the file
         
     Returns:
-        LangChain document loader
+        List[Document]: One document per PDF page, per CSV row, or for the whole text file
     """
     if mime_type == 'application/pdf':
-        return PyPDFLoader(file_path)
-    elif mime_type == 'text/plain':
-        return TextLoader(file_path)
+        reader = PdfReader(file_obj)
+        return [
+            Document(page_content=page.extract_text(), metadata={"source": source, "page": i})
+            for i, page in enumerate(reader.pages)
+        ]
     elif mime_type in ['text/csv', 'application/csv']:
-        return CSVLoader(file_path)
+        rows = csv.DictReader(io.TextIOWrapper(file_obj, encoding='utf-8'))
+        return [
+            Document(
+                page_content="\n".join(f"{k.strip()}: {(v or '').strip()}" for k, v in row.items() if k is not None),
+                metadata={"source": source, "row": i}
+            )
+            for i, row in enumerate(rows)
+        ]
     else:
-        # Default to text loader for unknown types
-        return TextLoader(file_path)
+        # Default to plain text for unknown types
+        return [Document(page_content=file_obj.getvalue().decode('utf-8'), metadata={"source": source})]
+
+
+# Built once per container rather than on every call
+_text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=200,
+    length_function=len,
+    separators=["\n\n", "\n", " ", ""]
+)
 
 
 def chunk_documents(documents: List[Document]) -> List[Document]:
@@ -157,98 +297,194 @@ def chunk_documents(documents: List[Document]) -> List[Document]:
     Returns:
         List[Document]: List of chunked documents
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    
-    chunks = text_splitter.split_documents(documents)
+    chunks = _text_splitter.split_documents(documents)
     return chunks
 
 
-def get_s3_object_with_various_encoding(bucket: str, key: str) -> str:
+def orjson_dumps(obj) -> str:
+    """
+    Serialize JSON column values with orjson.
+    """
+    return orjson.dumps(obj).decode('utf-8')
+
+
+# Binary COPY framing: signature, flags and header extension length; -1 field count ends the data
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+_FIELD_COUNT = struct.Struct('>h')
+_FIELD_LENGTH = struct.Struct('>i')
+_VECTOR_HEADER = struct.Struct('>HH')
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+CHUNK_COPY_SQL = """
+COPY chunks (chunk_id, document_id, user_id, content, metadata, embedding)
+FROM STDIN WITH (FORMAT BINARY)
+"""
+
+
+def encode_chunk_copy(records) -> io.BytesIO:
     """
-    Try to access an S3 object with different URL encoding methods.
-    Returns the correct key that works.
+    Encode chunk rows in PostgreSQL's binary COPY format.
+    
+    Args:
+        records (list): (chunk_id, document_id, user_id, content, metadata, embedding) tuples
+        
+    Returns:
+        io.BytesIO: COPY data positioned at the start
+    """
+    out = io.BytesIO()
+    out.write(_COPY_HEADER)
+    for chunk_id, document_id, user_id, content, metadata, embedding in records:
+        fields = [value.encode('utf-8') for value in (chunk_id, document_id, user_id, content)]
+        # jsonb is a version byte followed by the JSON text
+        fields.append(b'\x01' + orjson.dumps(metadata))
+        # pgvector's binary vector is the dimension, an unused int16, then big-endian
+        # float4 values, converted in one pass into a typed buffer
+        values = array.array('f', embedding)
+        if _LITTLE_ENDIAN:
+            values.byteswap()
+        fields.append(_VECTOR_HEADER.pack(len(values), 0) + values.tobytes())
+        out.write(_FIELD_COUNT.pack(len(fields)))
+        for field in fields:
+            out.write(_FIELD_LENGTH.pack(len(field)))
+            out.write(field)
+    out.write(_COPY_TRAILER)
+    out.seek(0)
+    return out
+
+
+# S3 keys resolved by get_s3_object_with_various_encoding: (bucket, decoded key) -> actual key
+S3_KEY_CACHE_SIZE = 1024
+_s3_key_cache = {}
+
+# Small objects download on the calling thread; large ones in parallel 16 MiB parts
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+SMALL_TRANSFER_CONFIG = TransferConfig(use_threads=False)
+LARGE_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=16
+)
+
+
+def _head_object_size(bucket: str, key: str) -> Optional[int]:
+    """Return the current size of an S3 object, or None if the key does not exist."""
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        return None
+
+
+def _cache_s3_key(cache_key: Tuple[str, str], actual_key: str):
+    """Remember a resolved S3 key, evicting the oldest entry once the cache is full."""
+    if cache_key not in _s3_key_cache and len(_s3_key_cache) >= S3_KEY_CACHE_SIZE:
+        del _s3_key_cache[next(iter(_s3_key_cache))]
+    _s3_key_cache[cache_key] = actual_key
+
+
+def get_s3_object_with_various_encoding(bucket: str, key: str, enable_list_fallback: bool = False) -> Tuple[str, int]:
+    """
+    Find the S3 key that actually exists for a key whose URL encoding may not match.
+    Tries the URL-decoded key first, then the key as given and its '+'-encoded form.
+    Optionally lists the key's directory and matches file names after URL decoding.
+    Resolved keys are cached per container; the size is always read from S3,
+    since the object may have been overwritten under the same key.
     
     Args:
         bucket (str): S3 bucket name
         key (str): S3 object key to try
+        enable_list_fallback (bool): List the directory if no candidate key exists
         
     Returns:
-        str: The correct S3 key that works
+        Tuple[str, int]: The correct S3 key that works and the object size in bytes
     
     Raises:
         Exception: If object cannot be found with any encoding approach
     """
-    logger.info(f"Trying to access S3 object with various encodings: s3://{bucket}/{key}")
-    
-    # List of keys to try
-    keys_to_try = []
-    
-    # Original key
-    keys_to_try.append(key)
-    
-    # URL decoded key 
     decoded_key = urllib.parse.unquote_plus(key)
-    if decoded_key != key:
-        keys_to_try.append(decoded_key)
+    cache_key = (bucket, decoded_key)
+    cached_key = _s3_key_cache.get(cache_key)
+    if cached_key is not None:
+        size = _head_object_size(bucket, cached_key)
+        if size is not None:
+            return cached_key, size
+        # The object was deleted or renamed since it was resolved
+        del _s3_key_cache[cache_key]
     
-    # URL encoded key (convert spaces to +)
-    encoded_key = urllib.parse.quote_plus(decoded_key)
-    if encoded_key != key and encoded_key != decoded_key:
-        keys_to_try.append(encoded_key)
+    candidates = list(dict.fromkeys([decoded_key, key, urllib.parse.quote_plus(decoded_key, safe='/')]))
+    for candidate in candidates:
+        size = _head_object_size(bucket, candidate)
+        if size is None:
+            logger.info(f"S3 object not found with key: {candidate}")
+            continue
+        _cache_s3_key(cache_key, candidate)
+        return candidate, size
     
-    # URL encoded key (convert spaces to %20)
-    encoded_key_alt = urllib.parse.quote(decoded_key, safe='/')
-    if encoded_key_alt != key and encoded_key_alt not in keys_to_try:
-        keys_to_try.append(encoded_key_alt)
-    
-    # Try all possible keys
-    for attempt_key in keys_to_try:
-        try:
-            logger.info(f"Trying key: {attempt_key}")
-            s3_client.head_object(Bucket=bucket, Key=attempt_key)
-            logger.info(f"Successfully found S3 object with key: {attempt_key}")
-            return attempt_key
-        except Exception as e:
-            logger.warning(f"Failed to access S3 object with key: {attempt_key}, error: {str(e)}")
-    
-    # If we get here, try listing objects with the same prefix
-    try:
+    if enable_list_fallback:
+        # List the object's directory once and compare decoded file names
         prefix = '/'.join(key.split('/')[:-1]) + '/'
+        expected_filename = decoded_key.split('/')[-1]
         logger.info(f"Listing objects with prefix: {prefix}")
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        
-        if 'Contents' in response:
-            for obj in response.get('Contents', []):
-                actual_key = obj['Key']
-                logger.info(f"Found object in bucket: {actual_key}")
-                
-                # Check if the filename part matches (ignoring encoding differences)
-                expected_filename = key.split('/')[-1].replace('+', ' ').replace('%20', ' ')
-                actual_filename = actual_key.split('/')[-1].replace('+', ' ').replace('%20', ' ')
-                
-                if expected_filename == actual_filename:
-                    logger.info(f"Found matching object: {actual_key}")
-                    # Test if we can access this object
-                    try:
-                        s3_client.head_object(Bucket=bucket, Key=actual_key)
-                        logger.info(f"Successfully accessed matching object: {actual_key}")
-                        return actual_key
-                    except Exception as e:
-                        logger.warning(f"Found matching object but can't access it: {actual_key}, error: {str(e)}")
-                
-            logger.warning(f"No matching object found after checking {len(response.get('Contents', []))} objects with prefix {prefix}")
-        else:
-            logger.warning(f"No objects found with prefix: {prefix}")
-    except Exception as e:
-        logger.error(f"Error listing objects in bucket: {str(e)}")
+        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1000)
+        contents = response.get('Contents', [])
+        for obj in contents:
+            actual_key = obj['Key']
+            if urllib.parse.unquote_plus(actual_key.split('/')[-1]) == expected_filename:
+                logger.info(f"Found matching object: {actual_key}")
+                _cache_s3_key(cache_key, actual_key)
+                return actual_key, obj['Size']
+        logger.warning(f"No matching object found after checking {len(contents)} objects with prefix {prefix}")
     
     # If we still can't find the object, raise exception with details
-    raise Exception(f"Could not find S3 object in bucket '{bucket}' with key '{key}' or any variation. Tried keys: {keys_to_try}")
+    raise Exception(f"Could not find S3 object in bucket '{bucket}' with key '{key}' or any variation. Tried keys: {candidates}")
+
+
+def store_document_metadata(bucket: str, key: str, document_id: str, user_id: str, chunk_ids: List[str]):
+    """
+    Store processed document metadata in DynamoDB.
+    
+    Args:
+        bucket (str): S3 bucket name
+        key (str): S3 object key
+        document_id (str): Document ID
+        user_id (str): User ID
+        chunk_ids (List[str]): IDs of the document's chunks
+    """
+    now_ms = int(time.time() * 1000)
+    metadata_table = dynamodb.Table(METADATA_TABLE)
+    metadata_table.put_item(
+        Item={
+            'id': f"doc#{document_id}",
+            'document_id': document_id,
+            'user_id': user_id,
+            'status': 'processed',
+            'bucket': bucket,
+            'key': key,
+            'num_chunks': len(chunk_ids),
+            'chunk_ids': chunk_ids,
+            'created_at': now_ms,
+            'updated_at': now_ms
+        }
+    )
+
+
+def mark_document_failed(document_id: str):
+    """
+    Mark a document's DynamoDB metadata as failed after its PostgreSQL writes were rolled back.
+    
+    Args:
+        document_id (str): Document ID
+    """
+    try:
+        dynamodb.Table(METADATA_TABLE).update_item(
+            Key={'id': f"doc#{document_id}"},
+            UpdateExpression="SET #status = :status, updated_at = :updated_at",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': 'failed', ':updated_at': int(time.time() * 1000)}
+        )
+    except Exception as e:
+        logger.error(f"Error marking document {document_id} as failed: {str(e)}")
 
 
 def process_document(bucket: str, key: str, document_id: str, user_id: str, mime_type: str) -> Tuple[int, List[str]]:
@@ -267,7 +503,7 @@ def process_document(bucket: str, key: str, document_id: str, user_id: str, mime
     """
     # Find the correct key encoding
     try:
-        working_key = get_s3_object_with_various_encoding(bucket, key)
+        working_key, size = get_s3_object_with_various_encoding(bucket, key)
         logger.info(f"Using corrected S3 key: {working_key}")
         
         if working_key != key:
@@ -277,16 +513,18 @@ def process_document(bucket: str, key: str, document_id: str, user_id: str, mime
         logger.error(f"Failed to find S3 object with any encoding variation: {str(e)}")
         raise
     
-    # Download the file to a temporary location
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        logger.info(f"Downloading S3 object from s3://{bucket}/{key} to {temp_file.name}")
-        s3_client.download_file(bucket, key, temp_file.name)
-        file_path = temp_file.name
+    # Download the file into memory
+    logger.info(f"Downloading S3 object from s3://{bucket}/{key} ({size} bytes)")
+    buffer = io.BytesIO()
+    transfer_config = LARGE_TRANSFER_CONFIG if size >= MULTIPART_THRESHOLD else SMALL_TRANSFER_CONFIG
+    s3_client.download_fileobj(bucket, key, buffer, Config=transfer_config)
+    buffer.seek(0)
     
+    metadata_future = None
+    committed = False
     try:
-        # Load document using appropriate loader
-        loader = get_document_loader(file_path, mime_type)
-        documents = loader.load()
+        # Load document based on its type
+        documents = load_documents(buffer, key, mime_type)
         
         logger.info(f"Loaded {len(documents)} document(s)")
         
@@ -295,79 +533,104 @@ def process_document(bucket: str, key: str, document_id: str, user_id: str, mime
         
         logger.info(f"Created {len(chunks)} chunks")
         
-        # Get PostgreSQL credentials
-        credentials = get_postgres_credentials()
-        conn = get_postgres_connection(credentials)
-        cursor = conn.cursor()
+        # Embed chunks before opening the transaction so it stays short
+        chunk_ids = []
+        records = []
+        embeddings = embed_documents([chunk.page_content for chunk in chunks])
+        for chunk, embedding in zip(chunks, embeddings):
+            chunk_id = str(uuid.uuid4())
+            chunk_ids.append(chunk_id)
+            
+            # Prepare metadata
+            metadata = {
+                "source": key,
+                "page": chunk.metadata.get("page", 0) if hasattr(chunk, "metadata") else 0
+            }
+            
+            records.append((chunk_id, document_id, user_id, chunk.page_content, metadata, embedding))
         
         # Get file name from key (handle encoding)
         file_name = key.split('/')[-1]
         
-        # Store document in PostgreSQL
-        cursor.execute("""
-        INSERT INTO documents (document_id, user_id, file_name, mime_type, status, bucket, key, created_at, updated_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-        """, (
+        # Store the document and its chunks in PostgreSQL in one transaction
+        document_sql = "EXECUTE insert_document (%s, %s, %s, %s, %s, %s, %s)"
+        document_row = (
             document_id,
             user_id,
             file_name,
             mime_type,
             'processed',
             bucket,
-            key,
-            datetime.now(),
-            datetime.now()
-        ))
+            key
+        )
+        conn = get_conn()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(document_sql, document_row)
+        except psycopg2.OperationalError as e:
+            # The server may have dropped the connection while the container was idle;
+            # nothing has been written yet, so reconnect and try once more
+            logger.warning(f"Reconnecting to PostgreSQL: {str(e)}")
+            conn = get_conn(reconnect=True)
+            cursor = conn.cursor()
+            cursor.execute(document_sql, document_row)
         
-        # Commit the transaction
-        conn.commit()
+        # Write the DynamoDB metadata while the chunks are inserted
+        metadata_future = _io_executor.submit(store_document_metadata, bucket, key, document_id, user_id, chunk_ids)
         
-        # Store chunks with embeddings in PostgreSQL
-        chunk_ids = []
-        for chunk in chunks:
-            chunk_id = str(uuid.uuid4())
-            chunk_ids.append(chunk_id)
-            
-            # Create embedding
-            embedding = embed_query(chunk.page_content)
-            
-            # Prepare metadata
-            metadata = {
-                "source": key,
-                "page": chunk.metadata.get("page", 0) if hasattr(chunk, "metadata") else 0
-            }
-            
-            # Store in PostgreSQL
-            cursor.execute("""
-            INSERT INTO chunks (chunk_id, document_id, user_id, content, metadata, embedding, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                chunk_id,
-                document_id,
-                user_id,
-                chunk.page_content,
-                json.dumps(metadata),
-                embedding,
-                datetime.now(),
-                datetime.now()
-            ))
+        if len(records) > CHUNK_COPY_THRESHOLD:
+            # Stream large documents in the binary COPY format
+            cursor.copy_expert(CHUNK_COPY_SQL, encode_chunk_copy(records))
+        else:
+            # Insert all chunks in batches instead of one round trip per chunk
+            rows = [
+                (chunk_id, document_id, user_id, content, Json(metadata, dumps=orjson_dumps), np.asarray(embedding, dtype=np.float32))
+                for chunk_id, document_id, user_id, content, metadata, embedding in records
+            ]
+            execute_values(cursor, """
+            INSERT INTO chunks (chunk_id, document_id, user_id, content, metadata, embedding)
+            VALUES %s
+            """, rows, page_size=CHUNK_INSERT_PAGE_SIZE)
         
         # Commit the transaction
         conn.commit()
+        committed = True
+        cursor.close()
+        
+        # Lambda may freeze once the handler returns, so wait for the metadata write.
+        # The chunks are committed, so a failure here must not fail the document and
+        # make the client retry into duplicate chunks.
+        try:
+            metadata_future.result(timeout=METADATA_WRITE_TIMEOUT)
+        except FutureTimeoutError:
+            logger.error(f"Metadata write for document {document_id} did not finish in {METADATA_WRITE_TIMEOUT}s")
+        except Exception as e:
+            logger.error(f"Error storing metadata for document {document_id}: {str(e)}")
         
         return len(chunks), chunk_ids
         
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
+        # Leave the shared connection usable for the next invocation
+        if _pg_conn is not None and not _pg_conn.closed:
+            try:
+                _pg_conn.rollback()
+            except Exception:
+                get_conn(reconnect=True)
+        # Don't leave the document marked as processed if the chunks were not stored.
+        # Committed chunks stay, so their metadata is left alone.
+        if metadata_future is not None and not committed:
+            try:
+                metadata_future.result(timeout=METADATA_WRITE_TIMEOUT)
+            except FutureTimeoutError:
+                # Marking it now could be overwritten by the put still in flight
+                logger.error(f"Metadata write for document {document_id} is still running; not marking it as failed")
+            except Exception:
+                # The put failed, so there is no item to mark
+                pass
+            else:
+                mark_document_failed(document_id)
         raise e
-    finally:
-        # Clean up temporary file
-        try:
-            os.unlink(file_path)
-            logger.info(f"Temporary file {file_path} cleaned up")
-        except Exception as e:
-            logger.warning(f"Error cleaning up temporary file {file_path}: {str(e)}")
 
 
 def handler(event, context):
@@ -470,23 +733,6 @@ def handler(event, context):
             # Process the document
             num_chunks, chunk_ids = process_document(bucket, key, document_id, user_id, mime_type)
             
-            # Store metadata in DynamoDB
-            metadata_table = dynamodb.Table(METADATA_TABLE)
-            metadata_table.put_item(
-                Item={
-                    'id': f"doc#{document_id}",
-                    'document_id': document_id,
-                    'user_id': user_id,
-                    'status': 'processed',
-                    'bucket': bucket,
-                    'key': key,
-                    'num_chunks': num_chunks,
-                    'chunk_ids': chunk_ids,
-                    'created_at': int(datetime.now().timestamp() * 1000),
-                    'updated_at': int(datetime.now().timestamp() * 1000)
-                }
-            )
-            
             return {
                 'statusCode': 200,
                 'body': json.dumps({
@@ -4,10 +4,19 @@ Includes RAG evaluation functionality.
 """
 import os
 import json
+import time
+import hashlib
+import functools
+import orjson
+import atexit
 import boto3
 import logging
 import psycopg2
-from typing import List, Dict, Any, Optional
+import numpy as np
+from psycopg2.extras import RealDictCursor
+from concurrent.futures import ThreadPoolExecutor
+from pgvector.psycopg2 import register_vector
+from typing import List, Dict, Any, Optional, Iterator
 from decimal import Decimal
 from google import genai
 from google.genai import types
@@ -34,6 +43,22 @@ TOP_K = int(os.environ.get('TOP_K'))
 TOP_P = float(os.environ.get('TOP_P'))
 ENABLE_EVALUATION = os.environ.get('ENABLE_EVALUATION', 'true').lower() == 'true'
 GEMINI_MODEL = "gemini-2.0-flash"
+EVALUATION_METRICS = ("answer_relevancy", "faithfulness", "context_precision")
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', '10'))
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', '100'))
+# Same {"answer": ...} shape as the Gemini responses the UI parses
+NO_DOCUMENTS_RESPONSE = orjson.dumps(
+    {"answer": "I don't have any documents to search yet. Please upload documents first."}
+).decode()
+GENERATION_FAILED_RESPONSE = orjson.dumps(
+    {"answer": "Sorry, I couldn't generate a response. Please try again later."}
+).decode()
+EMBED_BATCH_SIZE = 100  # texts per Gemini embed_content request
+QUERY_CACHE_SIZE = 1024  # query embeddings kept per container
+QUERY_CACHE_TTL_DAYS = int(os.environ.get('QUERY_CACHE_TTL_DAYS', '7'))  # shared query_cache rows
+
+# Threads for overlapping Gemini requests
+_executor = ThreadPoolExecutor(max_workers=4)
 
 # Get Gemini API key from Secrets Manager
 def get_gemini_api_key():
@@ -52,29 +77,131 @@ except Exception as e:
     logger.error(f"Error configuring Gemini API client: {str(e)}")
     raise
 
-# Convert Decimal in DynamoDB
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Decimal):
-            return float(o)
-        return super().default(o)
+# Generation settings are fixed for the life of the container
+GENERATION_CONFIG = types.GenerateContentConfig(
+    temperature=TEMPERATURE,
+    top_p=TOP_P,
+    top_k=TOP_K,
+    max_output_tokens=MAX_OUTPUT_TOKENS,
+    response_mime_type='application/json'
+)
+
+# Convert Decimal in DynamoDB for orjson
+def decimal_default(o):
+    if isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+# Serialize a response body with orjson
+def dumps(payload) -> str:
+    return orjson.dumps(payload, default=decimal_default).decode()
 
-# Embed a query using Gemini embedding model
+# Embed a query using Gemini embedding model; repeated queries are served from cache
 def embed_query(text: str) -> List[float]:
+    try:
+        return list(_cached_query_embedding(_QueryKey(text)))
+    except Exception as e:
+        logger.error(f"Error generating embedding: {str(e)}")
+        return [0.0] * 768
+
+# Cache key for a query: compares and hashes as the lowercased, whitespace-collapsed
+# text, while keeping the query as typed so a cache miss embeds the original
+class _QueryKey(str):
+    def __new__(cls, text: str):
+        key = super().__new__(cls, ' '.join(text.split()).lower())
+        key.text = text
+        return key
+
+# Embeddings cached per container by normalized query, backed by the shared
+# query_cache table so other containers' queries are reused. The shared key
+# includes the embedding model and dimension, so a model change doesn't serve
+# old vectors. Failures raise and are not cached.
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _cached_query_embedding(key: _QueryKey) -> tuple:
+    query_hash = hashlib.blake2b(f"{GEMINI_EMBEDDING_MODEL}:768\x00{key}".encode(), digest_size=16).digest()
+    embedding = load_cached_embedding(query_hash)
+    if embedding is None:
+        embedding = embed_text(key.text)
+        # Written before returning, since Lambda may freeze the container afterwards
+        if _pg_conn is not None and not _pg_conn.closed:
+            store_cached_embedding(_pg_conn, query_hash, embedding)
+    return tuple(embedding)
+
+# Rows older than QUERY_CACHE_TTL_DAYS are ignored, and pruned whenever a new
+# embedding is stored; a stored embedding replaces an expired row for its query
+QUERY_CACHE_LOOKUP_SQL = """
+SELECT embedding FROM query_cache
+WHERE query_hash = %s AND created_at > NOW() - make_interval(days => %s)
+"""
+QUERY_CACHE_STORE_SQL = """
+INSERT INTO query_cache (query_hash, embedding) VALUES (%s, %s)
+ON CONFLICT (query_hash) DO UPDATE SET embedding = EXCLUDED.embedding, created_at = NOW();
+DELETE FROM query_cache WHERE created_at < NOW() - make_interval(days => %s)
+"""
+
+# Look up a query embedding in the shared cache table. Only an already open
+# connection is used, so a cold container doesn't wait on PostgreSQL here.
+def load_cached_embedding(query_hash: bytes) -> Optional[List[float]]:
+    conn = _pg_conn
+    if conn is None or conn.closed:
+        return None
+    try:
+        rows = fetch_all(conn, QUERY_CACHE_LOOKUP_SQL, (query_hash, QUERY_CACHE_TTL_DAYS))
+        return rows[0][0].tolist() if rows else None
+    except Exception as e:
+        logger.warning(f"Query cache lookup failed: {str(e)}")
+        return None
+
+# Save a query embedding to the shared cache table
+def store_cached_embedding(conn, query_hash: bytes, embedding: List[float]) -> None:
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                QUERY_CACHE_STORE_SQL,
+                (query_hash, np.asarray(embedding, dtype=np.float32), QUERY_CACHE_TTL_DAYS)
+            )
+        finally:
+            cursor.close()
+    except Exception as e:
+        logger.warning(f"Query cache write failed: {str(e)}")
+
+# Embed one text using Gemini embedding model, without caching
+def embed_text(text: str) -> List[float]:
+    result = client.models.embed_content(
+        model=GEMINI_EMBEDDING_MODEL,
+        contents=text,
+        config=types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY")
+    )
+    return list(result.embeddings[0].values)
+
+# Embed up to EMBED_BATCH_SIZE texts in one request, one at a time if the batch fails
+def embed_batch(texts: List[str]) -> List[List[float]]:
     try:
         result = client.models.embed_content(
             model=GEMINI_EMBEDDING_MODEL,
-            contents=text,
+            contents=texts,
             config=types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY")
         )
-        return list(result.embeddings[0].values)
+        if len(result.embeddings) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(result.embeddings)}")
+        return [list(e.values) for e in result.embeddings]
     except Exception as e:
-        logger.error(f"Error generating embedding: {str(e)}")
-        return [0.0] * 768
+        logger.error(f"Error generating batch embeddings: {str(e)}")
+        # Document texts bypass the query caches
+        embeddings = []
+        for text in texts:
+            try:
+                embeddings.append(embed_text(text))
+            except Exception as e:
+                logger.error(f"Error generating embedding: {str(e)}")
+                embeddings.append([0.0] * 768)
+        return embeddings
 
-# Embed a list of documents
+# Embed a list of documents, sending the batches concurrently
 def embed_documents(texts: List[str]) -> List[List[float]]:
-    return [embed_query(text) for text in texts]
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    return [embedding for batch in _executor.map(embed_batch, batches) for embedding in batch]
 
 # Get RDS credentials from Secrets Manager
 def get_postgres_credentials():
@@ -96,64 +223,171 @@ def get_postgres_connection(creds):
     )
 
 
-# Vector similarity search using pgvector
-def similarity_search(query_embedding: List[float], user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
-    credentials = get_postgres_credentials()
-    conn = get_postgres_connection(credentials)
+# Prepared once per connection; the query embedding is bound as a parameter ($2)
+# so it is sent and parsed once per call and the plan can be reused. The ORDER BY
+# expression must match the vector index expression for the planner to use it.
+# The inner query reads only chunks so the index scan can stop at the LIMIT; file
+# names are joined onto those few rows afterwards.
+PREPARE_SIMILARITY_SEARCH = """
+PREPARE similarity_search (text, vector, integer) AS
+WITH hits AS (
+    SELECT chunk_id, document_id, user_id, content, metadata,
+           embedding <=> $2 AS distance
+    FROM chunks
+    WHERE user_id = $1
+    ORDER BY {distance}
+    LIMIT $3
+)
+SELECT
+    h.chunk_id,
+    h.document_id,
+    h.user_id,
+    h.content,
+    h.metadata,
+    d.file_name,
+    1 - h.distance AS similarity_score
+FROM
+    hits h
+JOIN
+    documents d ON h.document_id = d.document_id
+ORDER BY
+    h.distance
+"""
+EXECUTE_SIMILARITY_SEARCH = "EXECUTE similarity_search (%s, %s, %s)"
+VECTOR_FEATURES_SQL = """
+SELECT extversion,
+       EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'idx_chunks_embedding_halfvec')
+FROM pg_extension WHERE extname = 'vector'
+"""
+VECTOR_DISTANCE = "embedding <=> $2"
+HALFVEC_DISTANCE = "embedding::halfvec(768) <=> $2::halfvec(768)"
 
+
+# Compare an installed pgvector version such as '0.8.0' against (major, minor)
+def pgvector_at_least(extversion: Optional[str], minimum: tuple) -> bool:
     try:
-        cursor = conn.cursor()
+        return tuple(int(part) for part in extversion.split('.')[:2]) >= minimum
+    except (AttributeError, ValueError):
+        return False
 
-        # Manually convert the Python list to PostgreSQL vector string format
-        vector_str = '[' + ','.join([str(x) for x in query_embedding]) + ']'
-
-        cursor.execute(f"""
-            SELECT 
-                c.chunk_id,
-                c.document_id,
-                c.user_id,
-                c.content,
-                c.metadata,
-                d.file_name,
-                1 - (c.embedding <=> '{vector_str}'::vector) AS similarity_score
-            FROM 
-                chunks c
-            JOIN 
-                documents d ON c.document_id = d.document_id
-            WHERE 
-                c.user_id = %s
-            ORDER BY 
-                c.embedding <=> '{vector_str}'::vector
-            LIMIT %s
-        """, (user_id, limit))
-
-        rows = cursor.fetchall()
-        results = []
-        for row in rows:
-            chunk_id, document_id, user_id, content, metadata, file_name, similarity_score = row
-            results.append({
-                'chunk_id': chunk_id,
-                'document_id': document_id,
-                'user_id': user_id,
-                'content': content,
-                'metadata': metadata,
-                'file_name': file_name,
-                'similarity_score': float(similarity_score)
-            })
 
-        return results
+# Connection kept for the life of the container so warm invocations skip the
+# Secrets Manager lookup and the connection handshake
+_pg_conn = None
+
+def get_conn(reconnect=False):
+    """
+    Get the container's PostgreSQL connection, connecting on first use or if it was closed.
+    
+    Args:
+        reconnect (bool): Discard the current connection and open a new one
+    """
+    global _pg_conn
+    if reconnect and _pg_conn is not None:
+        try:
+            _pg_conn.close()
+        except Exception:
+            pass
+        _pg_conn = None
+    if _pg_conn is None or _pg_conn.closed:
+        conn = get_postgres_connection(get_postgres_credentials())
+        # Don't leave a transaction open between invocations
+        conn.autocommit = True
+        register_vector(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(VECTOR_FEATURES_SQL)
+            extversion, halfvec_index = cursor.fetchone() or (None, False)
+            # Order by the halfvec expression when db_init built the half-precision
+            # index (pgvector 0.7.0+); the returned score stays full precision
+            distance = HALFVEC_DISTANCE if halfvec_index else VECTOR_DISTANCE
+            cursor.execute(PREPARE_SIMILARITY_SEARCH.format(distance=distance))
+            # Candidate list size for HNSW scans; the connection is in autocommit
+            # mode, so set it for the session rather than per transaction
+            cursor.execute("SET hnsw.ef_search = %s", (HNSW_EF_SEARCH,))
+            # Chunks from many users share one HNSW index, so filtering on user_id
+            # after the scan can leave fewer than `limit` rows. pgvector 0.8.0+ can
+            # keep scanning until enough rows pass the filter, in distance order.
+            if pgvector_at_least(extversion, (0, 8)):
+                cursor.execute("SET hnsw.iterative_scan = strict_order")
+        # Publish the connection only once it is set up; other threads check it
+        _pg_conn = conn
+    return _pg_conn
+
+@atexit.register
+def _close_conn():
+    if _pg_conn is not None and not _pg_conn.closed:
+        _pg_conn.close()
+
+# Run a query on a connection and return all rows
+def fetch_all(conn, sql: str, params, cursor_factory=None) -> List[tuple]:
+    cursor = conn.cursor(cursor_factory=cursor_factory)
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+# Vector similarity search using pgvector
+def similarity_search(query_embedding: List[float], user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+    # Bound through pgvector's adapter rather than formatted into the SQL
+    params = (user_id, np.asarray(query_embedding, dtype=np.float32), limit)
+
+    try:
+        # Rows come back as dicts keyed by column name, ready to serialize;
+        # similarity_score is float8 so it is already a Python float
+        try:
+            return fetch_all(get_conn(), EXECUTE_SIMILARITY_SEARCH, params, cursor_factory=RealDictCursor)
+        except psycopg2.OperationalError as e:
+            # The server may have dropped the connection while the container was idle
+            logger.warning(f"Reconnecting to PostgreSQL: {str(e)}")
+            return fetch_all(get_conn(reconnect=True), EXECUTE_SIMILARITY_SEARCH, params,
+                             cursor_factory=RealDictCursor)
 
     except Exception as e:
         logger.error(f"Similarity search failed: {str(e)}")
         raise e
-    finally:
-        cursor.close()
-        conn.close()
 
 
-# Generate a response from Gemini using relevant context
-def generate_response(model_name: str, query: str, relevant_chunks: List[Dict[str, Any]]) -> str:
-    context = "\n\n".join([f"Document: {c['file_name']}\nContent: {c['content']}" for c in relevant_chunks])
+# Users known to have chunks: user_id -> checked_at. Only positive results are
+# cached, so a fresh upload is found at once; entries expire so deletions are noticed.
+USER_CHUNKS_TTL = 60  # seconds
+MAX_CACHED_USERS = 10000
+_user_chunks_cache = {}
+
+def user_has_chunks(user_id: str) -> bool:
+    cached = _user_chunks_cache.get(user_id)
+    now = time.monotonic()
+    if cached is not None and now - cached < USER_CHUNKS_TTL:
+        return True
+    try:
+        rows = fetch_all(get_conn(), "SELECT 1 FROM chunks WHERE user_id = %s LIMIT 1", (user_id,))
+    except Exception as e:
+        # Let similarity_search run and handle the database error
+        logger.warning(f"Checking for user chunks failed: {str(e)}")
+        return True
+    if not rows:
+        # Not cached, so documents uploaded a moment ago are found on the next query
+        return False
+    if len(_user_chunks_cache) >= MAX_CACHED_USERS:
+        _user_chunks_cache.clear()
+    _user_chunks_cache[user_id] = now
+    return True
+
+# Format retrieved chunks as the context passed to Gemini. The pieces are
+# collected and joined once, so each chunk's text is copied a single time.
+def build_context(relevant_chunks: List[Dict[str, Any]]) -> str:
+    parts = []
+    append = parts.append
+    for c in relevant_chunks:
+        append('\n\nDocument: ' if parts else 'Document: ')
+        append(c['file_name'])
+        append('\nContent: ')
+        append(c['content'])
+    return ''.join(parts)
+
+# Stream a response from Gemini using the context built from relevant chunks,
+# yielding text as it is generated
+def stream_response(model_name: str, query: str, context: str) -> Iterator[str]:
     prompt = f"""
     Answer the following question based on the provided context.
     If the answer is not in the context, say "I don't have enough information."
@@ -165,33 +399,49 @@ def generate_response(model_name: str, query: str, relevant_chunks: List[Dict[st
 
     Answer:
     """
+    for chunk in client.models.generate_content_stream(
+        model=model_name,
+        contents=prompt,
+        config=GENERATION_CONFIG
+    ):
+        if chunk.text:
+            yield chunk.text
+
+# Generate a complete response from Gemini; API Gateway REST integrations
+# buffer the Lambda response, so the streamed text is collected here
+def generate_response(model_name: str, query: str, context: str) -> str:
     try:
-        config = types.GenerateContentConfig(
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            top_k=TOP_K,
-            max_output_tokens=MAX_OUTPUT_TOKENS,
-            response_mime_type='application/json'
-        )
-        result = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=config
-        )
-        return result.text
+        return "".join(stream_response(model_name, query, context))
     except Exception as e:
         logger.error(f"Failed to generate response: {str(e)}")
-        return "Sorry, I couldn't generate a response. Please try again later."
+        return GENERATION_FAILED_RESPONSE
+
+# Evaluator replies are constrained to {"score": <number>}, a handful of tokens
+RATING_CONFIG = types.GenerateContentConfig(
+    response_mime_type='application/json',
+    response_schema={
+        "type": "object",
+        "properties": {"score": {"type": "number"}},
+        "required": ["score"]
+    },
+    max_output_tokens=16,
+    temperature=0.0
+)
 
 # RAG Evaluation functionality
 class GeminiRagEvaluator:
     """RAG Evaluator using Google's Gemini model"""
     
-    def __init__(self, model_name, google_api_key=None):
-        """Initialize the evaluator with the Gemini model"""
+    def __init__(self, model_name, google_api_key=None, gemini_client=None):
+        """Initialize the evaluator with the Gemini model, sharing the module's client by default"""
         self.model_name = model_name
         self.google_api_key = google_api_key
-        self.client = genai.Client(api_key=self.google_api_key)
+        if gemini_client is not None:
+            self.client = gemini_client
+        elif google_api_key and google_api_key != GEMINI_API_KEY:
+            self.client = genai.Client(api_key=self.google_api_key)
+        else:
+            self.client = client
         
     def evaluate_response(self, query: str, answer: str, contexts: List[str], 
                          ground_truth: Optional[str] = None) -> Dict[str, float]:
@@ -207,19 +457,54 @@ class GeminiRagEvaluator:
         Returns:
             Dict with evaluation metrics
         """
-        results = {}
-        
-        # Evaluate answer relevancy
-        results["answer_relevancy"] = self._evaluate_answer_relevancy(query, answer)
-        
-        # Evaluate faithfulness to the context
-        results["faithfulness"] = self._evaluate_faithfulness(query, answer, contexts)
+        # Each metric is an independent Gemini request, so send them concurrently
+        futures = {
+            "answer_relevancy": _executor.submit(self._evaluate_answer_relevancy, query, answer),
+            "faithfulness": _executor.submit(self._evaluate_faithfulness, query, answer, contexts)
+        }
         
         # If ground truth is provided, evaluate precision
         if ground_truth:
-            results["context_precision"] = self._evaluate_context_precision(answer, ground_truth)
+            futures["context_precision"] = _executor.submit(self._evaluate_context_precision, answer, ground_truth)
         
-        return results
+        return {metric: future.result() for metric, future in futures.items()}
+    
+    def evaluate_metric(self, metric: str, query: str, answer: str, contexts: List[str],
+                        ground_truth: Optional[str] = None) -> float:
+        """
+        Evaluate a single metric, so callers can score metrics independently
+        
+        Args:
+            metric: One of EVALUATION_METRICS
+            query: The user's query
+            answer: The generated answer
+            contexts: Retrieved context passages
+            ground_truth: Ground truth answer, required for context_precision
+            
+        Returns:
+            Score between 0 and 1
+        """
+        if metric == "answer_relevancy":
+            return self._evaluate_answer_relevancy(query, answer)
+        if metric == "faithfulness":
+            return self._evaluate_faithfulness(query, answer, contexts)
+        if metric == "context_precision":
+            return self._evaluate_context_precision(answer, ground_truth)
+        raise ValueError(f"Unknown evaluation metric: {metric}")
+    
+    def _rate(self, prompt: str, metric: str) -> float:
+        """Ask Gemini for a rating and parse it, defaulting to 0.5"""
+        try:
+            response = self.client.models.generate_content(
+                model=self.model_name,
+                contents=[prompt],
+                config=RATING_CONFIG
+            )
+            # Clamp the score to 0-1
+            return min(max(float(orjson.loads(response.text)["score"]), 0.0), 1.0)
+        except Exception as e:
+            logger.error(f"Error evaluating {metric} with Gemini: {str(e)}")
+            return 0.5
     
     def _evaluate_answer_relevancy(self, query: str, answer: str) -> float:
         """Evaluate how relevant the answer is to the query"""
@@ -231,29 +516,8 @@ class GeminiRagEvaluator:
         
         Rating (0-1):"""
         
-        try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[prompt]
-            )
-            rating_text = response.text.strip()
-            
-            # Extract the numerical rating
-            if rating_text:
-                try:
-                    # Find the first float in the response
-                    import re
-                    matches = re.findall(r"0\.\d+|\d+\.?\d*", rating_text)
-                    if matches:
-                        rating = float(matches[0])
-                        return min(max(rating, 0.0), 1.0)  # Ensure value is between 0 and 1
-                except:
-                    return 0.5
-            return 0.5
-        except Exception as e:
-            logger.error(f"Error evaluating answer relevancy with Gemini: {str(e)}")
-            return 0.5
-                
+        return self._rate(prompt, "answer relevancy")
+    
     def _evaluate_faithfulness(self, query: str, answer: str, contexts: List[str]) -> float:
         """Evaluate how faithful the answer is to the provided contexts"""
         # Join contexts with separators for clarity
@@ -270,28 +534,7 @@ class GeminiRagEvaluator:
         
         Faithfulness rating (0-1):"""
         
-        try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[prompt]
-            )
-            rating_text = response.text.strip()
-            
-            # Extract the numerical rating
-            if rating_text:
-                try:
-                    # Find the first float in the response
-                    import re
-                    matches = re.findall(r"0\.\d+|\d+\.?\d*", rating_text)
-                    if matches:
-                        rating = float(matches[0])
-                        return min(max(rating, 0.0), 1.0)  # Ensure value is between 0 and 1
-                except:
-                    return 0.5
-            return 0.5
-        except Exception as e:
-            logger.error(f"Error evaluating faithfulness with Gemini: {str(e)}")
-            return 0.5
+        return self._rate(prompt, "faithfulness")
     
     def _evaluate_context_precision(self, answer: str, ground_truth: str) -> float:
         """Evaluate how close the answer is to the ground truth"""
@@ -304,28 +547,12 @@ class GeminiRagEvaluator:
         
         Rating (0-1):"""
         
-        try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[prompt]
-            )
-            rating_text = response.text.strip()
-            
-            # Extract the numerical rating
-            if rating_text:
-                try:
-                    # Find the first float in the response
-                    import re
-                    matches = re.findall(r"0\.\d+|\d+\.?\d*", rating_text)
-                    if matches:
-                        rating = float(matches[0])
-                        return min(max(rating, 0.0), 1.0)  # Ensure value is between 0 and 1
-                except:
-                    return 0.5
-            return 0.5
-        except Exception as e:
-            logger.error(f"Error evaluating context precision with Gemini: {str(e)}")
-            return 0.5
+        return self._rate(prompt, "context precision")
+
+# Evaluators are reused across requests, one per requested model
+@functools.lru_cache(maxsize=8)
+def get_evaluator(model_name: str) -> GeminiRagEvaluator:
+    return GeminiRagEvaluator(model_name, gemini_client=client)
 
 # Function to evaluate the RAG response
 def evaluate_rag_response(model_name: str, query: str, answer: str, contexts: List[str], ground_truth: Optional[str] = None) -> Dict[str, float]:
@@ -349,11 +576,11 @@ def evaluate_rag_response(model_name: str, query: str, answer: str, contexts: Li
                 results["context_precision"] = 0.0
             return results
             
-        evaluator = GeminiRagEvaluator(model_name, GEMINI_API_KEY)
+        evaluator = get_evaluator(model_name)
         return evaluator.evaluate_response(
             query=query,
             answer=answer,
-            contexts=[c["content"] for c in contexts],
+            contexts=contexts,
             ground_truth=ground_truth
         )
     except Exception as e:
@@ -364,17 +591,163 @@ def evaluate_rag_response(model_name: str, query: str, answer: str, contexts: Li
             results["context_precision"] = 0.5
         return results
 
+# Function to evaluate a single metric of a RAG response
+def evaluate_rag_metric(model_name: str, metric: str, query: str, answer: str, contexts: List[str], ground_truth: Optional[str] = None) -> float:
+    """
+    Evaluate one RAG metric using Gemini
+    
+    Args:
+        metric: One of EVALUATION_METRICS
+        query: The user's question
+        answer: The generated answer
+        contexts: List of context passages used for generation
+        ground_truth: Optional ground truth answer
+        
+    Returns:
+        Score between 0 and 1
+    """
+    if not ENABLE_EVALUATION:
+        return 0.0
+    try:
+        evaluator = get_evaluator(model_name)
+        return evaluator.evaluate_metric(metric, query, answer, contexts, ground_truth)
+    except Exception as e:
+        logger.error(f"RAG evaluation of {metric} failed: {str(e)}")
+        return 0.5
+
+# Handle an 'evaluate' request scoring one metric of an existing answer
+def handle_evaluate_request(body: Dict[str, Any]) -> Dict[str, Any]:
+    metric = body.get('metric')
+    query = body.get('query')
+    answer = body.get('answer')
+    ground_truth = body.get('ground_truth')
+    
+    if metric not in EVALUATION_METRICS or not query or not answer:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'message': f"Query, answer and a metric from {list(EVALUATION_METRICS)} are required"})
+        }
+    if metric == 'context_precision' and not ground_truth:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'message': 'Ground truth is required for context_precision'})
+        }
+    
+    score = evaluate_rag_metric(
+        body.get('model_name', GEMINI_MODEL),
+        metric,
+        query=query,
+        answer=answer,
+        contexts=body.get('contexts', []),
+        ground_truth=ground_truth
+    )
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'metric': metric, 'score': score})
+    }
+
+# Retrieve, generate and optionally evaluate the answer to a single query
+def run_query(query: str, user_id: str, model_name: str, enable_evaluation: bool,
+              ground_truth: Optional[str] = None, projection: Optional[List[str]] = None) -> Dict[str, Any]:
+    # On a cold container, fetch credentials and connect while the query is embedded
+    connecting = _executor.submit(get_conn) if _pg_conn is None or _pg_conn.closed else None
+    query_embedding = embed_query(query)
+    if connecting is not None:
+        try:
+            connecting.result()
+        except Exception as e:
+            # similarity_search connects again and reports the error
+            logger.warning(f"Early PostgreSQL connection failed: {str(e)}")
+    # Users who haven't uploaded anything get no search, generation or evaluation
+    if not user_has_chunks(user_id):
+        return {
+            'query': query,
+            'response': NO_DOCUMENTS_RESPONSE,
+            'results': [],
+            'count': 0,
+            'evaluation': {}
+        }
+    relevant_chunks = similarity_search(query_embedding, user_id)
+    context = build_context(relevant_chunks)
+    response = generate_response(model_name, query, context)
+    
+    # Evaluate the response if enabled, one context per chunk
+    evaluation_results = {}
+    if enable_evaluation:
+        evaluation_results = evaluate_rag_response(
+            model_name,
+            query=query,
+            answer=response,
+            contexts=[c['content'] for c in relevant_chunks],
+            ground_truth=ground_truth
+        )
+
+    # Return only the chunk fields the client asked for
+    if projection:
+        relevant_chunks = [{k: chunk[k] for k in projection if k in chunk} for chunk in relevant_chunks]
+
+    return {
+        'query': query,
+        'response': response,
+        'results': relevant_chunks,
+        'count': len(relevant_chunks),
+        'evaluation': evaluation_results
+    }
+
+# Handle a batch of queries, keeping a per-item status so one failure doesn't lose the others
+def handle_batch_request(body: Dict[str, Any]) -> Dict[str, Any]:
+    queries = body.get('queries')
+    
+    if not isinstance(queries, list) or not queries or len(queries) > MAX_BATCH_QUERIES:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'message': f"Queries must be a list of 1 to {MAX_BATCH_QUERIES} questions"})
+        }
+    
+    user_id = body.get('user_id', 'system')
+    enable_evaluation = body.get('enable_evaluation', ENABLE_EVALUATION)
+    model_name = body.get('model_name', GEMINI_MODEL)
+    
+    results = []
+    for query in queries:
+        if not query:
+            results.append({'status': 400, 'error': 'Query is required'})
+            continue
+        try:
+            results.append({
+                'status': 200,
+                'data': run_query(query, user_id, model_name, enable_evaluation,
+                                  projection=body.get('projection'))
+            })
+        except Exception as e:
+            logger.error(f"Batch query failed: {str(e)}")
+            results.append({'status': 500, 'error': f"Internal error: {str(e)}"})
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'results': results})
+    }
+
 # Lambda handler
 def handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
     try:
+        # The event carries the user's query and evaluation contexts, so it is only
+        # logged when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received event: %s", dumps(event))
+        
          # Extract body from the request for API Gateway calls
         body = {}
         if 'body' in event:
             if isinstance(event.get('body'), str) and event.get('body'):
                 try:
-                    body = json.loads(event['body'])
-                except json.JSONDecodeError:
+                    body = orjson.loads(event['body'])
+                except orjson.JSONDecodeError:
                     body = {}
             elif isinstance(event.get('body'), dict):
                 body = event.get('body')
@@ -387,12 +760,20 @@ def handler(event, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
+                'body': dumps({
                     'message': 'Query processor is healthy',
                     'stage': STAGE
                 })
             }
 
+        # Score a single metric of an answer the client already has
+        if body.get('operation') == 'evaluate':
+            return handle_evaluate_request(body)
+
+        # Several queries bundled into one round trip
+        if 'queries' in body:
+            return handle_batch_request(body)
+
         query = body.get('query')
         user_id = body.get('user_id', 'system')
         ground_truth = body.get('ground_truth')
@@ -403,34 +784,14 @@ def handler(event, context):
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Query is required'})
+                'body': dumps({'message': 'Query is required'})
             }
 
-        query_embedding = embed_query(query)
-        relevant_chunks = similarity_search(query_embedding, user_id)
-        response = generate_response(model_name, query, relevant_chunks)
-        
-        # Evaluate the response if enabled
-        evaluation_results = {}
-        if enable_evaluation:
-            evaluation_results = evaluate_rag_response(
-                model_name,
-                query=query,
-                answer=response,
-                contexts=relevant_chunks,
-                ground_truth=ground_truth
-            )
-
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'query': query,
-                'response': response,
-                'results': relevant_chunks,
-                'count': len(relevant_chunks),
-                'evaluation': evaluation_results
-            }, cls=DecimalEncoder)
+            'body': dumps(run_query(query, user_id, model_name, enable_evaluation, ground_truth,
+                                         body.get('projection')))
         }
 
     except Exception as e:
@@ -438,5 +799,5 @@ def handler(event, context):
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'message': f"Internal error: {str(e)}"})
+            'body': dumps({'message': f"Internal error: {str(e)}"})
         }
\ No newline at end of file
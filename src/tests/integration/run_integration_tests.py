@@ -1,7 +1,7 @@
 import os
 import sys
 import json
-import requests
+import httpx
 from datetime import datetime
 
 # Get the API endpoint from environment variables
@@ -82,7 +82,7 @@ def write_junit_xml(tests, output_file="integration-test-results.xml"):
     log(f"Test results written to {output_file}")
     log(f"Total: {total}, Errors: {errors}, Failures: {failures}, Skipped: {skipped}")
 
-def test_api_health():
+def test_api_health(client):
     """Test that the API is healthy."""
     test_result = {
         "name": "test_api_health",
@@ -94,7 +94,7 @@ def test_api_health():
         
         # Use the auth endpoint with 'healthcheck' action which doesn't require authentication
         payload = {"action": "healthcheck"}
-        response = requests.post(f"{API_ENDPOINT}/auth", json=payload, timeout=10)
+        response = client.post(f"{API_ENDPOINT}/auth", json=payload)
         log(f"Health check status code: {response.status_code}")
         
         if response.status_code != 200:
@@ -134,10 +134,11 @@ def main():
     
     log(f"Running integration tests against API endpoint: {API_ENDPOINT}")
     
-    # Run a simple health check test
+    # Run a simple health check test, sharing one connection across tests
     tests = []
-    health_result = test_api_health()
-    tests.append(health_result)
+    with httpx.Client(http2=True, timeout=10.0) as client:
+        health_result = test_api_health(client)
+        tests.append(health_result)
     
     # Write the test results to a JUnit XML file
     write_junit_xml(tests)
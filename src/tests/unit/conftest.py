@@ -3,7 +3,9 @@ Global pytest configuration
 """
 import os
 import sys
-from unittest.mock import MagicMock, patch
+import types
+import pytest
+from unittest.mock import MagicMock
 
 # ------------------------------------------------------------------------------
 # Path Configuration
@@ -25,41 +27,6 @@ if src_dir not in sys.path:
 # Set AWS default region for boto3
 os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
 
-# ------------------------------------------------------------------------------
-# Mock Setup
-# ------------------------------------------------------------------------------
-
-# Mock response for Secrets Manager
-mock_secret_response = MagicMock()
-mock_secret_response.return_value = {"SecretString": '{"GEMINI_API_KEY": "test-api-key"}'}
-
-# Mock boto3
-mock_boto3 = MagicMock()
-mock_client = MagicMock()
-mock_resource = MagicMock()
-mock_client.get_secret_value = mock_secret_response
-mock_boto3.client.return_value = mock_client
-mock_boto3.resource.return_value = mock_resource
-
-# Mock Google Gemini
-mock_google = MagicMock()
-mock_genai = MagicMock()
-mock_genai_types = MagicMock()
-mock_genai_client = MagicMock()
-
-# Mock PostgreSQL
-mock_psycopg2 = MagicMock()
-mock_psycopg2_extensions = MagicMock()
-mock_psycopg2_extensions.ISOLATION_LEVEL_AUTOCOMMIT = 0
-
-# Mock LangChain
-mock_langchain = MagicMock()
-mock_document_loaders = MagicMock()
-mock_text_splitter = MagicMock()
-mock_schema = MagicMock()
-mock_langchain_community = MagicMock()
-mock_langchain_community_document_loaders = MagicMock()
-
 # ------------------------------------------------------------------------------
 # Mock Classes
 # ------------------------------------------------------------------------------
@@ -70,22 +37,87 @@ class MockDocument:
         self.page_content = page_content
         self.metadata = metadata or {}
 
+# Create a ClientError class for botocore
+class MockClientError(Exception):
+    def __init__(self, error_response, operation_name):
+        super().__init__(f"An error occurred ({error_response['Error']['Code']}) when calling the {operation_name} operation")
+        self.response = error_response
+        self.operation_name = operation_name
+
+# ------------------------------------------------------------------------------
+# Mock Setup
+# ------------------------------------------------------------------------------
+
+def _stub(name, **attributes):
+    """Create a plain module for imports that only need the module, or a few names, to exist."""
+    module = types.ModuleType(name)
+    for attribute, value in attributes.items():
+        setattr(module, attribute, value)
+    return module
+
+def build_module_mocks():
+    """Build the third-party modules replaced for the unit tests, keyed by module name."""
+    # Mock response for Secrets Manager
+    mock_secret_response = MagicMock()
+    mock_secret_response.return_value = {"SecretString": '{"GEMINI_API_KEY": "test-api-key"}'}
+    
+    # Mock boto3
+    mock_boto3 = MagicMock()
+    mock_client = MagicMock()
+    mock_resource = MagicMock()
+    mock_client.get_secret_value = mock_secret_response
+    mock_boto3.client.return_value = mock_client
+    mock_boto3.resource.return_value = mock_resource
+    
+    # Mock botocore; auth_handler creates its Cognito client from a botocore session
+    botocore = _stub(
+        'botocore',
+        session=_stub('botocore.session', get_session=MagicMock()),
+        config=_stub('botocore.config', Config=MagicMock()),
+        exceptions=_stub('botocore.exceptions', ClientError=MockClientError)
+    )
+    
+    # Mock Google Gemini
+    mock_genai = MagicMock()
+    
+    return {
+        'boto3': mock_boto3,
+        'boto3.s3': mock_boto3.s3,
+        'boto3.s3.transfer': mock_boto3.s3.transfer,
+        'botocore': botocore,
+        'botocore.session': botocore.session,
+        'botocore.config': botocore.config,
+        'botocore.exceptions': botocore.exceptions,
+        'psycopg2': MagicMock(),
+        'psycopg2.extensions': _stub('psycopg2.extensions', ISOLATION_LEVEL_AUTOCOMMIT=0),
+        'psycopg2.extras': MagicMock(),
+        'pgvector': _stub('pgvector'),
+        'pgvector.psycopg2': MagicMock(),
+        'numpy': MagicMock(),
+        'google': _stub('google', genai=mock_genai),
+        'google.genai': mock_genai,
+        'google.genai.types': _stub('google.genai.types'),
+        'langchain': _stub('langchain'),
+        'langchain.document_loaders': _stub('langchain.document_loaders'),
+        'langchain.text_splitter': _stub('langchain.text_splitter', RecursiveCharacterTextSplitter=MagicMock()),
+        'langchain.schema': _stub('langchain.schema', Document=MockDocument),
+        'langchain_community': _stub('langchain_community'),
+        'langchain_community.document_loaders': _stub('langchain_community.document_loaders'),
+        'pypdf': MagicMock(),
+    }
+
 # ------------------------------------------------------------------------------
 # Module Injection into sys.modules
 # ------------------------------------------------------------------------------
 
-sys.modules['boto3'] = mock_boto3
-sys.modules['botocore'] = MagicMock()
-sys.modules['botocore.exceptions'] = MagicMock()
-sys.modules['psycopg2'] = mock_psycopg2
-sys.modules['psycopg2.extensions'] = mock_psycopg2_extensions
-sys.modules['google'] = mock_google
-sys.modules['google.genai'] = mock_genai
-sys.modules['google.genai.types'] = mock_genai_types
-sys.modules['langchain'] = mock_langchain
-sys.modules['langchain.document_loaders'] = mock_document_loaders
-sys.modules['langchain.text_splitter'] = mock_text_splitter
-sys.modules['langchain.schema'] = mock_schema
-sys.modules['langchain.schema'].Document = MockDocument
-sys.modules['langchain_community'] = mock_langchain_community
-sys.modules['langchain_community.document_loaders'] = mock_langchain_community_document_loaders
+# Session-wide patch of sys.modules, undone when pytest shuts down
+_module_patch = pytest.MonkeyPatch()
+
+def pytest_configure(config):
+    """Install the module mocks once, before the test modules are imported."""
+    for name, module in build_module_mocks().items():
+        _module_patch.setitem(sys.modules, name, module)
+
+def pytest_unconfigure(config):
+    """Restore the real modules."""
+    _module_patch.undo()
@@ -0,0 +1,209 @@
+"""Test cases for the auth_handler Lambda function."""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import pytest
+from unittest.mock import MagicMock
+
+"""Set up test environment."""
+# Set environment variables
+os.environ["USER_POOL_ID"] = "test-pool"
+os.environ["CLIENT_ID"] = "test-client"
+
+# Now import the module under test - mocks are already in place globally from conftest
+import auth_handler.auth_handler as auth_handler
+from auth_handler.auth_handler import handler, refresh_token, login_user
+
+
+class NotAuthorizedException(Exception):
+    pass
+
+
+class UserNotConfirmedException(Exception):
+    pass
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    """Patch auth_handler's Cognito client and the error classes it catches."""
+    mock_cognito = MagicMock()
+    mock_cognito.initiate_auth.return_value = {
+        "AuthenticationResult": {
+            "AccessToken": "access",
+            "IdToken": "id",
+            "RefreshToken": "refresh",
+            "ExpiresIn": 3600
+        }
+    }
+    monkeypatch.setattr(auth_handler, "cognito", mock_cognito)
+    monkeypatch.setattr(auth_handler, "NotAuthorizedException", NotAuthorizedException)
+    monkeypatch.setattr(auth_handler, "UserNotConfirmedException", UserNotConfirmedException)
+    monkeypatch.setattr(auth_handler, "_refresh_cache", {})
+    monkeypatch.setattr(auth_handler, "_bad_logins", {})
+    return mock_cognito
+
+
+@pytest.fixture
+def client_secret(monkeypatch):
+    """Configure an app client secret and return the SECRET_HASH expected for a username."""
+    monkeypatch.setattr(auth_handler, "_HMAC_TEMPLATE", hmac.new(b"test-secret", digestmod=hashlib.sha256))
+
+    def secret_hash(username):
+        digest = hmac.new(b"test-secret", (username + "test-client").encode(), hashlib.sha256).digest()
+        return base64.b64encode(digest).decode()
+    return secret_hash
+
+
+def test_handler_healthcheck():
+    """Test the Lambda handler for a health check."""
+    response = handler({"action": "healthcheck"}, {})
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["message"] == "Authentication service is healthy"
+
+
+def test_secret_hash_param(client_secret):
+    """Test that SECRET_HASH is the base64 HMAC of username + client id."""
+    assert auth_handler._secret_hash_param("user@example.com") == {
+        "SecretHash": client_secret("user@example.com")
+    }
+    assert auth_handler._secret_hash_param("user@example.com", "SECRET_HASH") == {
+        "SECRET_HASH": client_secret("user@example.com")
+    }
+
+
+def test_secret_hash_param_without_secret():
+    """Test that no SECRET_HASH is sent when the app client has no secret."""
+    assert auth_handler._HMAC_TEMPLATE is None
+    assert auth_handler._secret_hash_param("user@example.com") == {}
+
+
+def test_refresh_token_cached(cognito):
+    """Test that a repeated refresh is answered from the cache."""
+    first = refresh_token({"refresh_token": "refresh"})
+    second = refresh_token({"refresh_token": "refresh"})
+
+    # Verify one Cognito call and the same tokens with the remaining lifetime
+    cognito.initiate_auth.assert_called_once()
+    assert json.loads(first["body"])["access_token"] == "access"
+    body = json.loads(second["body"])
+    assert body["access_token"] == "access"
+    assert body["id_token"] == "id"
+    assert 0 < body["expires_in"] <= 3600
+
+
+def test_refresh_token_cache_expiry(cognito, monkeypatch):
+    """Test that cached tokens close to expiry are refreshed through Cognito."""
+    refresh_token({"refresh_token": "refresh"})
+
+    # Move the clock to just inside the margin before the cached tokens expire
+    now = auth_handler.time.monotonic()
+    monkeypatch.setattr(auth_handler.time, "monotonic",
+                        lambda: now + 3600 - auth_handler.REFRESH_CACHE_MARGIN + 1)
+    refresh_token({"refresh_token": "refresh"})
+
+    assert cognito.initiate_auth.call_count == 2
+
+
+def test_refresh_cache_margin_below_client_window():
+    """Test that the cache can answer refreshes the UI makes with under 300 seconds left."""
+    assert auth_handler.REFRESH_CACHE_MARGIN < 300
+
+
+def test_refresh_token_invalid(cognito):
+    """Test that a rejected refresh token drops its cached tokens."""
+    token_key = hashlib.sha256(b"refresh").digest()
+    auth_handler._refresh_cache[token_key] = (auth_handler.time.monotonic() + 10, ("old", "old"))
+    cognito.initiate_auth.side_effect = NotAuthorizedException()
+
+    response = refresh_token({"refresh_token": "refresh"})
+
+    assert response["statusCode"] == 401
+    assert auth_handler._refresh_cache == {}
+
+
+def test_login_user_bad_login_cached(cognito):
+    """Test that a rejected email/password pair is refused without calling Cognito again."""
+    cognito.initiate_auth.side_effect = NotAuthorizedException()
+    params = {"email": "user@example.com", "password": "wrong-password"}
+
+    first = login_user(params)
+    second = login_user(params)
+
+    assert first["statusCode"] == 401
+    assert second["statusCode"] == 401
+    cognito.initiate_auth.assert_called_once()
+
+
+def test_login_user_include_profile(cognito):
+    """Test that the user's attributes are returned as the profile when requested."""
+    cognito.admin_get_user.return_value = {
+        "UserAttributes": [{"Name": "email", "Value": "user@example.com"}, {"Name": "name", "Value": "Test"}]
+    }
+
+    response = login_user({"email": "user@example.com", "password": "password123", "include_profile": True})
+
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert body["profile"] == {"email": "user@example.com", "name": "Test"}
+    cognito.admin_get_user.assert_called_once_with(UserPoolId="test-pool", Username="user@example.com")
+
+
+def test_login_user_with_secret(cognito, client_secret):
+    """Test that login sends the SECRET_HASH of the email when a client secret is set."""
+    login_user({"email": "user@example.com", "password": "password123"})
+
+    auth_parameters = cognito.initiate_auth.call_args.kwargs["AuthParameters"]
+    assert auth_parameters["SECRET_HASH"] == client_secret("user@example.com")
+
+
+def test_invalid_input_skips_cognito(cognito):
+    """Test that malformed emails and short passwords are rejected before calling Cognito."""
+    invalid_email = login_user({"email": "not-an-email", "password": "password123"})
+    short_password = auth_handler.register_user({"email": "user@example.com", "password": "short"})
+
+    assert invalid_email == auth_handler.ERR_INVALID_EMAIL
+    assert short_password == auth_handler.ERR_PASSWORD_TOO_SHORT
+    cognito.initiate_auth.assert_not_called()
+    cognito.sign_up.assert_not_called()
+
+
+def test_refresh_token_without_secret(cognito):
+    """Test that a refresh without a client secret needs no username and sends no SECRET_HASH."""
+    response = refresh_token({"refresh_token": "refresh"})
+
+    assert response["statusCode"] == 200
+    assert cognito.initiate_auth.call_args.kwargs["AuthParameters"] == {"REFRESH_TOKEN": "refresh"}
+
+
+def test_refresh_token_with_secret(cognito, client_secret):
+    """Test that a refresh sends the SECRET_HASH of the username when a client secret is set."""
+    response = refresh_token({"refresh_token": "refresh", "username": "test-sub"})
+
+    assert response["statusCode"] == 200
+    auth_parameters = cognito.initiate_auth.call_args.kwargs["AuthParameters"]
+    assert auth_parameters["SECRET_HASH"] == client_secret("test-sub")
+
+
+def test_refresh_token_with_secret_requires_username(cognito, client_secret):
+    """Test that a refresh without a username is rejected when a client secret is set."""
+    response = refresh_token({"refresh_token": "refresh"})
+
+    assert response == auth_handler.ERR_USERNAME_REQUIRED
+    cognito.initiate_auth.assert_not_called()
+
+
+def test_confirm_forgot_password_clears_only_that_user(cognito):
+    """Test that a password reset forgets rejected logins for that user alone."""
+    cognito.initiate_auth.side_effect = NotAuthorizedException()
+    login_user({"email": "user@example.com", "password": "new-password"})
+    login_user({"email": "other@example.com", "password": "wrong-password"})
+
+    response = auth_handler.confirm_forgot_password({
+        "email": "user@example.com", "confirmation_code": "123456", "new_password": "new-password"
+    })
+
+    assert response["statusCode"] == 200
+    assert list(auth_handler._bad_logins) == ["other@example.com"]
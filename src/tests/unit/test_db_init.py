@@ -2,7 +2,7 @@
 import json
 import os
 import socket
-import unittest
+import pytest
 from unittest.mock import MagicMock, patch, call
 
 """Set up test environment."""
@@ -13,382 +13,419 @@ os.environ["MAX_RETRIES"] = "3"
 os.environ["RETRY_DELAY"] = "1"  # Short delay for tests
 
 # Now import the module under test - mocks are already in place globally from conftest
+import db_init.db_init as db_init
 from db_init.db_init import (
     handler, get_postgres_credentials, check_dns_resolution,
-    create_database_if_not_exists, initialize_database
+    create_database_if_not_exists, initialize_database, supports_hnsw,
+    supports_halfvec
 )
 
-class TestDbInit(unittest.TestCase):
-    """Test cases for the db_init Lambda function."""
-
-    def tearDown(self):
-        """Clean up test environment."""
-        # Clean up environment variables
-        for key in ["DB_SECRET_ARN", "STAGE", "MAX_RETRIES", "RETRY_DELAY"]:
-            if key in os.environ:
-                del os.environ[key]
-
-    @patch("db_init.db_init.secretsmanager")
-    def test_get_postgres_credentials(self, mock_secretsmanager):
-        """Test getting PostgreSQL credentials from Secrets Manager."""
-        # Mock the Secrets Manager response
-        mock_credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        mock_response = {"SecretString": json.dumps(mock_credentials)}
-        mock_secretsmanager.get_secret_value.return_value = mock_response
-
-        # Call the function
-        credentials = get_postgres_credentials()
-
-        # Verify results
-        self.assertEqual(credentials, mock_credentials)
-        mock_secretsmanager.get_secret_value.assert_called_once_with(
-            SecretId="test-db-secret"
-        )
-
-    @patch("db_init.db_init.socket.gethostbyname")
-    def test_check_dns_resolution_success(self, mock_gethostbyname):
-        """Test successful DNS resolution."""
-        # Mock the socket.gethostbyname function
-        mock_gethostbyname.return_value = "192.168.1.1"
-
-        # Call the function
-        result = check_dns_resolution("test-host")
-
-        # Verify results
-        self.assertTrue(result)
-        mock_gethostbyname.assert_called_once_with("test-host")
-
-    @patch("db_init.db_init.socket.gethostbyname")
-    def test_check_dns_resolution_failure(self, mock_gethostbyname):
-        """Test failed DNS resolution."""
-        # Mock the socket.gethostbyname function to raise an exception
-        mock_gethostbyname.side_effect = socket.gaierror()
-
-        # Call the function
-        result = check_dns_resolution("test-host")
-
-        # Verify results
-        self.assertFalse(result)
-        mock_gethostbyname.assert_called_once_with("test-host")
-        
-    @patch("db_init.db_init.psycopg2")
-    @patch("db_init.db_init.check_dns_resolution")
-    @patch("db_init.db_init.time.sleep")
-    def test_create_database_if_not_exists_success(self, mock_sleep, mock_check_dns, mock_psycopg2):
-        """Test creating a database successfully."""
-        # Mock DNS resolution
-        mock_check_dns.return_value = True
-        
-        # Mock the psycopg2 connection and cursor
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.cursor.return_value = mock_cursor
-        mock_psycopg2.connect.return_value = mock_conn
-        
-        # Mock cursor fetchone result (database does not exist)
-        mock_cursor.fetchone.return_value = None
-        
-        # Test credentials
-        credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        
-        # Call the function
-        result = create_database_if_not_exists(credentials, "test-db")
-        
-        # Verify results
-        self.assertTrue(result)
-        mock_check_dns.assert_called_once_with("test-host")
-        mock_psycopg2.connect.assert_called_once_with(
-            host="test-host",
-            port=5432,
-            user="test-user",
-            password="test-password",
-            dbname="postgres",
-            connect_timeout=10
-        )
-        
-        # Verify database creation
-        mock_cursor.execute.assert_any_call("SELECT 1 FROM pg_database WHERE datname = 'test-db'")
-        mock_cursor.execute.assert_any_call("CREATE DATABASE test-db")
-        
-    @patch("db_init.db_init.psycopg2")
-    @patch("db_init.db_init.check_dns_resolution")
-    @patch("db_init.db_init.time.sleep")
-    def test_create_database_if_not_exists_already_exists(self, mock_sleep, mock_check_dns, mock_psycopg2):
-        """Test when database already exists."""
-        # Mock DNS resolution
-        mock_check_dns.return_value = True
-        
-        # Mock the psycopg2 connection and cursor
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.cursor.return_value = mock_cursor
-        mock_psycopg2.connect.return_value = mock_conn
-        
-        # Mock cursor fetchone result (database exists)
-        mock_cursor.fetchone.return_value = (1,)
-        
-        # Test credentials
-        credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        
-        # Call the function
-        result = create_database_if_not_exists(credentials, "test-db")
-        
-        # Verify results
-        self.assertTrue(result)
-        mock_check_dns.assert_called_once_with("test-host")
-        mock_psycopg2.connect.assert_called_once()
-        
-        # Verify database check but no creation
-        mock_cursor.execute.assert_called_once_with("SELECT 1 FROM pg_database WHERE datname = 'test-db'")
-        
-    @patch("db_init.db_init.check_dns_resolution")
-    @patch("db_init.db_init.time.sleep")
-    def test_create_database_if_not_exists_dns_failure(self, mock_sleep, mock_check_dns):
-        """Test handling DNS resolution failure with retries."""
-        # Mock DNS resolution to fail
-        mock_check_dns.return_value = False
-        
-        # Test credentials
-        credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        
-        # Call the function (max retries is 3 from setup)
-        result = create_database_if_not_exists(credentials, "test-db")
-        
-        # Verify results
-        self.assertFalse(result)
-        self.assertEqual(mock_check_dns.call_count, 4)  # Initial + 3 retries
-        self.assertEqual(mock_sleep.call_count, 3)  # Sleep between retries
-        
-    @patch("db_init.db_init.psycopg2")
-    @patch("db_init.db_init.check_dns_resolution")
-    @patch("db_init.db_init.time.sleep")
-    def test_initialize_database_success(self, mock_sleep, mock_check_dns, mock_psycopg2):
-        """Test successful database initialization."""
-        # Mock DNS resolution
-        mock_check_dns.return_value = True
-        
-        # Mock the psycopg2 connection and cursor
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.cursor.return_value = mock_cursor
-        mock_psycopg2.connect.return_value = mock_conn
-        
-        # Test credentials
-        credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        
-        # Call the function
-        result = initialize_database(credentials)
-        
-        # Verify results
-        self.assertTrue(result)
-        mock_check_dns.assert_called_once_with("test-host")
-        mock_psycopg2.connect.assert_called_once_with(
-            host="test-host",
-            port=5432,
-            user="test-user",
-            password="test-password",
-            dbname="test-db",
-            connect_timeout=10
-        )
-        
-        # Verify SQL executions
-        self.assertTrue(mock_cursor.execute.call_count >= 7)  # Several SQL statements are executed
-        # Check that pgvector extension is created
-        mock_cursor.execute.assert_any_call("CREATE EXTENSION IF NOT EXISTS vector")
-        
-    @patch("db_init.db_init.check_dns_resolution")
-    @patch("db_init.db_init.time.sleep")
-    def test_initialize_database_dns_failure(self, mock_sleep, mock_check_dns):
-        """Test handling DNS resolution failure with retries in initialize_database."""
-        # Mock DNS resolution to fail
-        mock_check_dns.return_value = False
-        
-        # Test credentials
-        credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        
-        # Call the function (max retries is 3 from setup)
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Start each test with an empty DNS cache and clean up environment variables afterwards."""
+    db_init._DNS_CACHE.clear()
+    yield
+    for key in ["DB_SECRET_ARN", "STAGE", "MAX_RETRIES", "RETRY_DELAY"]:
+        if key in os.environ:
+            del os.environ[key]
+
+
+@pytest.fixture(scope="session")
+def credentials():
+    """PostgreSQL credentials as stored in Secrets Manager."""
+    return {
+        "host": "test-host",
+        "port": 5432,
+        "username": "test-user",
+        "password": "test-password",
+        "dbname": "test-db"
+    }
+
+
+# psycopg2 mock shared by the database tests: built once and reset before each test
+_PSYCOPG2_TEMPLATE = MagicMock()
+_PSYCOPG2_TEMPLATE.OperationalError = type("OperationalError", (Exception,), {})
+
+
+@pytest.fixture
+def psycopg2_mock(monkeypatch):
+    """Patch db_init's psycopg2 with the shared mock, cleared of earlier calls and results."""
+    _PSYCOPG2_TEMPLATE.reset_mock(side_effect=True)
+    _PSYCOPG2_TEMPLATE.connect.return_value.cursor.return_value.fetchone.reset_mock(return_value=True)
+    monkeypatch.setattr(db_init, "psycopg2", _PSYCOPG2_TEMPLATE)
+    return _PSYCOPG2_TEMPLATE
+
+
+@patch("db_init.db_init.secretsmanager")
+def test_get_postgres_credentials(mock_secretsmanager, credentials):
+    """Test getting PostgreSQL credentials from Secrets Manager."""
+    # Mock the Secrets Manager response
+    mock_response = {"SecretString": json.dumps(credentials)}
+    mock_secretsmanager.get_secret_value.return_value = mock_response
+
+    # Call the function
+    result = get_postgres_credentials()
+
+    # Verify results
+    assert result == credentials
+    mock_secretsmanager.get_secret_value.assert_called_once_with(
+        SecretId="test-db-secret"
+    )
+
+
+@patch("db_init.db_init.socket.gethostbyname")
+def test_check_dns_resolution_success(mock_gethostbyname):
+    """Test successful DNS resolution."""
+    # Mock the socket.gethostbyname function
+    mock_gethostbyname.return_value = "192.168.1.1"
+
+    # Call the function
+    result = check_dns_resolution("test-host")
+
+    # Verify results
+    assert result
+    mock_gethostbyname.assert_called_once_with("test-host")
+
+
+@patch("db_init.db_init.socket.gethostbyname")
+def test_check_dns_resolution_cached(mock_gethostbyname):
+    """Test that a successful DNS lookup is reused."""
+    # Mock the socket.gethostbyname function
+    mock_gethostbyname.return_value = "192.168.1.1"
+
+    # Call the function twice
+    assert check_dns_resolution("test-host")
+    assert check_dns_resolution("test-host")
+
+    # Verify only one lookup was made
+    mock_gethostbyname.assert_called_once_with("test-host")
+
+
+@patch("db_init.db_init.socket.gethostbyname")
+def test_check_dns_resolution_failure(mock_gethostbyname):
+    """Test failed DNS resolution."""
+    # Mock the socket.gethostbyname function to raise an exception
+    mock_gethostbyname.side_effect = socket.gaierror()
+
+    # Call the function
+    result = check_dns_resolution("test-host")
+
+    # Verify results
+    assert not result
+    mock_gethostbyname.assert_called_once_with("test-host")
+
+
+@patch("db_init.db_init.sql")
+@patch("db_init.db_init.check_dns_resolution")
+@patch("db_init.db_init.time.sleep")
+def test_create_database_if_not_exists_success(mock_sleep, mock_check_dns, mock_sql, psycopg2_mock, credentials):
+    """Test creating a database successfully."""
+    # Mock DNS resolution
+    mock_check_dns.return_value = True
+
+    # Mock cursor fetchone result (database does not exist)
+    mock_cursor = psycopg2_mock.connect.return_value.cursor.return_value
+    mock_cursor.fetchone.return_value = None
+
+    # Call the function
+    result = create_database_if_not_exists(credentials, "test-db")
+
+    # Verify results
+    assert result
+    mock_check_dns.assert_called_once_with("test-host")
+    psycopg2_mock.connect.assert_called_once_with(
+        host="test-host",
+        port=5432,
+        user="test-user",
+        password="test-password",
+        dbname="postgres",
+        connect_timeout=10
+    )
+
+    # Verify database creation
+    mock_cursor.execute.assert_any_call("SELECT 1 FROM pg_database WHERE datname = %s", ("test-db",))
+    mock_sql.SQL.assert_called_once_with("CREATE DATABASE {}")
+    mock_sql.Identifier.assert_called_once_with("test-db")
+    mock_cursor.execute.assert_any_call(mock_sql.SQL.return_value.format.return_value)
+
+
+@patch("db_init.db_init.check_dns_resolution")
+@patch("db_init.db_init.time.sleep")
+def test_create_database_if_not_exists_already_exists(mock_sleep, mock_check_dns, psycopg2_mock, credentials):
+    """Test when database already exists."""
+    # Mock DNS resolution
+    mock_check_dns.return_value = True
+
+    # Mock cursor fetchone result (database exists)
+    mock_cursor = psycopg2_mock.connect.return_value.cursor.return_value
+    mock_cursor.fetchone.return_value = (1,)
+
+    # Call the function
+    result = create_database_if_not_exists(credentials, "test-db")
+
+    # Verify results
+    assert result
+    mock_check_dns.assert_called_once_with("test-host")
+    psycopg2_mock.connect.assert_called_once()
+
+    # Verify database check but no creation
+    mock_cursor.execute.assert_called_once_with("SELECT 1 FROM pg_database WHERE datname = %s", ("test-db",))
+
+
+@patch("db_init.db_init.check_dns_resolution")
+@patch("db_init.db_init.time.sleep")
+def test_create_database_if_not_exists_dns_failure(mock_sleep, mock_check_dns, credentials):
+    """Test handling DNS resolution failure with retries."""
+    # Mock DNS resolution to fail
+    mock_check_dns.return_value = False
+
+    # Call the function (max retries is 3 from setup)
+    result = create_database_if_not_exists(credentials, "test-db")
+
+    # Verify results
+    assert not result
+    assert mock_check_dns.call_count == 4  # Initial + 3 retries
+    assert mock_sleep.call_count == 3  # Sleep between retries
+
+
+@patch("db_init.db_init.check_dns_resolution")
+@patch("db_init.db_init.time.sleep")
+def test_initialize_database_success(mock_sleep, mock_check_dns, psycopg2_mock, credentials):
+    """Test successful database initialization."""
+    # Mock DNS resolution
+    mock_check_dns.return_value = True
+    mock_cursor = psycopg2_mock.connect.return_value.cursor.return_value
+
+    # Call the function
+    result = initialize_database(credentials)
+
+    # Verify results
+    assert result
+    mock_check_dns.assert_called_once_with("test-host")
+    psycopg2_mock.connect.assert_called_once_with(
+        host="test-host",
+        port=5432,
+        user="test-user",
+        password="test-password",
+        dbname="test-db",
+        connect_timeout=10
+    )
+
+    # Verify SQL executions
+    assert mock_cursor.execute.call_count >= 7  # Several SQL statements are executed
+    # Check that pgvector extension is created
+    mock_cursor.execute.assert_any_call("CREATE EXTENSION IF NOT EXISTS vector")
+    mock_cursor.execute.assert_any_call("SET maintenance_work_mem = %s", ("256MB",))
+
+
+@pytest.mark.parametrize("indexdef, rebuilt", [
+    ("CREATE INDEX idx_chunks_embedding ON public.chunks USING ivfflat (embedding vector_cosine_ops) "
+     "WITH (lists='100')", True),
+    ("CREATE INDEX idx_chunks_embedding ON public.chunks USING hnsw (embedding vector_cosine_ops)", True),
+    ("CREATE INDEX idx_chunks_embedding ON public.chunks USING hnsw (embedding vector_cosine_ops) "
+     "WITH (m='24', ef_construction='128')", False),
+])
+@patch("db_init.db_init.check_dns_resolution", return_value=True)
+def test_initialize_database_rebuilds_outdated_index(mock_check_dns, psycopg2_mock, credentials, indexdef, rebuilt):
+    """Test that an existing embedding index other than the tuned HNSW one is dropped and rebuilt."""
+    mock_cursor = psycopg2_mock.connect.return_value.cursor.return_value
+    mock_cursor.fetchone.side_effect = [("0.6.0",), (indexdef,)]
+
+    # Call the function
+    assert initialize_database(credentials)
+
+    # Verify the index is only dropped when it differs
+    dropped = call("DROP INDEX idx_chunks_embedding") in mock_cursor.execute.call_args_list
+    assert dropped == rebuilt
+
+
+@pytest.mark.parametrize("indexdef, rebuilt", [
+    ("CREATE INDEX idx_chunks_embedding_halfvec ON public.chunks USING hnsw (((embedding)::halfvec(768)) "
+     "halfvec_cosine_ops) WITH (m='16', ef_construction='64')", True),
+    ("CREATE INDEX idx_chunks_embedding_halfvec ON public.chunks USING hnsw (((embedding)::halfvec(768)) "
+     "halfvec_cosine_ops) WITH (m='24', ef_construction='128')", False),
+])
+@patch("db_init.db_init.check_dns_resolution", return_value=True)
+def test_initialize_database_rebuilds_outdated_halfvec_index(mock_check_dns, psycopg2_mock, credentials,
+                                                              indexdef, rebuilt):
+    """Test that a differently tuned halfvec index is rebuilt and the old index dropped after it."""
+    mock_cursor = psycopg2_mock.connect.return_value.cursor.return_value
+    mock_cursor.fetchone.side_effect = [("0.7.0",), (indexdef,)]
+
+    assert initialize_database(credentials)
+
+    statements = [c.args[0] for c in mock_cursor.execute.call_args_list]
+    dropped = "DROP INDEX idx_chunks_embedding_halfvec" in statements
+    assert dropped == rebuilt
+    create = next(i for i, sql in enumerate(statements) if "idx_chunks_embedding_halfvec ON chunks" in sql)
+    assert statements.index("DROP INDEX IF EXISTS idx_chunks_embedding") > create
+
+
+@patch("db_init.db_init.check_dns_resolution", return_value=True)
+def test_initialize_database_keeps_old_index_on_halfvec_failure(mock_check_dns, psycopg2_mock, credentials):
+    """Test that the full-precision index is kept when the halfvec index fails to build."""
+    mock_cursor = psycopg2_mock.connect.return_value.cursor.return_value
+    mock_cursor.fetchone.side_effect = [("0.7.0",), None]
+
+    def execute(sql, params=None):
+        if "idx_chunks_embedding_halfvec ON chunks" in sql:
+            raise Exception("out of memory")
+    mock_cursor.execute.side_effect = execute
+
+    assert initialize_database(credentials)
+    assert call("DROP INDEX IF EXISTS idx_chunks_embedding") not in mock_cursor.execute.call_args_list
+
+
+def test_supports_hnsw():
+    """Test choosing HNSW only for pgvector 0.5.0 and later."""
+    assert supports_hnsw("0.5.0")
+    assert supports_hnsw("0.8.0")
+    assert not supports_hnsw("0.4.4")
+    assert not supports_hnsw(None)
+
+
+def test_supports_halfvec():
+    """Test indexing halfvec only for pgvector 0.7.0 and later."""
+    assert supports_halfvec("0.7.0")
+    assert supports_halfvec("0.8.0")
+    assert not supports_halfvec("0.6.2")
+    assert not supports_halfvec(None)
+
+
+@patch("db_init.db_init.check_dns_resolution")
+@patch("db_init.db_init.time.sleep")
+def test_initialize_database_dns_failure(mock_sleep, mock_check_dns, credentials):
+    """Test handling DNS resolution failure with retries in initialize_database."""
+    # Mock DNS resolution to fail
+    mock_check_dns.return_value = False
+
+    # Call the function (max retries is 3 from setup)
+    result = initialize_database(credentials)
+
+    # Verify results
+    assert not result
+    assert mock_check_dns.call_count == 4  # Initial + 3 retries
+    assert mock_sleep.call_count == 3  # Sleep between retries
+
+
+@patch("db_init.db_init.check_dns_resolution")
+def test_initialize_database_connection_error(mock_check_dns, psycopg2_mock, credentials):
+    """Test handling database connection errors."""
+    # Mock DNS resolution to succeed
+    mock_check_dns.return_value = True
+
+    # Mock the psycopg2 connection to raise an error
+    psycopg2_mock.connect.side_effect = psycopg2_mock.OperationalError("Connection refused")
+
+    # Call the function (max retries is 3 from setup)
+    with patch("db_init.db_init.time.sleep") as mock_sleep:
         result = initialize_database(credentials)
-        
-        # Verify results
-        self.assertFalse(result)
-        self.assertEqual(mock_check_dns.call_count, 4)  # Initial + 3 retries
-        self.assertEqual(mock_sleep.call_count, 3)  # Sleep between retries
-        
-    @patch("db_init.db_init.psycopg2")
-    @patch("db_init.db_init.check_dns_resolution")
-    def test_initialize_database_connection_error(self, mock_check_dns, mock_psycopg2):
-        """Test handling database connection errors."""
-        # Mock DNS resolution to succeed
-        mock_check_dns.return_value = True
-        
-        # Mock the psycopg2 connection to raise an error
-        mock_psycopg2.OperationalError = Exception
-        mock_psycopg2.connect.side_effect = mock_psycopg2.OperationalError("Connection refused")
-        
-        # Test credentials
-        credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        
-        # Call the function (max retries is 3 from setup)
-        with patch("db_init.db_init.time.sleep") as mock_sleep:
-            result = initialize_database(credentials)
-        
-        # Verify results
-        self.assertFalse(result)
-        mock_check_dns.assert_called_with("test-host")                  # ✅ was called at least once
-        self.assertEqual(mock_check_dns.call_count, 4)                  # ✅ was called exactly 4 times
-        mock_check_dns.assert_has_calls([call("test-host")] * 4)        # ✅ was called 4 times with same arg
-        self.assertEqual(mock_psycopg2.connect.call_count, 4)  # Initial + 3 retries
-        self.assertEqual(mock_sleep.call_count, 3)  # Sleep between retries
-        
-    @patch("db_init.db_init.get_postgres_credentials")
-    @patch("db_init.db_init.create_database_if_not_exists")
-    @patch("db_init.db_init.initialize_database")
-    def test_handler_success(self, mock_initialize, mock_create_db, mock_get_creds):
-        """Test the Lambda handler for successful execution."""
-        # Mock credential retrieval
-        mock_credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        mock_get_creds.return_value = mock_credentials
-        
-        # Mock database creation and initialization
-        mock_create_db.return_value = True
-        mock_initialize.return_value = True
-        
-        # Call the handler
-        response = handler({}, {})
-        
-        # Verify results
-        self.assertEqual(response["statusCode"], 200)
-        response_body = json.loads(response["body"])
-        self.assertEqual(response_body["message"], "Database initialization completed successfully")
-        
-        # Verify function calls
-        mock_get_creds.assert_called_once()
-        mock_create_db.assert_called_once_with(mock_credentials, "test-db")
-        mock_initialize.assert_called_once_with(mock_credentials)
-        
-    @patch("db_init.db_init.get_postgres_credentials")
-    @patch("db_init.db_init.create_database_if_not_exists")
-    def test_handler_create_db_failure(self, mock_create_db, mock_get_creds):
-        """Test the Lambda handler when database creation fails."""
-        # Mock credential retrieval
-        mock_credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        mock_get_creds.return_value = mock_credentials
-        
-        # Mock database creation failure
-        mock_create_db.return_value = False
-        
-        # Call the handler
-        response = handler({}, {})
-        
-        # Verify results
-        self.assertEqual(response["statusCode"], 500)
-        response_body = json.loads(response["body"])
-        self.assertEqual(
-            response_body["message"],
-            "Failed to create database. Please check that the RDS instance is available."
-        )
-        
-    @patch("db_init.db_init.get_postgres_credentials")
-    @patch("db_init.db_init.create_database_if_not_exists")
-    @patch("db_init.db_init.initialize_database")
-    def test_handler_initialize_db_failure(self, mock_initialize, mock_create_db, mock_get_creds):
-        """Test the Lambda handler when database initialization fails."""
-        # Mock credential retrieval
-        mock_credentials = {
-            "host": "test-host",
-            "port": 5432,
-            "username": "test-user",
-            "password": "test-password",
-            "dbname": "test-db"
-        }
-        mock_get_creds.return_value = mock_credentials
-        
-        # Mock database creation success but initialization failure
-        mock_create_db.return_value = True
-        mock_initialize.return_value = False
-        
-        # Call the handler
-        response = handler({}, {})
-        
-        # Verify results
-        self.assertEqual(response["statusCode"], 500)
-        response_body = json.loads(response["body"])
-        self.assertEqual(
-            response_body["message"],
-            "Failed to initialize database schema. Please check logs for details."
-        )
-        
-    def test_handler_healthcheck(self):
-        """Test the Lambda handler for a health check."""
-        # Override environment variable to ensure it's correct
-        os.environ["STAGE"] = "test"
-        
-        # Create a health check event
-        event = {"action": "healthcheck"}
-
-        # Call the handler
-        response = handler(event, {})
-
-        # Verify results
-        self.assertEqual(response["statusCode"], 200)
-        response_body = json.loads(response["body"])
-        self.assertEqual(response_body["message"], "DB initialization function is healthy")
-        self.assertEqual(response_body["stage"], "test")
-
-
-if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+
+    # Verify results
+    assert not result
+    mock_check_dns.assert_has_calls([call("test-host")] * 4)  # Initial + 3 retries
+    assert mock_check_dns.call_count == 4
+    assert psycopg2_mock.connect.call_count == 4
+    assert mock_sleep.call_count == 3  # Sleep between retries
+
+
+@patch("db_init.db_init.check_dns_resolution", return_value=True)
+@patch("db_init.db_init.time.sleep")
+def test_initialize_database_closes_connection_on_retry(mock_sleep, mock_check_dns, psycopg2_mock, credentials):
+    """Test that each attempt closes its connection when a retryable error is raised."""
+    # Mock the connection dropping after it was opened
+    mock_conn = psycopg2_mock.connect.return_value
+    mock_conn.cursor.return_value.execute.side_effect = psycopg2_mock.OperationalError("Connection lost")
+
+    # Call the function (max retries is 3 from setup)
+    assert not initialize_database(credentials)
+    assert not create_database_if_not_exists(credentials, "test-db")
+
+    # Verify every connection was closed: initial + 3 retries for each function
+    assert psycopg2_mock.connect.call_count == 8
+    assert mock_conn.close.call_count == 8
+
+
+@patch("db_init.db_init.get_postgres_credentials")
+@patch("db_init.db_init.create_database_if_not_exists")
+@patch("db_init.db_init.initialize_database")
+def test_handler_success(mock_initialize, mock_create_db, mock_get_creds, credentials):
+    """Test the Lambda handler for successful execution."""
+    # Mock credential retrieval
+    mock_get_creds.return_value = credentials
+
+    # Mock database creation and initialization
+    mock_create_db.return_value = True
+    mock_initialize.return_value = True
+
+    # Call the handler
+    response = handler({}, {})
+
+    # Verify results
+    assert response["statusCode"] == 200
+    response_body = json.loads(response["body"])
+    assert response_body["message"] == "Database initialization completed successfully"
+
+    # Verify function calls
+    mock_get_creds.assert_called_once()
+    mock_create_db.assert_called_once_with(credentials, "test-db")
+    mock_initialize.assert_called_once_with(credentials)
+
+
+@patch("db_init.db_init.get_postgres_credentials")
+@patch("db_init.db_init.create_database_if_not_exists")
+def test_handler_create_db_failure(mock_create_db, mock_get_creds, credentials):
+    """Test the Lambda handler when database creation fails."""
+    # Mock credential retrieval
+    mock_get_creds.return_value = credentials
+
+    # Mock database creation failure
+    mock_create_db.return_value = False
+
+    # Call the handler
+    response = handler({}, {})
+
+    # Verify results
+    assert response["statusCode"] == 500
+    response_body = json.loads(response["body"])
+    assert response_body["message"] == "Failed to create database. Please check that the RDS instance is available."
+
+
+@patch("db_init.db_init.get_postgres_credentials")
+@patch("db_init.db_init.create_database_if_not_exists")
+@patch("db_init.db_init.initialize_database")
+def test_handler_initialize_db_failure(mock_initialize, mock_create_db, mock_get_creds, credentials):
+    """Test the Lambda handler when database initialization fails."""
+    # Mock credential retrieval
+    mock_get_creds.return_value = credentials
+
+    # Mock database creation success but initialization failure
+    mock_create_db.return_value = True
+    mock_initialize.return_value = False
+
+    # Call the handler
+    response = handler({}, {})
+
+    # Verify results
+    assert response["statusCode"] == 500
+    response_body = json.loads(response["body"])
+    assert response_body["message"] == "Failed to initialize database schema. Please check logs for details."
+
+
+def test_handler_healthcheck():
+    """Test the Lambda handler for a health check."""
+    # Override environment variable to ensure it's correct
+    os.environ["STAGE"] = "test"
+
+    # Create a health check event
+    event = {"action": "healthcheck"}
+
+    # Call the handler
+    response = handler(event, {})
+
+    # Verify results
+    assert response["statusCode"] == 200
+    response_body = json.loads(response["body"])
+    assert response_body["message"] == "DB initialization function is healthy"
+    assert response_body["stage"] == "test"
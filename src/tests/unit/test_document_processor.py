@@ -1,9 +1,13 @@
 """Test cases for the document_processor Lambda function."""
 import json
 import os
+import struct
 import unittest
+from io import BytesIO
 from unittest.mock import MagicMock, patch
 
+from botocore.exceptions import ClientError
+
 """Set up test environment."""
 # Set environment variables
 os.environ["DOCUMENTS_BUCKET"] = "test-bucket"
@@ -19,9 +23,11 @@ os.environ["TOP_P"] = "0.8"
 os.environ["SIMILARITY_THRESHOLD"] = "0.7"
 
 # Now import the module under test - mocks are already in place globally from conftest
+import document_processor.document_processor as document_processor
 from document_processor.document_processor import (
-    handler, get_gemini_api_key, get_postgres_credentials, get_postgres_connection,
-    embed_query, embed_documents, get_document_loader, chunk_documents, process_document
+    handler, get_gemini_api_key, get_postgres_credentials, get_postgres_connection, get_conn,
+    embed_query, embed_documents, load_documents, chunk_documents, process_document,
+    get_s3_object_with_various_encoding, encode_chunk_copy
 )
 
 class TestDocumentProcessor(unittest.TestCase):
@@ -43,6 +49,11 @@ class TestDocumentProcessor(unittest.TestCase):
         # Set up DynamoDB table mock
         self.mock_table = MagicMock()
         self.mock_dynamodb.Table.return_value = self.mock_table
+        
+        # Start each test without a cached PostgreSQL connection, secrets or S3 keys
+        document_processor._pg_conn = None
+        document_processor._secret_cache.clear()
+        document_processor._s3_key_cache.clear()
 
     def tearDown(self):
         """Clean up test environment."""
@@ -99,6 +110,12 @@ class TestDocumentProcessor(unittest.TestCase):
         mock_secretsmanager.get_secret_value.assert_called_once_with(
             SecretId="test-db-secret"
         )
+        
+        # A second call is served from the cache unless a refresh is requested
+        self.assertEqual(get_postgres_credentials(), mock_credentials)
+        self.assertEqual(mock_secretsmanager.get_secret_value.call_count, 1)
+        get_postgres_credentials(refresh=True)
+        self.assertEqual(mock_secretsmanager.get_secret_value.call_count, 2)
 
     @patch("document_processor.document_processor.psycopg2")
     def test_get_postgres_connection(self, mock_psycopg2):
@@ -126,8 +143,58 @@ class TestDocumentProcessor(unittest.TestCase):
             port=5432,
             user="test-user",
             password="test-password",
-            dbname="test-db"
+            dbname="test-db",
+            connect_timeout=5
+        )
+
+    @patch("document_processor.document_processor.register_vector")
+    @patch("document_processor.document_processor.get_postgres_credentials")
+    @patch("document_processor.document_processor.get_postgres_connection")
+    def test_get_conn_reuses_connection(self, mock_get_connection, mock_get_creds, mock_register_vector):
+        """Test that the PostgreSQL connection is reused until it is closed."""
+        mock_conn = MagicMock()
+        mock_conn.closed = 0
+        mock_get_connection.return_value = mock_conn
+
+        # Two calls on an open connection connect once
+        self.assertIs(get_conn(), mock_conn)
+        self.assertIs(get_conn(), mock_conn)
+        mock_get_creds.assert_called_once()
+        mock_get_connection.assert_called_once()
+        mock_register_vector.assert_called_once_with(mock_conn)
+        mock_conn.cursor.return_value.__enter__.return_value.execute.assert_called_once_with(
+            document_processor.PREPARE_INSERT_DOCUMENT
+        )
+
+        # A closed connection is replaced
+        mock_conn.closed = 1
+        get_conn()
+        self.assertEqual(mock_get_connection.call_count, 2)
+
+    @patch("document_processor.document_processor.register_vector")
+    @patch("document_processor.document_processor.get_postgres_credentials")
+    @patch("document_processor.document_processor.get_postgres_connection")
+    def test_get_conn_setup_failure(self, mock_get_connection, mock_get_creds, mock_register_vector):
+        """Test that a connection whose setup fails is closed and not reused."""
+        failed_conn = MagicMock()
+        failed_conn.closed = 0
+        failed_conn.cursor.return_value.__enter__.return_value.execute.side_effect = Exception(
+            'relation "documents" does not exist'
         )
+        mock_conn = MagicMock()
+        mock_conn.closed = 0
+        mock_get_connection.side_effect = [failed_conn, mock_conn]
+
+        # PREPARE fails, so the connection is closed and the error raised
+        with self.assertRaises(Exception):
+            get_conn()
+        failed_conn.close.assert_called_once()
+        self.assertIsNone(document_processor._pg_conn)
+
+        # The next call sets up a new connection
+        self.assertIs(get_conn(), mock_conn)
+        self.assertEqual(mock_get_connection.call_count, 2)
+        mock_register_vector.assert_called_with(mock_conn)
 
     @patch("document_processor.document_processor.client")
     def test_embed_query(self, mock_client):
@@ -145,9 +212,33 @@ class TestDocumentProcessor(unittest.TestCase):
         self.assertEqual(result, [0.1, 0.2, 0.3])
         mock_client.models.embed_content.assert_called_once()
 
+    @patch("document_processor.document_processor.client")
+    def test_embed_documents(self, mock_client):
+        """Test embedding multiple documents in one request."""
+        # Mock the Gemini embedding response
+        mock_embeddings = MagicMock()
+        mock_embeddings.embeddings = [MagicMock(), MagicMock()]
+        mock_embeddings.embeddings[0].values = [0.1, 0.2, 0.3]
+        mock_embeddings.embeddings[1].values = [0.4, 0.5, 0.6]
+        mock_client.models.embed_content.return_value = mock_embeddings
+
+        # Test documents
+        docs = ["Document 1", "Document 2"]
+
+        # Call the function
+        result = embed_documents(docs)
+
+        # Verify results
+        self.assertEqual(result, [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]])
+        mock_client.models.embed_content.assert_called_once()
+        self.assertEqual(mock_client.models.embed_content.call_args.kwargs["contents"], docs)
+
+    @patch("document_processor.document_processor.client")
     @patch("document_processor.document_processor.embed_query")
-    def test_embed_documents(self, mock_embed_query):
-        """Test embedding multiple documents."""
+    def test_embed_documents_fallback(self, mock_embed_query, mock_client):
+        """Test embedding documents one at a time when the batch request fails."""
+        mock_client.models.embed_content.side_effect = Exception("Batch failed")
+        
         # Mock the embed_query function
         mock_embed_query.side_effect = [
             [0.1, 0.2, 0.3],
@@ -166,57 +257,52 @@ class TestDocumentProcessor(unittest.TestCase):
         mock_embed_query.assert_any_call("Document 1")
         mock_embed_query.assert_any_call("Document 2")
 
-    @patch("document_processor.document_processor.PyPDFLoader")
-    def test_get_document_loader_pdf(self, mock_loader_class):
-        """Test getting document loader for PDF files."""
-        mock_loader = MagicMock()
-        mock_loader_class.return_value = mock_loader
-        
-        loader = get_document_loader("test.pdf", "application/pdf")
-        
-        self.assertEqual(loader, mock_loader)
-        mock_loader_class.assert_called_once_with("test.pdf")
-
-    @patch("document_processor.document_processor.TextLoader")
-    def test_get_document_loader_text(self, mock_loader_class):
-        """Test getting document loader for text files."""
-        mock_loader = MagicMock()
-        mock_loader_class.return_value = mock_loader
-        
-        loader = get_document_loader("test.txt", "text/plain")
-        
-        self.assertEqual(loader, mock_loader)
-        mock_loader_class.assert_called_once_with("test.txt")
-
-    @patch("document_processor.document_processor.CSVLoader")
-    def test_get_document_loader_csv(self, mock_loader_class):
-        """Test getting document loader for CSV files."""
-        mock_loader = MagicMock()
-        mock_loader_class.return_value = mock_loader
-        
-        loader = get_document_loader("test.csv", "text/csv")
-        
-        self.assertEqual(loader, mock_loader)
-        mock_loader_class.assert_called_once_with("test.csv")
-
-    @patch("document_processor.document_processor.TextLoader")
-    def test_get_document_loader_unknown(self, mock_loader_class):
-        """Test getting document loader for unknown file types."""
-        mock_loader = MagicMock()
-        mock_loader_class.return_value = mock_loader
-        
-        loader = get_document_loader("test.unknown", "application/octet-stream")
-        
-        self.assertEqual(loader, mock_loader)
-        mock_loader_class.assert_called_once_with("test.unknown")
-
-    @patch("document_processor.document_processor.RecursiveCharacterTextSplitter")
-    def test_chunk_documents(self, mock_splitter_class):
+    @patch("document_processor.document_processor.PdfReader")
+    def test_load_documents_pdf(self, mock_reader_class):
+        """Test loading PDF files one document per page."""
+        mock_pages = [MagicMock(), MagicMock()]
+        mock_pages[0].extract_text.return_value = "Page 1"
+        mock_pages[1].extract_text.return_value = "Page 2"
+        mock_reader_class.return_value.pages = mock_pages
+        buffer = BytesIO(b"%PDF")
+        
+        documents = load_documents(buffer, "test.pdf", "application/pdf")
+        
+        mock_reader_class.assert_called_once_with(buffer)
+        self.assertEqual([d.page_content for d in documents], ["Page 1", "Page 2"])
+        self.assertEqual([d.metadata for d in documents], [
+            {"source": "test.pdf", "page": 0},
+            {"source": "test.pdf", "page": 1}
+        ])
+
+    def test_load_documents_text(self):
+        """Test loading text files as a single document."""
+        documents = load_documents(BytesIO(b"Hello world"), "test.txt", "text/plain")
+        
+        self.assertEqual(len(documents), 1)
+        self.assertEqual(documents[0].page_content, "Hello world")
+        self.assertEqual(documents[0].metadata, {"source": "test.txt"})
+
+    def test_load_documents_csv(self):
+        """Test loading CSV files one document per row."""
+        documents = load_documents(BytesIO(b"name,value\na,1\nb,2\n"), "test.csv", "text/csv")
+        
+        self.assertEqual([d.page_content for d in documents], ["name: a\nvalue: 1", "name: b\nvalue: 2"])
+        self.assertEqual([d.metadata for d in documents], [
+            {"source": "test.csv", "row": 0},
+            {"source": "test.csv", "row": 1}
+        ])
+
+    def test_load_documents_unknown(self):
+        """Test loading unknown file types as text."""
+        documents = load_documents(BytesIO(b"Some data"), "test.unknown", "application/octet-stream")
+        
+        self.assertEqual(len(documents), 1)
+        self.assertEqual(documents[0].page_content, "Some data")
+
+    @patch("document_processor.document_processor._text_splitter")
+    def test_chunk_documents(self, mock_splitter):
         """Test chunking documents."""
-        # Mock the splitter
-        mock_splitter = MagicMock()
-        mock_splitter_class.return_value = mock_splitter
-        
         # Mock the split_documents method
         mock_chunks = ["chunk1", "chunk2"]
         mock_splitter.split_documents.return_value = mock_chunks
@@ -229,7 +315,7 @@ class TestDocumentProcessor(unittest.TestCase):
         
         # Verify results
         self.assertEqual(result, mock_chunks)
-        mock_splitter_class.assert_called_once_with(
+        document_processor.RecursiveCharacterTextSplitter.assert_any_call(
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
@@ -237,36 +323,115 @@ class TestDocumentProcessor(unittest.TestCase):
         )
         mock_splitter.split_documents.assert_called_once_with(docs)
 
-    @patch("document_processor.document_processor.tempfile")
-    @patch("document_processor.document_processor.get_document_loader")
+    def test_encode_chunk_copy(self):
+        """Test encoding chunk rows in the binary COPY format."""
+        data = encode_chunk_copy([
+            ("chunk-1", "doc-1", "user-1", "Chunk 1", {"page": 1}, [0.5, 1.0])
+        ]).getvalue()
+        
+        # Header, one row of six fields, trailer
+        self.assertTrue(data.startswith(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)))
+        self.assertTrue(data.endswith(struct.pack(">h", -1)))
+        offset = 19
+        self.assertEqual(struct.unpack_from(">h", data, offset)[0], 6)
+        offset += 2
+        fields = []
+        for _ in range(6):
+            length = struct.unpack_from(">i", data, offset)[0]
+            fields.append(data[offset + 4:offset + 4 + length])
+            offset += 4 + length
+        
+        self.assertEqual(fields[:4], [b"chunk-1", b"doc-1", b"user-1", b"Chunk 1"])
+        self.assertEqual(json.loads(fields[4][1:]), {"page": 1})
+        self.assertEqual(fields[4][:1], b"\x01")
+        self.assertEqual(struct.unpack(">HH2f", fields[5]), (2, 0, 0.5, 1.0))
+
+    def test_get_s3_object_with_various_encoding_decoded_first(self):
+        """Test that the URL-decoded key is tried first and cached without its size."""
+        self.mock_s3.head_object.side_effect = [
+            ClientError({"Error": {"Code": "404"}}, "HeadObject"),
+            {"ContentLength": 2048},
+            {"ContentLength": 4096}
+        ]
+
+        # The '+'-encoded form exists; the object is overwritten between calls
+        key = "uploads/user-1/doc-1/my+file.pdf"
+        self.assertEqual(get_s3_object_with_various_encoding("test-bucket", key), (key, 2048))
+        self.assertEqual(get_s3_object_with_various_encoding("test-bucket", key), (key, 4096))
+
+        # Verify the decoded key is tried first, the cached key is reused and nothing is listed
+        self.assertEqual(
+            [c.kwargs["Key"] for c in self.mock_s3.head_object.call_args_list],
+            ["uploads/user-1/doc-1/my file.pdf", key, key]
+        )
+        self.mock_s3.list_objects_v2.assert_not_called()
+
+    def test_get_s3_object_with_various_encoding_cache_bounded(self):
+        """Test that the resolved-key cache evicts its oldest entry when full."""
+        self.mock_s3.head_object.return_value = {"ContentLength": 1024}
+
+        with patch.object(document_processor, "S3_KEY_CACHE_SIZE", 2):
+            for name in ("a.pdf", "b.pdf", "c.pdf"):
+                get_s3_object_with_various_encoding("test-bucket", f"uploads/user-1/doc-1/{name}")
+
+        self.assertEqual(
+            list(document_processor._s3_key_cache),
+            [("test-bucket", "uploads/user-1/doc-1/b.pdf"), ("test-bucket", "uploads/user-1/doc-1/c.pdf")]
+        )
+
+    def test_get_s3_object_with_various_encoding_listing(self):
+        """Test finding an S3 key through the opt-in directory listing."""
+        # No candidate key exists
+        self.mock_s3.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        self.mock_s3.list_objects_v2.return_value = {
+            "Contents": [
+                {"Key": "uploads/user-1/doc-1/other.pdf", "Size": 1024},
+                {"Key": "uploads/user-1/doc-1/my%20file.pdf", "Size": 2048}
+            ]
+        }
+
+        # Without the fallback the lookup fails
+        key = "uploads/user-1/doc-1/my file.pdf"
+        with self.assertRaises(Exception):
+            get_s3_object_with_various_encoding("test-bucket", key)
+        self.mock_s3.list_objects_v2.assert_not_called()
+
+        # With the fallback the listed key is matched
+        self.assertEqual(
+            get_s3_object_with_various_encoding("test-bucket", key, enable_list_fallback=True),
+            ("uploads/user-1/doc-1/my%20file.pdf", 2048)
+        )
+        self.mock_s3.list_objects_v2.assert_called_once_with(
+            Bucket="test-bucket", Prefix="uploads/user-1/doc-1/", MaxKeys=1000
+        )
+
+    def test_get_s3_object_with_various_encoding_access_denied(self):
+        """Test that errors other than not found are raised immediately."""
+        self.mock_s3.head_object.side_effect = ClientError({"Error": {"Code": "403"}}, "HeadObject")
+
+        with self.assertRaises(ClientError):
+            get_s3_object_with_various_encoding("test-bucket", "uploads/user-1/doc-1/test.pdf")
+        self.mock_s3.head_object.assert_called_once()
+
+    @patch("document_processor.document_processor.load_documents")
     @patch("document_processor.document_processor.chunk_documents")
-    @patch("document_processor.document_processor.embed_query")
+    @patch("document_processor.document_processor.embed_documents")
     @patch("document_processor.document_processor.get_postgres_credentials")
     @patch("document_processor.document_processor.get_postgres_connection")
-    @patch("document_processor.document_processor.os.unlink")
     @patch("document_processor.document_processor.uuid.uuid4")
-    @patch("document_processor.document_processor.datetime")
+    @patch("document_processor.document_processor.execute_values")
+    @patch("document_processor.document_processor.np.asarray", side_effect=lambda values, dtype: values)
     def test_process_document(
-        self, mock_datetime, mock_uuid, mock_unlink, mock_get_conn, mock_get_creds,
-        mock_embed, mock_chunk, mock_loader, mock_tempfile
+        self, mock_asarray, mock_execute_values, mock_uuid, mock_get_conn, mock_get_creds,
+        mock_embed, mock_chunk, mock_load
     ):
         """Test processing a document."""
-        # Mock datetime
-        mock_now = MagicMock()
-        mock_datetime.now.return_value = mock_now
-        
-        # Mock the temporary file
-        mock_temp_file = MagicMock()
-        mock_temp_file.name = "/tmp/test_file"
-        mock_tempfile.NamedTemporaryFile.return_value.__enter__.return_value = mock_temp_file
+        # Mock the S3 object lookup
+        self.mock_s3.head_object.return_value = {"ContentLength": 1024}
         
         # Mock UUID
         mock_uuid.side_effect = ["chunk-1", "chunk-2"]
         
-        # Mock document loader
-        mock_doc_loader = MagicMock()
-        mock_loader.return_value = mock_doc_loader
-        
         # Create mock documents
         class MockDocument:
             def __init__(self, page_content, metadata):
@@ -277,7 +442,7 @@ class TestDocumentProcessor(unittest.TestCase):
             MockDocument("Content 1", {"page": 1}),
             MockDocument("Content 2", {"page": 2})
         ]
-        mock_doc_loader.load.return_value = mock_documents
+        mock_load.return_value = mock_documents
         
         # Mock chunking
         mock_chunks = [
@@ -287,7 +452,7 @@ class TestDocumentProcessor(unittest.TestCase):
         mock_chunk.return_value = mock_chunks
         
         # Mock embedding
-        mock_embed.side_effect = [
+        mock_embed.return_value = [
             [0.1, 0.2, 0.3],
             [0.4, 0.5, 0.6]
         ]
@@ -316,25 +481,89 @@ class TestDocumentProcessor(unittest.TestCase):
         self.assertEqual(chunk_ids, ["chunk-1", "chunk-2"])
         
         # Verify S3 download
-        self.mock_s3.download_file.assert_called_once_with(
-            bucket, key, "/tmp/test_file"
+        self.mock_s3.download_fileobj.assert_called_once_with(
+            bucket, key, unittest.mock.ANY, Config=document_processor.SMALL_TRANSFER_CONFIG
         )
-        
-        # Verify temporary file cleanup
-        mock_unlink.assert_called_once_with("/tmp/test_file")
+        mock_load.assert_called_once_with(unittest.mock.ANY, key, mime_type)
         
         # Verify document insertion
         mock_cursor.execute.assert_any_call(
-            """
-        INSERT INTO documents (document_id, user_id, file_name, mime_type, status, bucket, key, created_at, updated_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-        """,
+            "EXECUTE insert_document (%s, %s, %s, %s, %s, %s, %s)",
             unittest.mock.ANY  # We don't need to check the exact values here
         )
         
         # Verify chunk insertions
-        self.assertEqual(mock_cursor.execute.call_count, 3)  # 1 for document + 2 for chunks
+        self.assertEqual(mock_cursor.execute.call_count, 1)  # Only the document row
+        mock_execute_values.assert_called_once()
+        args, kwargs = mock_execute_values.call_args
+        self.assertIs(args[0], mock_cursor)
+        self.assertIn("VALUES %s", args[1])
+        self.assertEqual([row[0] for row in args[2]], ["chunk-1", "chunk-2"])
+        self.assertEqual([row[5] for row in args[2]], [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]])
+        self.assertEqual(kwargs["page_size"], 100)
+        mock_embed.assert_called_once_with(["Chunk 1", "Chunk 2"])
+        
+        # Verify a single transaction for the document and its chunks
+        self.assertEqual(mock_conn.commit.call_count, 2)  # 1 after PREPARE on connect + 1 for the document
+        
+        # Verify DynamoDB put_item call
+        self.mock_table.put_item.assert_called_once()
+        item = self.mock_table.put_item.call_args.kwargs["Item"]
+        self.assertEqual(item["status"], "processed")
+        self.assertEqual(item["chunk_ids"], ["chunk-1", "chunk-2"])
+        self.assertEqual(item["num_chunks"], 2)
+
+    @patch("document_processor.document_processor.load_documents")
+    @patch("document_processor.document_processor.chunk_documents")
+    @patch("document_processor.document_processor.embed_documents")
+    @patch("document_processor.document_processor.get_conn")
+    @patch("document_processor.document_processor.execute_values")
+    def test_process_document_insert_failure(
+        self, mock_execute_values, mock_get_conn, mock_embed, mock_chunk, mock_load
+    ):
+        """Test that a failed chunk insert marks the DynamoDB metadata as failed."""
+        self.mock_s3.head_object.return_value = {"ContentLength": 1024}
+        mock_chunk.return_value = [MagicMock(page_content="Chunk 1", metadata={"page": 1})]
+        mock_embed.return_value = [[0.1, 0.2, 0.3]]
+        mock_execute_values.side_effect = Exception("Insert failed")
+        
+        with self.assertRaises(Exception):
+            process_document("test-bucket", "uploads/user-1/doc-1/test.txt", "doc-1", "user-1", "text/plain")
+        
+        # Verify the metadata written alongside the insert is marked as failed
+        mock_get_conn.return_value.commit.assert_not_called()
+        self.mock_table.put_item.assert_called_once()
+        self.mock_table.update_item.assert_called_once()
+        self.assertEqual(self.mock_table.update_item.call_args.kwargs["Key"], {"id": "doc#doc-1"})
+        self.assertEqual(
+            self.mock_table.update_item.call_args.kwargs["ExpressionAttributeValues"][":status"], "failed"
+        )
+
+    @patch("document_processor.document_processor.load_documents")
+    @patch("document_processor.document_processor.chunk_documents")
+    @patch("document_processor.document_processor.embed_documents")
+    @patch("document_processor.document_processor.get_conn")
+    @patch("document_processor.document_processor.execute_values")
+    def test_process_document_metadata_failure(
+        self, mock_execute_values, mock_get_conn, mock_embed, mock_chunk, mock_load
+    ):
+        """Test that a failed metadata write never marks the document as failed."""
+        self.mock_s3.head_object.return_value = {"ContentLength": 1024}
+        mock_chunk.return_value = [MagicMock(page_content="Chunk 1", metadata={"page": 1})]
+        mock_embed.return_value = [[0.1, 0.2, 0.3]]
+        self.mock_table.put_item.side_effect = Exception("Put failed")
+
+        # The chunks are committed, so the document still succeeds and is not marked as failed
+        num_chunks, _ = process_document("test-bucket", "uploads/user-1/doc-1/test.txt", "doc-1", "user-1", "text/plain")
+        self.assertEqual(num_chunks, 1)
+        mock_get_conn.return_value.commit.assert_called_once()
+        self.mock_table.update_item.assert_not_called()
+
+        # The insert fails too, but there is no metadata item to mark
+        mock_execute_values.side_effect = Exception("Insert failed")
+        with self.assertRaises(Exception):
+            process_document("test-bucket", "uploads/user-1/doc-1/test.txt", "doc-1", "user-1", "text/plain")
+        self.mock_table.update_item.assert_not_called()
 
     def test_handler_healthcheck(self):
         """Test the Lambda handler for a health check."""
@@ -386,9 +615,6 @@ class TestDocumentProcessor(unittest.TestCase):
         mock_process.assert_called_once_with(
             "test-bucket", "uploads/user-1/doc-1/test.pdf", "doc-1", "user-1", "application/pdf"
         )
-        
-        # Verify DynamoDB put_item call
-        self.mock_table.put_item.assert_called_once()
 
     def test_handler_direct_invocation(self):
         """Test the Lambda handler for a direct invocation with no Records."""
@@ -20,9 +20,11 @@ os.environ["TOP_P"] = "0.8"
 MODEL_NAME = "gemini-2.0-flash"
 
 # Now import the module under test - mocks are already in place globally from conftest
+import query_processor.query_processor as query_processor
 from query_processor.query_processor import (
     handler, get_gemini_api_key, get_postgres_credentials, get_postgres_connection,
-    embed_query, embed_documents, similarity_search, generate_response, DecimalEncoder
+    embed_query, embed_documents, similarity_search, generate_response, dumps,
+    run_query, GeminiRagEvaluator, build_context
 )
 
 class TestQueryProcessor(unittest.TestCase):
@@ -37,6 +39,11 @@ class TestQueryProcessor(unittest.TestCase):
         self.mock_s3 = self.s3_patcher.start()
         self.mock_dynamodb = self.dynamodb_patcher.start()
         self.mock_secretsmanager = self.secrets_patcher.start()
+        
+        # Start each test without a cached PostgreSQL connection
+        query_processor._pg_conn = None
+        query_processor._cached_query_embedding.cache_clear()
+        query_processor._user_chunks_cache.clear()
 
     def tearDown(self):
         """Clean up test environment."""
@@ -139,26 +146,110 @@ class TestQueryProcessor(unittest.TestCase):
         self.assertEqual(result, [0.1, 0.2, 0.3])
         mock_client.models.embed_content.assert_called_once()
 
-    @patch("query_processor.query_processor.embed_query")
-    def test_embed_documents(self, mock_embed_query):
-        """Test embedding multiple documents."""
-        # Mock the embed_query function
-        mock_embed_query.side_effect = [
-            [0.1, 0.2, 0.3],
-            [0.4, 0.5, 0.6]
-        ]
+    @patch("query_processor.query_processor.client")
+    def test_embed_query_cache(self, mock_client):
+        """Test that repeated queries reuse the cached embedding but failures are retried."""
+        mock_client.models.embed_content.side_effect = Exception("Gemini unavailable")
+        self.assertEqual(embed_query("What is RAG?"), [0.0] * 768)
+        
+        mock_embeddings = MagicMock()
+        mock_embeddings.embeddings = [MagicMock(values=[0.1, 0.2, 0.3])]
+        mock_client.models.embed_content.side_effect = None
+        mock_client.models.embed_content.return_value = mock_embeddings
+        
+        # Call the function with the same query, differently formatted
+        first = embed_query("What is RAG?")
+        second = embed_query("  what is   rag? ")
+        
+        # Verify one successful Gemini call served both
+        self.assertEqual(first, [0.1, 0.2, 0.3])
+        self.assertEqual(second, [0.1, 0.2, 0.3])
+        self.assertEqual(mock_client.models.embed_content.call_count, 2)
+        # The cache key is normalized, but Gemini embeds the query as typed
+        self.assertEqual(mock_client.models.embed_content.call_args.kwargs["contents"], "What is RAG?")
+
+    @patch("query_processor.query_processor.client")
+    def test_embed_query_shared_cache(self, mock_client):
+        """Test reading a query embedding from the shared cache table."""
+        mock_conn = MagicMock()
+        mock_conn.closed = 0
+        mock_conn.cursor.return_value.fetchall.return_value = [(MagicMock(**{"tolist.return_value": [0.4, 0.5]}),)]
+        query_processor._pg_conn = mock_conn
+        
+        result = embed_query("What is RAG?")
+        
+        # Verify the cached row was used without calling Gemini
+        self.assertEqual(result, [0.4, 0.5])
+        mock_client.models.embed_content.assert_not_called()
+        sql, params = mock_conn.cursor.return_value.execute.call_args[0]
+        self.assertIn("FROM query_cache", sql)
+        self.assertEqual(len(params[0]), 16)
+        self.assertEqual(params[1], query_processor.QUERY_CACHE_TTL_DAYS)
+
+    @patch("query_processor.query_processor.client")
+    def test_embed_query_stores_shared_cache(self, mock_client):
+        """Test that a cache miss is written to the shared cache table before returning."""
+        mock_conn = MagicMock()
+        mock_conn.closed = 0
+        mock_conn.cursor.return_value.fetchall.return_value = []
+        query_processor._pg_conn = mock_conn
+        mock_client.models.embed_content.return_value.embeddings = [MagicMock(values=[0.1, 0.2])]
+
+        with patch("query_processor.query_processor._executor") as mock_executor:
+            result = embed_query("What is RAG?")
+
+        # Verify the row was written inline, replacing expired rows and pruning old ones
+        self.assertEqual(result, [0.1, 0.2])
+        mock_executor.submit.assert_not_called()
+        lookup, store = mock_conn.cursor.return_value.execute.call_args_list
+        self.assertIn("ON CONFLICT (query_hash) DO UPDATE", store[0][0])
+        self.assertIn("DELETE FROM query_cache", store[0][0])
+        self.assertEqual(store[0][1][0], lookup[0][1][0])
+
+    @patch("query_processor.query_processor.EMBED_BATCH_SIZE", 2)
+    @patch("query_processor.query_processor.client")
+    def test_embed_documents(self, mock_client):
+        """Test embedding multiple documents in batched requests."""
+        # Mock the Gemini response for each batch; batches may be sent in any order
+        values = {"Document 1": [0.1, 0.2, 0.3], "Document 2": [0.4, 0.5, 0.6], "Document 3": [0.7, 0.8, 0.9]}
+        def embed_content(model, contents, config):
+            response = MagicMock()
+            response.embeddings = [MagicMock(values=values[text]) for text in contents]
+            return response
+        mock_client.models.embed_content.side_effect = embed_content
 
         # Test documents
-        docs = ["Document 1", "Document 2"]
+        docs = ["Document 1", "Document 2", "Document 3"]
 
         # Call the function
         result = embed_documents(docs)
 
         # Verify results
-        self.assertEqual(result, [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]])
-        self.assertEqual(mock_embed_query.call_count, 2)
-        mock_embed_query.assert_any_call("Document 1")
-        mock_embed_query.assert_any_call("Document 2")
+        self.assertEqual(result, [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]])
+        self.assertEqual(mock_client.models.embed_content.call_count, 2)
+        batches = [c.kwargs["contents"] for c in mock_client.models.embed_content.call_args_list]
+        self.assertCountEqual(batches, [["Document 1", "Document 2"], ["Document 3"]])
+
+    @patch("query_processor.query_processor.client")
+    @patch("query_processor.query_processor.embed_query")
+    @patch("query_processor.query_processor.embed_text")
+    def test_embed_documents_fallback(self, mock_embed_text, mock_embed_query, mock_client):
+        """Test embedding documents one at a time, without the query caches, when the batch request fails."""
+        mock_client.models.embed_content.side_effect = Exception("Batch failed")
+        
+        # Mock the uncached single-text embedding; the second text fails
+        mock_embed_text.side_effect = [
+            [0.1, 0.2, 0.3],
+            Exception("Embedding failed")
+        ]
+
+        # Call the function
+        result = embed_documents(["Document 1", "Document 2"])
+
+        # Verify results
+        self.assertEqual(result, [[0.1, 0.2, 0.3], [0.0] * 768])
+        self.assertEqual(mock_embed_text.call_count, 2)
+        mock_embed_query.assert_not_called()
 
     @patch("query_processor.query_processor.get_postgres_credentials")
     @patch("query_processor.query_processor.get_postgres_connection")
@@ -170,13 +261,17 @@ class TestQueryProcessor(unittest.TestCase):
         mock_conn.cursor.return_value = mock_cursor
         mock_get_conn.return_value = mock_conn
         
+        # No halfvec index in this database
+        mock_cursor.__enter__.return_value.fetchone.return_value = None
+        
         # Mock credentials
         mock_get_creds.return_value = {"host": "test-host"}
         
         # Mock the query results
+        columns = ("chunk_id", "document_id", "user_id", "content", "metadata", "file_name", "similarity_score")
         mock_cursor.fetchall.return_value = [
-            ("chunk-1", "doc-1", "user-1", "Content 1", {"page": 1}, "file1.pdf", 0.95),
-            ("chunk-2", "doc-2", "user-1", "Content 2", {"page": 2}, "file2.pdf", 0.85)
+            dict(zip(columns, ("chunk-1", "doc-1", "user-1", "Content 1", {"page": 1}, "file1.pdf", 0.95))),
+            dict(zip(columns, ("chunk-2", "doc-2", "user-1", "Content 2", {"page": 2}, "file2.pdf", 0.85)))
         ]
         
         # Test query embedding
@@ -194,18 +289,184 @@ class TestQueryProcessor(unittest.TestCase):
         self.assertEqual(results[0]["file_name"], "file1.pdf")
         self.assertEqual(results[0]["similarity_score"], 0.95)
         
-        # Verify SQL query execution
+        # Verify the prepared statement runs with the embedding bound as a parameter
+        mock_conn.cursor.assert_called_with(cursor_factory=query_processor.RealDictCursor)
         mock_cursor.execute.assert_called_once()
-        # Verify query contains the user_id parameter
-        mock_cursor.execute.assert_called_with(unittest.mock.ANY, ("user-1", 2))
+        mock_cursor.execute.assert_called_with(
+            "EXECUTE similarity_search (%s, %s, %s)", ("user-1", unittest.mock.ANY, 2)
+        )
+        mock_conn.cursor.return_value.__enter__.return_value.execute.assert_any_call(
+            query_processor.PREPARE_SIMILARITY_SEARCH.format(distance=query_processor.VECTOR_DISTANCE)
+        )
+        self.assertNotIn(
+            unittest.mock.call("SET hnsw.iterative_scan = strict_order"),
+            mock_conn.cursor.return_value.__enter__.return_value.execute.call_args_list
+        )
+
+    @patch("query_processor.query_processor.get_postgres_credentials")
+    @patch("query_processor.query_processor.get_postgres_connection")
+    def test_similarity_search_reuses_connection(self, mock_get_conn, mock_get_creds):
+        """Test that similarity search reuses the container's connection."""
+        mock_conn = MagicMock()
+        mock_conn.closed = 0
+        mock_conn.cursor.return_value.__enter__.return_value.fetchone.return_value = ("0.7.0", False)
+        mock_conn.cursor.return_value.fetchall.return_value = []
+        mock_get_conn.return_value = mock_conn
+        
+        # Call the function twice
+        similarity_search([0.1, 0.2, 0.3], "user-1")
+        similarity_search([0.1, 0.2, 0.3], "user-1")
+        
+        # Verify credentials and connection were set up once
+        mock_get_creds.assert_called_once()
+        mock_get_conn.assert_called_once()
+        self.assertTrue(mock_conn.autocommit)
+        self.assertEqual(mock_conn.cursor.return_value.execute.call_count, 2)
+        mock_conn.cursor.return_value.__enter__.return_value.execute.assert_any_call(
+            "SET hnsw.ef_search = %s", (100,)
+        )
+
+    @patch("query_processor.query_processor.get_postgres_credentials")
+    @patch("query_processor.query_processor.get_postgres_connection")
+    def test_similarity_search_uses_halfvec_index(self, mock_get_conn, mock_get_creds):
+        """Test ordering by the halfvec expression when its index exists."""
+        mock_conn = MagicMock()
+        mock_conn.closed = 0
+        mock_conn.cursor.return_value.__enter__.return_value.fetchone.return_value = ("0.8.0", True)
+        mock_conn.cursor.return_value.fetchall.return_value = []
+        mock_get_conn.return_value = mock_conn
+        
+        similarity_search([0.1, 0.2, 0.3], "user-1")
+        
+        prepare_sql = mock_conn.cursor.return_value.__enter__.return_value.execute.call_args_list[1][0][0]
+        self.assertIn("ORDER BY embedding::halfvec(768) <=> $2::halfvec(768)", prepare_sql)
+        query_processor.register_vector.assert_called_with(mock_conn)
+        # pgvector 0.8.0 keeps scanning until enough of the user's chunks are found
+        mock_conn.cursor.return_value.__enter__.return_value.execute.assert_any_call(
+            "SET hnsw.iterative_scan = strict_order"
+        )
+
+    @patch("query_processor.query_processor.user_has_chunks", return_value=True)
+    @patch("query_processor.query_processor.generate_response")
+    @patch("query_processor.query_processor.similarity_search")
+    @patch("query_processor.query_processor.embed_query")
+    @patch("query_processor.query_processor.get_conn")
+    def test_run_query_connects_while_embedding(self, mock_get_conn, mock_embed_query,
+                                                mock_similarity_search, mock_generate_response,
+                                                mock_has_chunks):
+        """Test that a cold container connects to PostgreSQL alongside the query embedding."""
+        mock_embed_query.return_value = [0.1, 0.2, 0.3]
+        mock_similarity_search.return_value = []
+        mock_generate_response.return_value = "Answer"
+        
+        result = run_query("What is RAG?", "user-1", "gemini-2.0-flash", False)
+        
+        # Verify the connection was opened and the search still ran
+        mock_get_conn.assert_called_once_with()
+        mock_similarity_search.assert_called_once_with([0.1, 0.2, 0.3], "user-1")
+        self.assertEqual(result["response"], "Answer")
+
+    @patch("query_processor.query_processor.user_has_chunks", return_value=True)
+    @patch("query_processor.query_processor.evaluate_rag_response")
+    @patch("query_processor.query_processor.generate_response")
+    @patch("query_processor.query_processor.similarity_search")
+    @patch("query_processor.query_processor.embed_query")
+    @patch("query_processor.query_processor.get_conn")
+    def test_run_query_evaluates_each_chunk(self, mock_get_conn, mock_embed_query, mock_similarity_search,
+                                            mock_generate_response, mock_evaluate, mock_has_chunks):
+        """Test that evaluation gets one context per retrieved chunk."""
+        mock_embed_query.return_value = [0.1, 0.2, 0.3]
+        mock_similarity_search.return_value = [
+            {"file_name": "a.pdf", "content": "A"},
+            {"file_name": "b.txt", "content": "B"}
+        ]
+        mock_generate_response.return_value = "Answer"
+        
+        run_query("What is RAG?", "user-1", MODEL_NAME, True)
+        
+        self.assertEqual(mock_evaluate.call_args.kwargs["contexts"], ["A", "B"])
+
+    @patch("query_processor.query_processor.generate_response")
+    @patch("query_processor.query_processor.similarity_search")
+    @patch("query_processor.query_processor.embed_query")
+    @patch("query_processor.query_processor.get_conn")
+    def test_run_query_without_documents(self, mock_get_conn, mock_embed_query,
+                                         mock_similarity_search, mock_generate_response):
+        """Test that users without chunks skip search and generation, without caching the result."""
+        mock_cursor = mock_get_conn.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = []
+        
+        # Call the function twice
+        first = run_query("What is RAG?", "user-1", MODEL_NAME, True)
+        second = run_query("What is RAG?", "user-1", MODEL_NAME, True)
+        
+        # Verify the answer has the shape the UI parses and nothing else ran
+        self.assertIn("upload documents", json.loads(first["response"])["answer"])
+        self.assertEqual(second["count"], 0)
+        mock_similarity_search.assert_not_called()
+        mock_generate_response.assert_not_called()
+        
+        # Verify both queries checked the database, so a new upload is found at once
+        self.assertEqual(mock_cursor.execute.call_count, 2)
+        mock_cursor.execute.assert_called_with(
+            "SELECT 1 FROM chunks WHERE user_id = %s LIMIT 1", ("user-1",)
+        )
+
+    @patch("query_processor.query_processor.get_conn")
+    def test_user_has_chunks_cached(self, mock_get_conn):
+        """Test that a user found to have chunks is not checked again within the TTL."""
+        mock_cursor = mock_get_conn.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = [(1,)]
+        
+        self.assertTrue(query_processor.user_has_chunks("user-1"))
+        self.assertTrue(query_processor.user_has_chunks("user-1"))
+        
+        mock_cursor.execute.assert_called_once_with(
+            "SELECT 1 FROM chunks WHERE user_id = %s LIMIT 1", ("user-1",)
+        )
+
+    def test_evaluate_response(self):
+        """Test that the evaluator scores every applicable metric."""
+        evaluator = GeminiRagEvaluator(MODEL_NAME)
+        evaluator.client = MagicMock()
+        evaluator.client.models.generate_content.return_value.text = '{"score": 0.8}'
+        
+        results = evaluator.evaluate_response("What is RAG?", "An answer", ["Context"], ground_truth="Truth")
+        
+        # Verify one Gemini request per metric
+        self.assertEqual(results, {"answer_relevancy": 0.8, "faithfulness": 0.8, "context_precision": 0.8})
+        self.assertEqual(evaluator.client.models.generate_content.call_count, 3)
+
+    @patch("query_processor.query_processor.genai")
+    def test_evaluator_reuses_client(self, mock_genai):
+        """Test that evaluators share the module's Gemini client."""
+        evaluator = query_processor.get_evaluator(MODEL_NAME)
+        
+        # Verify no client was built and the evaluator is cached per model
+        self.assertIs(evaluator.client, query_processor.client)
+        self.assertIs(query_processor.get_evaluator(MODEL_NAME), evaluator)
+        mock_genai.Client.assert_not_called()
+
+    def test_evaluator_rating_parsing(self):
+        """Test parsing evaluator replies into scores between 0 and 1."""
+        evaluator = GeminiRagEvaluator(MODEL_NAME)
+        evaluator.client = MagicMock()
+        
+        for reply, expected in (('{"score": 0.85}', 0.85), ('{"score": 1.5}', 1.0), ("No idea", 0.5)):
+            evaluator.client.models.generate_content.return_value.text = reply
+            self.assertEqual(evaluator._rate("prompt", "answer relevancy"), expected)
+        
+        # Verify the reply was constrained to the score schema
+        self.assertIs(evaluator.client.models.generate_content.call_args.kwargs["config"],
+                      query_processor.RATING_CONFIG)
 
     @patch("query_processor.query_processor.client")
     def test_generate_response(self, mock_client):
         """Test generating a response using Gemini."""
-        # Mock the Gemini response
-        mock_result = MagicMock()
-        mock_result.text = "This is the generated response."
-        mock_client.models.generate_content.return_value = mock_result
+        # Mock the streamed Gemini response
+        mock_client.models.generate_content_stream.return_value = [
+            MagicMock(text="This is the "), MagicMock(text=None), MagicMock(text="generated response.")
+        ]
         
         # Test query and relevant chunks
         query = "What is RAG?"
@@ -222,33 +483,38 @@ class TestQueryProcessor(unittest.TestCase):
         ]
         
         # Call the function
-        response = generate_response(MODEL_NAME, query, relevant_chunks)
+        context = build_context(relevant_chunks)
+        response = generate_response(MODEL_NAME, query, context)
         
         # Verify results
+        self.assertEqual(context, "Document: file1.pdf\nContent: RAG stands for Retrieval-Augmented Generation")
         self.assertEqual(response, "This is the generated response.")
-        mock_client.models.generate_content.assert_called_once()
-        
-    def test_decimal_encoder(self):
-        """Test the DecimalEncoder JSON encoder."""
-        # Create an object with Decimal values
-        obj = {
-            "score1": Decimal("0.95"),
-            "score2": Decimal("0.85"),
-            "text": "test",
-            "number": 42
-        }
+        mock_client.models.generate_content_stream.assert_called_once()
+        self.assertIn(context, mock_client.models.generate_content_stream.call_args.kwargs["contents"])
+        self.assertIs(mock_client.models.generate_content_stream.call_args.kwargs["config"],
+                      query_processor.GENERATION_CONFIG)
         
-        # Encode the object to JSON
-        json_str = json.dumps(obj, cls=DecimalEncoder)
+        # Chunks are separated by a blank line
+        self.assertEqual(
+            build_context([{"file_name": "a.pdf", "content": "A"}, {"file_name": "b.txt", "content": "B"}]),
+            "Document: a.pdf\nContent: A\n\nDocument: b.txt\nContent: B"
+        )
+
+    @patch("query_processor.query_processor.client")
+    def test_generate_response_failure(self, mock_client):
+        """Test that a failed generation returns an answer in the JSON shape the UI parses."""
+        mock_client.models.generate_content_stream.side_effect = Exception("Gemini unavailable")
+
+        response = generate_response(MODEL_NAME, "What is RAG?", "Context")
+
+        self.assertIn("couldn't generate a response", json.loads(response)["answer"])
         
-        # Decode the JSON
-        decoded_obj = json.loads(json_str)
+    def test_dumps_decimal(self):
+        """Test serializing response bodies containing Decimal values."""
+        decoded_obj = json.loads(dumps({"score": Decimal("0.95"), "text": "test"}))
         
         # Verify results
-        self.assertEqual(decoded_obj["score1"], 0.95)
-        self.assertEqual(decoded_obj["score2"], 0.85)
-        self.assertEqual(decoded_obj["text"], "test")
-        self.assertEqual(decoded_obj["number"], 42)
+        self.assertEqual(decoded_obj, {"score": 0.95, "text": "test"})
 
     def test_handler_healthcheck(self):
         """Test the Lambda handler for a health check."""
@@ -330,7 +596,127 @@ class TestQueryProcessor(unittest.TestCase):
         # Verify function calls
         mock_embed.assert_called_once_with("What is RAG?")
         mock_search.assert_called_once_with([0.1, 0.2, 0.3], "user-1")
-        mock_generate.assert_called_once_with("gemini-2.0-flash", "What is RAG?", mock_chunks)
+        mock_generate.assert_called_once_with("gemini-2.0-flash", "What is RAG?", build_context(mock_chunks))
+
+    @patch("query_processor.query_processor.evaluate_rag_metric")
+    def test_handler_evaluate_metric(self, mock_evaluate):
+        """Test the Lambda handler scoring a single evaluation metric."""
+        mock_evaluate.return_value = 0.8
+        
+        # Create an evaluate event for an existing answer
+        event = {
+            "body": json.dumps({
+                "operation": "evaluate",
+                "metric": "faithfulness",
+                "query": "What is RAG?",
+                "answer": "Retrieval-Augmented Generation.",
+                "contexts": ["RAG stands for Retrieval-Augmented Generation"],
+                "model_name": "gemini-2.0-flash"
+            })
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify results
+        self.assertEqual(response["statusCode"], 200)
+        response_body = json.loads(response["body"])
+        self.assertEqual(response_body, {"metric": "faithfulness", "score": 0.8})
+        mock_evaluate.assert_called_once_with(
+            "gemini-2.0-flash",
+            "faithfulness",
+            query="What is RAG?",
+            answer="Retrieval-Augmented Generation.",
+            contexts=["RAG stands for Retrieval-Augmented Generation"],
+            ground_truth=None
+        )
+
+    @patch("query_processor.query_processor.embed_query")
+    @patch("query_processor.query_processor.similarity_search")
+    @patch("query_processor.query_processor.generate_response")
+    def test_handler_query_projection(self, mock_generate, mock_search, mock_embed):
+        """Test that the handler returns only the projected chunk fields."""
+        mock_embed.return_value = [0.1, 0.2, 0.3]
+        mock_search.return_value = [
+            {
+                "chunk_id": "chunk-1",
+                "document_id": "doc-1",
+                "user_id": "user-1",
+                "content": "RAG stands for Retrieval-Augmented Generation",
+                "metadata": {"page": 1},
+                "file_name": "file1.pdf",
+                "similarity_score": 0.95
+            }
+        ]
+        mock_generate.return_value = "Retrieval-Augmented Generation."
+
+        # Create a query event asking for two fields
+        event = {
+            "body": json.dumps({
+                "query": "What is RAG?",
+                "user_id": "user-1",
+                "enable_evaluation": False,
+                "projection": ["file_name", "similarity_score"]
+            })
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify only the requested fields are returned
+        self.assertEqual(response["statusCode"], 200)
+        response_body = json.loads(response["body"])
+        self.assertEqual(response_body["results"], [{"file_name": "file1.pdf", "similarity_score": 0.95}])
+
+    @patch("query_processor.query_processor.embed_query")
+    @patch("query_processor.query_processor.similarity_search")
+    @patch("query_processor.query_processor.generate_response")
+    def test_handler_batch_queries(self, mock_generate, mock_search, mock_embed):
+        """Test the Lambda handler for a batch of queries with a per-item failure."""
+        # Fail embedding for the second query only
+        mock_embed.side_effect = [[0.1, 0.2, 0.3], Exception("Error embedding query")]
+        mock_search.return_value = []
+        mock_generate.return_value = "No relevant information found."
+
+        # Create a batch event
+        event = {
+            "body": json.dumps({
+                "queries": ["What is RAG?", "What is a vector?"],
+                "user_id": "user-1",
+                "model_name": "gemini-2.0-flash",
+                "enable_evaluation": False
+            })
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify results are positional with their own status
+        self.assertEqual(response["statusCode"], 200)
+        results = json.loads(response["body"])["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["status"], 200)
+        self.assertEqual(results[0]["data"]["query"], "What is RAG?")
+        self.assertEqual(results[1]["status"], 500)
+        self.assertIn("Error embedding query", results[1]["error"])
+
+    def test_handler_evaluate_requires_ground_truth(self):
+        """Test that context_precision evaluation requires a ground truth."""
+        # Create an evaluate event without ground truth
+        event = {
+            "body": json.dumps({
+                "operation": "evaluate",
+                "metric": "context_precision",
+                "query": "What is RAG?",
+                "answer": "Retrieval-Augmented Generation."
+            })
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify results
+        self.assertEqual(response["statusCode"], 400)
 
     @patch("query_processor.query_processor.embed_query")
     def test_handler_error_handling(self, mock_embed):
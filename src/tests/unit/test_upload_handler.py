@@ -1,4 +1,6 @@
 """Test cases for the upload_handler Lambda function."""
+import base64
+import gzip
 import json
 import os
 import unittest
@@ -326,6 +328,160 @@ class TestUploadHandler(unittest.TestCase):
         response_body = json.loads(response["body"])
         self.assertTrue("Error uploading file" in response_body["message"])
         
+    @patch("upload_handler.upload_handler.uuid.uuid4")
+    def test_handler_presign(self, mock_uuid):
+        """Test the Lambda handler issuing a presigned upload URL."""
+        # Mock UUID
+        mock_uuid.return_value = "test-doc-id"
+        self.mock_s3.generate_presigned_url.return_value = "https://s3.example/presigned"
+        
+        # Create a presign event without file content
+        event = {
+            "body": json.dumps({
+                "operation": "presign",
+                "file_name": "test.pdf",
+                "user_id": "test-user"
+            })
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify results
+        self.assertEqual(response["statusCode"], 200)
+        response_body = json.loads(response["body"])
+        self.assertEqual(response_body["document_id"], "test-doc-id")
+        self.assertEqual(response_body["presigned_url"], "https://s3.example/presigned")
+        self.assertEqual(response_body["mime_type"], "application/pdf")
+        
+        # Verify the URL is scoped to the document key and content type
+        self.mock_s3.generate_presigned_url.assert_called_once_with(
+            "put_object",
+            Params={
+                "Bucket": "test-bucket",
+                "Key": "uploads/test-user/test-doc-id/test.pdf",
+                "ContentType": "application/pdf"
+            },
+            ExpiresIn=900
+        )
+        self.mock_s3.put_object.assert_not_called()
+        self.mock_table.put_item.assert_not_called()
+
+    @patch("upload_handler.upload_handler.get_postgres_credentials")
+    @patch("upload_handler.upload_handler.get_postgres_connection")
+    def test_handler_finalize(self, mock_get_conn, mock_get_creds):
+        """Test the Lambda handler finalizing a presigned upload."""
+        # Mock PostgreSQL connection
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+        mock_get_creds.return_value = {"host": "test-host"}
+        
+        # Create a finalize event
+        event = {
+            "body": json.dumps({
+                "operation": "finalize",
+                "document_id": "test-doc-id",
+                "file_name": "test.pdf",
+                "user_id": "test-user"
+            })
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify results
+        self.assertEqual(response["statusCode"], 200)
+        response_body = json.loads(response["body"])
+        self.assertEqual(response_body["message"], "File uploaded successfully")
+        self.assertEqual(response_body["document_id"], "test-doc-id")
+        
+        # Verify the object was checked and metadata stored
+        self.mock_s3.head_object.assert_called_once_with(
+            Bucket="test-bucket",
+            Key="uploads/test-user/test-doc-id/test.pdf"
+        )
+        mock_cursor.execute.assert_called_once()
+        self.mock_table.put_item.assert_called_once()
+
+    def test_handler_finalize_missing_object(self):
+        """Test the Lambda handler finalizing an upload that never reached S3."""
+        # Mock S3 head_object to raise an exception
+        self.mock_s3.head_object.side_effect = Exception("Not Found")
+        
+        # Create a finalize event
+        event = {
+            "body": json.dumps({
+                "operation": "finalize",
+                "document_id": "test-doc-id",
+                "file_name": "test.pdf",
+                "user_id": "test-user"
+            })
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify results
+        self.assertEqual(response["statusCode"], 400)
+        response_body = json.loads(response["body"])
+        self.assertEqual(response_body["message"], "Uploaded file not found")
+        self.mock_table.put_item.assert_not_called()
+
+    @patch("upload_handler.upload_handler.uuid.uuid4")
+    def test_handler_gzip_body(self, mock_uuid):
+        """Test the Lambda handler with a gzip-compressed, base64-encoded body."""
+        # Mock UUID
+        mock_uuid.return_value = "test-doc-id"
+        
+        # Create an event the way API Gateway delivers a compressed binary payload
+        payload = json.dumps({
+            "file_content": "ZmlsZSBjb250ZW50",  # base64 "file content"
+            "file_name": "test.txt",
+            "user_id": "test-user"
+        }).encode("utf-8")
+        event = {
+            "headers": {"Content-Encoding": "gzip"},
+            "isBase64Encoded": True,
+            "body": base64.b64encode(gzip.compress(payload)).decode("ascii")
+        }
+
+        # Call the handler
+        response = handler(event, {})
+
+        # Verify results
+        self.assertEqual(response["statusCode"], 200)
+        self.mock_s3.put_object.assert_called_once_with(
+            Bucket="test-bucket",
+            Key="uploads/test-user/test-doc-id/test.txt",
+            Body=b"file content",
+            ContentType="text/plain"
+        )
+
+    def test_handler_invalid_gzip_body(self):
+        """Test that gzip bodies API Gateway decoded as text, or that fail to decompress, are rejected."""
+        compressed = gzip.compress(b'{"file_name": "test.txt"}')
+        events = [
+            {
+                "headers": {"Content-Encoding": "gzip"},
+                "body": compressed.decode("latin-1")
+            },
+            {
+                "headers": {"Content-Encoding": "gzip"},
+                "isBase64Encoded": True,
+                "body": base64.b64encode(b"not gzip").decode("ascii")
+            }
+        ]
+
+        for event in events:
+            # Call the handler
+            response = handler(event, {})
+
+            # Verify results
+            self.assertEqual(response["statusCode"], 400)
+        self.mock_s3.put_object.assert_not_called()
+
     def test_handler_json_decode_error(self):
         """Test the Lambda handler with invalid JSON in body."""
         # Create an event with invalid JSON
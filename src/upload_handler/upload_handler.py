@@ -7,6 +7,9 @@ import boto3
 import logging
 import uuid
 import base64
+import gzip
+import zlib
+import binascii
 import psycopg2
 from datetime import datetime
 
@@ -25,6 +28,7 @@ DOCUMENTS_BUCKET = os.environ.get('DOCUMENTS_BUCKET')
 METADATA_TABLE = os.environ.get('METADATA_TABLE')
 DB_SECRET_ARN = os.environ.get('DB_SECRET_ARN')
 STAGE = os.environ.get('STAGE')
+PRESIGNED_URL_EXPIRY = int(os.environ.get('PRESIGNED_URL_EXPIRY', '900'))
 
 def get_postgres_credentials():
     """
@@ -80,6 +84,218 @@ def get_mime_type(file_name):
     return mime_types.get(file_extension, 'application/octet-stream')
 
 
+def decode_request_body(event):
+    """
+    Return the raw request body, inflating it if the client sent it gzip-compressed.
+    
+    Args:
+        event (dict): API Gateway proxy event with a string body
+        
+    Returns:
+        str: Request body text
+        
+    Raises:
+        ValueError: If a gzip body is not base64 encoded or cannot be decompressed
+    """
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if headers.get('content-encoding') != 'gzip':
+        return event['body']
+    
+    # Compressed bytes only survive API Gateway when it treats the request as binary
+    # (Content-Type application/gzip) and passes the body base64 encoded; a text body
+    # has already been decoded as UTF-8 and cannot be recovered
+    if not event.get('isBase64Encoded'):
+        raise ValueError('Gzip request bodies must be sent with Content-Type application/gzip')
+    try:
+        return gzip.decompress(base64.b64decode(event['body'])).decode('utf-8')
+    except (binascii.Error, OSError, EOFError, zlib.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid gzip request body: {str(e)}")
+
+
+def build_s3_key(user_id, document_id, file_name):
+    """
+    Build the S3 key a document is stored under.
+    """
+    return f"uploads/{user_id}/{document_id}/{file_name}"
+
+
+def store_document_metadata(document_id, user_id, file_name, mime_type, s3_key):
+    """
+    Record an uploaded document in PostgreSQL and DynamoDB.
+    
+    Args:
+        document_id (str): Document ID
+        user_id (str): Owner of the document
+        file_name (str): Original file name
+        mime_type (str): MIME type of the file
+        s3_key (str): S3 key of the stored object
+    """
+    # Store initial metadata in PostgreSQL
+    try:
+        # Get PostgreSQL credentials
+        credentials = get_postgres_credentials()
+        conn = get_postgres_connection(credentials)
+        cursor = conn.cursor()
+        
+        # Insert document record
+        cursor.execute("""
+            INSERT INTO documents (document_id, user_id, file_name, mime_type, status, bucket, key, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+            document_id,
+            user_id,
+            file_name,
+            mime_type,
+            'uploaded',
+            DOCUMENTS_BUCKET,
+            s3_key,
+            datetime.now(),
+            datetime.now()
+        ))
+        
+        # Commit the transaction
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+    except Exception as e:
+        logger.error(f"Error storing metadata in PostgreSQL: {str(e)}")
+        # Continue with DynamoDB as fallback
+    
+    # Store metadata in DynamoDB
+    metadata_table = dynamodb.Table(METADATA_TABLE)
+    metadata_table.put_item(
+        Item={
+            'id': f"doc#{document_id}",
+            'document_id': document_id,
+            'user_id': user_id,
+            'file_name': file_name,
+            'mime_type': mime_type,
+            'status': 'uploaded',
+            'bucket': DOCUMENTS_BUCKET,
+            'key': s3_key,
+            'created_at': int(datetime.now().timestamp() * 1000),
+            'updated_at': int(datetime.now().timestamp() * 1000)
+        }
+    )
+
+
+def create_presigned_upload(body):
+    """
+    Issue a presigned S3 PUT URL so the client can send the raw file directly to S3.
+    
+    Args:
+        body (dict): Request body with file_name, mime_type and user_id
+        
+    Returns:
+        dict: Response with status code and body
+    """
+    file_name = body.get('file_name', '')
+    user_id = body.get('user_id', 'system')
+    
+    if not file_name:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'message': 'File name is required'
+            })
+        }
+    
+    mime_type = body.get('mime_type') or get_mime_type(file_name)
+    document_id = str(uuid.uuid4())
+    s3_key = build_s3_key(user_id, document_id, file_name)
+    
+    presigned_url = s3_client.generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': DOCUMENTS_BUCKET,
+            'Key': s3_key,
+            'ContentType': mime_type
+        },
+        ExpiresIn=PRESIGNED_URL_EXPIRY
+    )
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'document_id': document_id,
+            'file_name': file_name,
+            'mime_type': mime_type,
+            'presigned_url': presigned_url,
+            'expires_in': PRESIGNED_URL_EXPIRY
+        })
+    }
+
+
+def finalize_presigned_upload(body):
+    """
+    Record metadata for a file the client has already PUT to its presigned URL.
+    
+    Args:
+        body (dict): Request body with document_id, file_name, mime_type and user_id
+        
+    Returns:
+        dict: Response with status code and body
+    """
+    document_id = body.get('document_id', '')
+    file_name = body.get('file_name', '')
+    user_id = body.get('user_id', 'system')
+    
+    if not document_id or not file_name:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'message': 'Document ID and file name are required'
+            })
+        }
+    
+    mime_type = body.get('mime_type') or get_mime_type(file_name)
+    s3_key = build_s3_key(user_id, document_id, file_name)
+    
+    # Make sure the client actually completed the PUT
+    try:
+        s3_client.head_object(Bucket=DOCUMENTS_BUCKET, Key=s3_key)
+    except Exception as e:
+        logger.error(f"Uploaded object {s3_key} not found: {str(e)}")
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'message': 'Uploaded file not found'
+            })
+        }
+    
+    store_document_metadata(document_id, user_id, file_name, mime_type, s3_key)
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'message': 'File uploaded successfully',
+            'document_id': document_id,
+            'file_name': file_name
+        })
+    }
+
+
 def handler(event, context):
     """
     Lambda function to handle document uploads.
@@ -99,9 +315,20 @@ def handler(event, context):
         if 'body' in event:
             if isinstance(event.get('body'), str) and event.get('body'):
                 try:
-                    body = json.loads(event['body'])
+                    body = json.loads(decode_request_body(event))
                 except json.JSONDecodeError:
                     body = {}
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({
+                            'message': str(e)
+                        })
+                    }
             elif isinstance(event.get('body'), dict):
                 body = event.get('body')
                 
@@ -119,6 +346,13 @@ def handler(event, context):
                 })
             }
         
+        # Presigned upload flow: issue the URL, then record metadata once the PUT is done
+        operation = body.get('operation')
+        if operation == 'presign':
+            return create_presigned_upload(body)
+        if operation == 'finalize':
+            return finalize_presigned_upload(body)
+        
         # Extract file data and metadata
         file_content_base64 = body.get('file_content', '')
         file_name = body.get('file_name', '')
@@ -148,7 +382,7 @@ def handler(event, context):
         document_id = str(uuid.uuid4())
         
         # Upload file to S3
-        s3_key = f"uploads/{user_id}/{document_id}/{file_name}"
+        s3_key = build_s3_key(user_id, document_id, file_name)
         s3_client.put_object(
             Bucket=DOCUMENTS_BUCKET,
             Key=s3_key,
@@ -156,54 +390,7 @@ def handler(event, context):
             ContentType=mime_type
         )
         
-        # Store initial metadata in PostgreSQL
-        try:
-            # Get PostgreSQL credentials
-            credentials = get_postgres_credentials()
-            conn = get_postgres_connection(credentials)
-            cursor = conn.cursor()
-            
-            # Insert document record
-            cursor.execute("""
-            INSERT INTO documents (document_id, user_id, file_name, mime_type, status, bucket, key, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                document_id,
-                user_id,
-                file_name,
-                mime_type,
-                'uploaded',
-                DOCUMENTS_BUCKET,
-                s3_key,
-                datetime.now(),
-                datetime.now()
-            ))
-            
-            # Commit the transaction
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-        except Exception as e:
-            logger.error(f"Error storing metadata in PostgreSQL: {str(e)}")
-            # Continue with DynamoDB as fallback
-        
-        # Store metadata in DynamoDB
-        metadata_table = dynamodb.Table(METADATA_TABLE)
-        metadata_table.put_item(
-            Item={
-                'id': f"doc#{document_id}",
-                'document_id': document_id,
-                'user_id': user_id,
-                'file_name': file_name,
-                'mime_type': mime_type,
-                'status': 'uploaded',
-                'bucket': DOCUMENTS_BUCKET,
-                'key': s3_key,
-                'created_at': int(datetime.now().timestamp() * 1000),
-                'updated_at': int(datetime.now().timestamp() * 1000)
-            }
-        )
+        store_document_metadata(document_id, user_id, file_name, mime_type, s3_key)
         
         # Return success response
         return {